@@ -0,0 +1,797 @@
+"""A local, in-memory stand-in for the girder REST api.
+
+Only the routes that are used by the multiscale client are implemented:
+authentication, /user/me, /folder, /item, /file (chunked uploads and
+downloads), /job and /multiscale/*. The server can add a fixed latency
+to every request and limit the bandwidth of request and response
+bodies, and it counts the requests that it receives so that the
+benchmarks can report them.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import json
+import re
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+API_ROOT = '/api/v1'
+API_KEY = 'benchmark-api-key'
+
+# Job status codes, as in girder's jobs plugin
+INACTIVE = 0
+RUNNING = 2
+SUCCESS = 3
+CANCELED = 5
+
+CALCULATION_ROUTES = {
+    'run_albany': 'albany',
+    'run_dream3d': 'dream3d',
+    'run_smtk_mesh_placement': 'smtk'
+}
+
+# The number of records returned by list routes without a limit
+DEFAULT_LIMIT = 50
+
+
+class RestError(Exception):
+    """An error that is returned to the client with a status code."""
+
+    def __init__(self, status, message):
+        """Initialize with the http status and an error message."""
+        super(RestError, self).__init__(message)
+        self.status = status
+
+
+def isoTime(dt):
+    """Format a naive UTC datetime the way girder does."""
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%f') + '+00:00'
+
+
+def parseIsoTime(value):
+    """Parse a time formatted by isoTime()."""
+    return datetime.strptime(value[:-len('+00:00')], '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def isTrue(value):
+    """Interpret a boolean query parameter."""
+    return str(value).lower() == 'true'
+
+
+class MockGirder(object):
+    """The in-memory state of the mock server and its route handlers.
+
+    Ids are increasing hexadecimal strings, so sorting jobs by id sorts
+    them by creation time, as with mongo object ids.
+    """
+
+    def __init__(self):
+        """Initialize an empty server with a single user."""
+        self.lock = threading.RLock()
+        self._lastId = 0
+        self.tokens = set()
+        self.user = {'_id': self.newId(), 'login': 'benchmark',
+                     '_modelType': 'user'}
+
+        self.folders = {}
+        self.items = {}
+        self.files = {}
+        self.fileData = {}
+        self.uploads = {}
+        self.jobs = OrderedDict()
+
+        # Children of each folder, and items of each folder and files of
+        # each item, in creation order
+        self.childFolders = {}
+        self.folderItems = {}
+        self.itemFiles = {}
+        # (parentId, name) to folder id
+        self.folderNames = {}
+
+        self.routes = [
+            ('POST', ('api_key', 'token'), self.createToken),
+            ('GET', ('user', 'me'), self.getMe),
+            ('GET', ('folder', ), self.listFolders),
+            ('POST', ('folder', ), self.createFolderRoute),
+            ('GET', ('folder', ':id'), self.getFolder),
+            ('DELETE', ('folder', ':id'), self.deleteFolderRoute),
+            ('GET', ('item', ), self.listItems),
+            ('POST', ('item', ), self.createItemRoute),
+            ('GET', ('item', ':id'), self.getItem),
+            ('GET', ('item', ':id', 'files'), self.listFiles),
+            ('POST', ('file', ), self.initUpload),
+            ('POST', ('file', 'chunk'), self.uploadChunk),
+            ('GET', ('file', 'offset'), self.uploadOffset),
+            ('GET', ('file', ':id'), self.getFile),
+            ('GET', ('file', ':id', 'download'), self.downloadFile),
+            ('GET', ('job', ), self.listAllJobs),
+            ('GET', ('job', ':id'), self.getJob),
+            ('PUT', ('job', ':id', 'cancel'), self.cancelJob),
+            ('DELETE', ('job', ':id'), self.deleteJob),
+            ('GET', ('multiscale', 'jobs'), self.listMultiscaleJobs),
+            ('GET', ('multiscale', 'queue'), self.getQueue),
+            ('GET', ('multiscale', 'jobs', ':id', 'progress'),
+             self.getJobProgress),
+            ('GET', ('multiscale', 'jobs', ':id', 'summary'),
+             self.getJobSummary),
+            ('POST', ('multiscale', ':calculation'), self.runCalculation)
+        ]
+
+    def newId(self):
+        """Get a new unique id."""
+        with self.lock:
+            self._lastId += 1
+            return '%024x' % self._lastId
+
+    # Dispatching
+
+    def dispatch(self, method, segments, params, body):
+        """Find the handler of a request and call it.
+
+        The client sends some ids as query parameters with a literal
+        '{id}' path element (e.g. '/job/{id}?id=...'), so such path
+        elements are replaced by the 'id' parameter.
+
+        Returns the route name (for counting) and the handler result.
+        """
+        segments = [params.get('id', s) if s == '{id}' else s
+                    for s in segments]
+        for routeMethod, pattern, handler in self.routes:
+            if routeMethod != method or len(pattern) != len(segments):
+                continue
+
+            wildcards = {}
+            for part, segment in zip(pattern, segments):
+                if part.startswith(':'):
+                    wildcards[part[1:]] = segment
+                elif part != segment:
+                    break
+            else:
+                routeName = method + ' ' + '/'.join(pattern)
+                kwargs = dict(params)
+                kwargs.update(wildcards)
+                return routeName, handler(body=body, **kwargs)
+
+        raise RestError(404, 'No matching route: %s /%s' %
+                        (method, '/'.join(segments)))
+
+    def checkToken(self, token):
+        """Check that a request is authenticated."""
+        if token not in self.tokens:
+            raise RestError(401, 'You must be logged in.')
+
+    @staticmethod
+    def page(records, limit=None, offset=None, **kwargs):
+        """Get a page of a list of records."""
+        offset = int(offset or 0)
+        limit = int(limit if limit is not None else DEFAULT_LIMIT)
+        if limit <= 0:
+            return records[offset:]
+        return records[offset:offset + limit]
+
+    def _lookup(self, collection, name, id):
+        """Get a document by id, or raise a 400 error like girder."""
+        doc = collection.get(id)
+        if doc is None:
+            raise RestError(400, 'Invalid %s id (%s).' % (name, id))
+        return doc
+
+    # Authentication and users
+
+    def createToken(self, key=None, body=None, **kwargs):
+        """Exchange the api key for a token."""
+        if key != API_KEY:
+            raise RestError(400, 'Invalid API key.')
+
+        token = uuid.uuid4().hex
+        self.tokens.add(token)
+        expires = datetime.utcnow() + timedelta(days=180)
+        return {'authToken': {'token': token, 'expires': isoTime(expires)}}
+
+    def getMe(self, **kwargs):
+        """Get the current user."""
+        return self.user
+
+    # Folders
+
+    def createFolder(self, parentId, name, parentType='folder',
+                     reuseExisting=False):
+        """Create a folder, or reuse an existing one with the same name."""
+        with self.lock:
+            existingId = self.folderNames.get((parentId, name))
+            if existingId is not None:
+                if reuseExisting:
+                    return self.folders[existingId]
+                raise RestError(400, 'A folder with that name already '
+                                     'exists here.')
+
+            now = isoTime(datetime.utcnow())
+            folder = {
+                '_id': self.newId(),
+                '_modelType': 'folder',
+                'name': name,
+                'parentId': parentId,
+                'parentCollection': parentType,
+                'created': now,
+                'updated': now
+            }
+            self.folders[folder['_id']] = folder
+            self.folderNames[(parentId, name)] = folder['_id']
+            self.childFolders.setdefault(parentId, OrderedDict())[
+                folder['_id']] = True
+            return folder
+
+    def deleteFolder(self, folderId):
+        """Delete a folder along with its contents."""
+        with self.lock:
+            folder = self.folders.pop(folderId)
+            for childId in list(self.childFolders.pop(folderId, {})):
+                self.deleteFolder(childId)
+            for itemId in self.folderItems.pop(folderId, {}):
+                self.items.pop(itemId, None)
+                for fileId in self.itemFiles.pop(itemId, {}):
+                    self.files.pop(fileId, None)
+                    self.fileData.pop(fileId, None)
+            self.childFolders.get(folder['parentId'], {}).pop(folderId, None)
+            self.folderNames.pop((folder['parentId'], folder['name']), None)
+
+    def listFolders(self, parentId=None, parentType='folder', name=None,
+                    **kwargs):
+        """List the folders in a parent."""
+        with self.lock:
+            folders = [self.folders[x]
+                       for x in self.childFolders.get(parentId, {})]
+        if name is not None:
+            folders = [x for x in folders if x['name'] == name]
+        return MockGirder.page(folders, **kwargs)
+
+    def createFolderRoute(self, parentId, name, parentType='folder',
+                          reuseExisting=False, **kwargs):
+        """Create a folder."""
+        return self.createFolder(parentId, name, parentType,
+                                 isTrue(reuseExisting))
+
+    def getFolder(self, id, **kwargs):
+        """Get a folder."""
+        return self._lookup(self.folders, 'folder', id)
+
+    def deleteFolderRoute(self, id, **kwargs):
+        """Delete a folder."""
+        folder = self._lookup(self.folders, 'folder', id)
+        self.deleteFolder(id)
+        return {'message': 'Deleted folder %s.' % folder['name']}
+
+    # Items and files
+
+    def createItem(self, folderId, name, reuseExisting=False):
+        """Create an item, or reuse an existing one with the same name."""
+        with self.lock:
+            self._lookup(self.folders, 'folder', folderId)
+            items = self.folderItems.setdefault(folderId, OrderedDict())
+            if reuseExisting:
+                for itemId in items:
+                    if self.items[itemId]['name'] == name:
+                        return self.items[itemId]
+
+            now = isoTime(datetime.utcnow())
+            item = {
+                '_id': self.newId(),
+                '_modelType': 'item',
+                'name': name,
+                'folderId': folderId,
+                'created': now,
+                'updated': now,
+                'size': 0
+            }
+            self.items[item['_id']] = item
+            items[item['_id']] = True
+            return item
+
+    def createFile(self, itemId, name, data):
+        """Create a file in an item."""
+        with self.lock:
+            item = self._lookup(self.items, 'item', itemId)
+            fileDoc = {
+                '_id': self.newId(),
+                '_modelType': 'file',
+                'name': name,
+                'itemId': itemId,
+                'size': len(data),
+                'created': isoTime(datetime.utcnow())
+            }
+            self.files[fileDoc['_id']] = fileDoc
+            self.fileData[fileDoc['_id']] = data
+            self.itemFiles.setdefault(itemId, OrderedDict())[
+                fileDoc['_id']] = True
+            item['size'] += len(data)
+            return fileDoc
+
+    def listItems(self, folderId=None, name=None, **kwargs):
+        """List the items in a folder."""
+        with self.lock:
+            items = [self.items[x] for x in self.folderItems.get(folderId, {})]
+        if name is not None:
+            items = [x for x in items if x['name'] == name]
+        return MockGirder.page(items, **kwargs)
+
+    def createItemRoute(self, folderId, name, reuseExisting=False, **kwargs):
+        """Create an item."""
+        return self.createItem(folderId, name, isTrue(reuseExisting))
+
+    def getItem(self, id, **kwargs):
+        """Get an item."""
+        return self._lookup(self.items, 'item', id)
+
+    def listFiles(self, id, **kwargs):
+        """List the files in an item."""
+        with self.lock:
+            self._lookup(self.items, 'item', id)
+            files = [self.files[x] for x in self.itemFiles.get(id, {})]
+        return MockGirder.page(files, **kwargs)
+
+    def initUpload(self, parentId, name, size, parentType='item', **kwargs):
+        """Start an upload into an item."""
+        size = int(size)
+        if size == 0:
+            return self.createFile(parentId, name, b'')
+
+        upload = {
+            '_id': self.newId(),
+            '_modelType': 'upload',
+            'parentId': parentId,
+            'name': name,
+            'size': size,
+            'received': 0
+        }
+        with self.lock:
+            self._lookup(self.items, 'item', parentId)
+            self.uploads[upload['_id']] = {'doc': upload, 'chunks': []}
+        return upload
+
+    def uploadChunk(self, uploadId, offset, body=b'', **kwargs):
+        """Receive the next chunk of an upload."""
+        with self.lock:
+            upload = self._lookup(self.uploads, 'upload', uploadId)
+            doc = upload['doc']
+            if int(offset) != doc['received']:
+                raise RestError(400, 'Server has received %d bytes, but '
+                                     'client sent offset %s.' %
+                                (doc['received'], offset))
+
+            upload['chunks'].append(body)
+            doc['received'] += len(body)
+            if doc['received'] < doc['size']:
+                return doc
+
+            del self.uploads[uploadId]
+        return self.createFile(doc['parentId'], doc['name'],
+                               b''.join(upload['chunks']))
+
+    def uploadOffset(self, uploadId, **kwargs):
+        """Get how many bytes of an upload have been received."""
+        upload = self._lookup(self.uploads, 'upload', uploadId)
+        return {'offset': upload['doc']['received']}
+
+    def getFile(self, id, **kwargs):
+        """Get a file."""
+        return self._lookup(self.files, 'file', id)
+
+    def downloadFile(self, id, **kwargs):
+        """Get the contents of a file as bytes."""
+        self._lookup(self.files, 'file', id)
+        return self.fileData[id]
+
+    # Jobs
+
+    def createJob(self, calculationType, inputFolderId, outputFolderId,
+                  status=INACTIVE, runSeconds=None):
+        """Create a multiscale job.
+
+        If 'runSeconds' is given, the job gets timestamps and run time
+        fields as if it had run for that long and ended with 'status'.
+        """
+        now = datetime.utcnow()
+        job = {
+            '_id': self.newId(),
+            '_modelType': 'job',
+            'title': 'docker_run',
+            'type': 'celery',
+            'userId': self.user['_id'],
+            'status': status,
+            'created': isoTime(now),
+            'updated': isoTime(now),
+            'timestamps': [],
+            'runStarted': None,
+            'runEnded': None,
+            'wallSeconds': None,
+            'log': [],
+            'meta': {
+                'multiscale_settings': {
+                    'inputFolderId': inputFolderId,
+                    'outputFolderId': outputFolderId,
+                    'calculationType': calculationType
+                }
+            }
+        }
+        if runSeconds is not None:
+            job['log'] = ['Running the calculation...\n', 'Done.\n']
+            job['timestamps'] = [
+                {'status': RUNNING,
+                 'time': isoTime(now - timedelta(seconds=runSeconds))},
+                {'status': status, 'time': isoTime(now)}
+            ]
+            job['runStarted'] = job['timestamps'][0]['time']
+            job['runEnded'] = job['timestamps'][1]['time']
+            job['wallSeconds'] = float(runSeconds)
+
+        with self.lock:
+            self.jobs[job['_id']] = job
+        return job
+
+    @staticmethod
+    def project(job, fields):
+        """Keep only the requested fields of a job."""
+        if not fields:
+            return dict((k, v) for k, v in job.items() if k != 'log')
+        return dict((k, v) for k, v in job.items()
+                    if k in fields or k == '_id')
+
+    def listAllJobs(self, limit=None, offset=None, **kwargs):
+        """List all of the jobs of the user, newest first."""
+        with self.lock:
+            jobs = [MockGirder.project(x, None)
+                    for x in reversed(self.jobs.values())]
+        return MockGirder.page(jobs, limit=limit, offset=offset)
+
+    def getJob(self, id, **kwargs):
+        """Get a job."""
+        return self._lookup(self.jobs, 'job', id)
+
+    def cancelJob(self, id, **kwargs):
+        """Cancel a job."""
+        with self.lock:
+            job = self._lookup(self.jobs, 'job', id)
+            now = isoTime(datetime.utcnow())
+            job['status'] = CANCELED
+            job['updated'] = now
+            job['timestamps'].append({'status': CANCELED, 'time': now})
+            if job['runStarted'] and not job['runEnded']:
+                job['runEnded'] = now
+                job['wallSeconds'] = (parseIsoTime(now) - parseIsoTime(
+                    job['runStarted'])).total_seconds()
+        return job
+
+    def deleteJob(self, id, **kwargs):
+        """Delete a job."""
+        with self.lock:
+            self._lookup(self.jobs, 'job', id)
+            del self.jobs[id]
+        return {'message': 'Deleted job %s.' % id}
+
+    def getJobSummary(self, id, **kwargs):
+        """Get the output summary of a job."""
+        job = self._lookup(self.jobs, 'job', id)
+        return job['meta'].get('multiscale_summary')
+
+    def getQueue(self, calculationType=None, count='1', **kwargs):
+        """Estimate the wait times of new jobs, with a single worker."""
+        count = int(count)
+        counts = OrderedDict()
+        wallSeconds = {}
+        for job in list(self.jobs.values()):
+            calcType = job['meta']['multiscale_settings']['calculationType']
+            if job['status'] in (INACTIVE, RUNNING):
+                entry = counts.setdefault(calcType, {
+                    'calculationType': calcType,
+                    'queue': 'celery',
+                    'queued': 0,
+                    'running': 0
+                })
+                entry['running' if job['status'] == RUNNING else
+                      'queued'] += 1
+            elif job['status'] == SUCCESS and len(job['timestamps']) > 1:
+                start, end = [parseIsoTime(x['time'])
+                              for x in job['timestamps'][:2]]
+                wallSeconds.setdefault(calcType, []).append(
+                    (end - start).total_seconds())
+
+        estimates = []
+        for calcType in sorted(set(CALCULATION_ROUTES.values())):
+            if calculationType and calcType != calculationType:
+                continue
+            seconds = sorted(wallSeconds.get(calcType, []))
+            median = seconds[len(seconds) // 2] if seconds else None
+            estimates.append({
+                'calculationType': calcType,
+                'count': count,
+                'medianWallSeconds': median,
+                'samples': len(seconds),
+                'estimatedWaitSeconds': 0.0 if seconds else None,
+                'estimatedFinishSeconds': (median * count if seconds else
+                                           None)
+            })
+
+        return {
+            'time': isoTime(datetime.utcnow()),
+            'queues': list(counts.values()),
+            'estimates': estimates
+        }
+
+    def getJobProgress(self, id, **kwargs):
+        """Get the status and the progress of a job, as the plugin does."""
+        job = self._lookup(self.jobs, 'job', id)
+        progress = job.get('progress') or {}
+        message = progress.get('message') or ''
+        return {
+            '_id': job['_id'],
+            'status': job['status'],
+            'updated': job.get('updated'),
+            'stage': message.split(':', 1)[0].strip() or None,
+            'message': message,
+            'current': progress.get('current'),
+            'total': progress.get('total')
+        }
+
+    def listMultiscaleJobs(self, statuses=None, calculationType=None,
+                           createdSince=None, createdBefore=None,
+                           updatedSince=None, updatedBefore=None,
+                           cursor=None, limit=100, fields=None, **kwargs):
+        """List a filtered page of multiscale jobs, as the plugin does."""
+        limit = int(limit)
+        statuses = set(json.loads(statuses)) if statuses else None
+        fields = json.loads(fields) if fields else None
+
+        def dateKey(value):
+            # Compare dates as strings, with the time zone stripped
+            return re.sub(r'(\+00:00|Z)$', '', value) if value else None
+
+        ranges = (('created', dateKey(createdSince), dateKey(createdBefore)),
+                  ('updated', dateKey(updatedSince), dateKey(updatedBefore)))
+
+        page = []
+        with self.lock:
+            for job in reversed(self.jobs.values()):
+                if cursor and job['_id'] >= cursor:
+                    continue
+                settings = job['meta'].get('multiscale_settings')
+                if settings is None:
+                    continue
+                if statuses is not None and job['status'] not in statuses:
+                    continue
+                if (calculationType and
+                        settings.get('calculationType') != calculationType):
+                    continue
+                if any((since and dateKey(job[field]) < since) or
+                       (before and dateKey(job[field]) >= before)
+                       for field, since, before in ranges):
+                    continue
+
+                page.append(MockGirder.project(job, fields))
+                if len(page) > limit:
+                    break
+
+        nextCursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            nextCursor = page[-1]['_id']
+
+        return {'jobs': page, 'cursor': nextCursor}
+
+    def runCalculation(self, calculation, body=b'', inputFolderId=None,
+                       outputFolderId=None, **kwargs):
+        """Create one job, or a batch of jobs, for a calculation."""
+        batch = calculation.endswith('_batch')
+        route = calculation[:-len('_batch')] if batch else calculation
+        if route not in CALCULATION_ROUTES:
+            raise RestError(404, 'No matching route: multiscale/' +
+                            calculation)
+
+        calcType = CALCULATION_ROUTES[route]
+        if not batch:
+            return self.createJob(calcType, inputFolderId, outputFolderId)
+
+        folders = json.loads(body.decode('utf-8'))
+        return [self.createJob(calcType, x['inputFolderId'],
+                               x['outputFolderId'])['_id']
+                for x in folders]
+
+    # Seeding
+
+    def seedJobs(self, count, filesPerJob=1, fileSize=1024,
+                 status=SUCCESS, calculationType='albany'):
+        """Create 'count' finished multiscale jobs with their folders.
+
+        Each job gets a 'multiscale_data/job_<n>' folder with an input
+        and an output folder, and 'filesPerJob' output files of
+        'fileSize' bytes. The file contents are shared to save memory.
+
+        Returns the list of job ids.
+        """
+        base = self.createFolder(self.user['_id'], 'multiscale_data',
+                                 parentType='user', reuseExisting=True)
+        data = b'x' * fileSize
+        jobIds = []
+        for i in range(1, count + 1):
+            working = self.createFolder(base['_id'], 'job_' + str(i))
+            inputFolder = self.createFolder(working['_id'], 'input')
+            outputFolder = self.createFolder(working['_id'], 'output')
+            for j in range(filesPerJob):
+                item = self.createItem(outputFolder['_id'],
+                                       'output_%d.exo' % j)
+                self.createFile(item['_id'], item['name'], data)
+
+            job = self.createJob(calculationType, inputFolder['_id'],
+                                 outputFolder['_id'], status=status,
+                                 runSeconds=60 + i % 3600)
+            jobIds.append(job['_id'])
+
+        return jobIds
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """An http server that handles each connection in a thread."""
+
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Translate http requests into MockGirder.dispatch() calls."""
+
+    protocol_version = 'HTTP/1.1'
+    # Responses are written in several sends (headers, then body). With
+    # keep-alive connections, Nagle's algorithm would hold back each
+    # body until the client's delayed ACK, about 40 ms per request.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """Keep quiet."""
+        pass
+
+    def do_GET(self):
+        """Handle a GET request."""
+        self._handle('GET')
+
+    def do_POST(self):
+        """Handle a POST request."""
+        self._handle('POST')
+
+    def do_PUT(self):
+        """Handle a PUT request."""
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        """Handle a DELETE request."""
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        """Dispatch a request and send the response."""
+        server = self.server.mock
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for k, v in
+                      parse_qs(url.query, keep_blank_values=True).items())
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        path = url.path
+        if path.startswith(API_ROOT):
+            path = path[len(API_ROOT):]
+        segments = [unquote(x) for x in path.split('/') if x]
+
+        server.throttle(len(body), addLatency=True)
+        routeName = method + ' ' + '/'.join(segments)
+        try:
+            if segments != ['api_key', 'token']:
+                server.girder.checkToken(self.headers.get('Girder-Token'))
+            routeName, result = server.girder.dispatch(method, segments,
+                                                       params, body)
+            status = 200
+        except RestError as e:
+            status = e.status
+            result = {'message': str(e), 'type': 'rest'}
+        except (KeyError, TypeError, ValueError) as e:
+            status = 400
+            result = {'message': 'Bad request: %r' % e, 'type': 'rest'}
+
+        if isinstance(result, bytes):
+            payload = result
+            contentType = 'application/octet-stream'
+        else:
+            payload = json.dumps(result).encode('utf-8')
+            contentType = 'application/json'
+
+        server.throttle(len(payload))
+        server.count(routeName, status, len(body), len(payload))
+
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MockGirderServer(object):
+    """Serve a MockGirder over http on a local port.
+
+    'latency' is the time in seconds added to every request, and
+    'bandwidth' is the number of bytes per second at which request and
+    response bodies are transferred (None for unlimited).
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, host='127.0.0.1',
+                 port=0):
+        """Create the server. Call start() to start serving."""
+        self.girder = MockGirder()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._countLock = threading.Lock()
+        self.resetCounts()
+
+        self.httpd = _ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def apiUrl(self):
+        """Get the api url of the server."""
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d%s' % (host, port, API_ROOT)
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def throttle(self, numBytes, addLatency=False):
+        """Wait for the bytes to be transferred, and for the latency."""
+        delay = self.latency if addLatency else 0.0
+        if numBytes and self.bandwidth:
+            delay += float(numBytes) / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def count(self, routeName, status, bytesIn, bytesOut):
+        """Count a request."""
+        with self._countLock:
+            self.counts['requests'] += 1
+            self.counts['bytesIn'] += bytesIn
+            self.counts['bytesOut'] += bytesOut
+            routes = self.counts['routes']
+            routes[routeName] = routes.get(routeName, 0) + 1
+            if status >= 400:
+                self.counts['errors'] += 1
+
+    def resetCounts(self):
+        """Reset the request counts and return the previous ones."""
+        with self._countLock:
+            counts = getattr(self, 'counts', None)
+            self.counts = {
+                'requests': 0,
+                'errors': 0,
+                'bytesIn': 0,
+                'bytesOut': 0,
+                'routes': {}
+            }
+        return counts
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+"""
+Multiscale client benchmarks.
+
+Runs the multiscale-client commands against a local mock girder server
+that has been seeded with a given number of jobs, and reports the wall
+time and the number of requests of each command as JSON.
+
+See --help for options.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+from mock_girder import API_KEY, MockGirderServer
+
+CLIENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SCALES = [10, 100, 1000, 10000]
+
+# Bumped whenever the layout of the results changes
+RESULTS_VERSION = 1
+
+
+def clientEnvironment(server, homeDir):
+    """Get the environment for running the client against the server.
+
+    The home directory is replaced so that the local job index, the
+    token cache and the upload state start out empty.
+    """
+    env = dict(os.environ)
+    env['HOME'] = homeDir
+    env['USERPROFILE'] = homeDir
+    env['MULTISCALE_API_URL'] = server.apiUrl
+    env['MULTISCALE_API_KEY'] = API_KEY
+    env['PYTHONPATH'] = os.pathsep.join(
+        [CLIENT_DIR] + [x for x in [env.get('PYTHONPATH')] if x])
+    return env
+
+
+def runCommand(server, scale, operation, args, env, cwd, answer=None,
+               clientArgs=None):
+    """Run one client command and measure it.
+
+    'answer' is written to the standard input of the command (e.g. to
+    confirm a deletion). Returns a dictionary with the results.
+    """
+    command = ([sys.executable, '-m', 'multiscale_client.client'] +
+               list(clientArgs or []) + list(args))
+    server.resetCounts()
+
+    start = time.time()
+    proc = subprocess.Popen(command, env=env, cwd=cwd,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = proc.communicate(answer.encode('utf-8') if answer else None)[0]
+    wallSeconds = time.time() - start
+
+    counts = server.resetCounts()
+    result = {
+        'scale': scale,
+        'operation': operation,
+        'wallSeconds': wallSeconds,
+        'returncode': proc.returncode,
+        'requests': counts['requests'],
+        'errors': counts['errors'],
+        'bytesSent': counts['bytesIn'],
+        'bytesReceived': counts['bytesOut'],
+        'routes': counts['routes']
+    }
+    if proc.returncode != 0:
+        # Keep the end of the output to help find out what went wrong
+        result['outputTail'] = output.decode('utf-8', 'replace')[-2000:]
+
+    return result
+
+
+def createInputs(directory, numFiles, fileSize):
+    """Create the input files that are uploaded by the submit benchmark."""
+    os.makedirs(directory)
+    for i in range(numFiles):
+        with open(os.path.join(directory, 'input_%d.dat' % i), 'wb') as wf:
+            wf.write(os.urandom(fileSize))
+
+
+def benchmarkScale(scale, args):
+    """Run all of the benchmarks against a server with 'scale' jobs.
+
+    The server is seeded with one job less than 'scale' so that it
+    holds exactly 'scale' jobs after the submit benchmark.
+    """
+    bandwidth = args.bandwidth * 1024 ** 2 if args.bandwidth else None
+    server = MockGirderServer(latency=args.latency / 1000.0,
+                              bandwidth=bandwidth).start()
+    tmpDir = tempfile.mkdtemp(prefix='multiscale_benchmark_')
+    try:
+        jobIds = server.girder.seedJobs(scale - 1,
+                                        filesPerJob=args.output_files,
+                                        fileSize=args.output_size)
+        homeDir = os.path.join(tmpDir, 'home')
+        workDir = os.path.join(tmpDir, 'work')
+        inputDir = os.path.join(tmpDir, 'inputs')
+        os.makedirs(homeDir)
+        os.makedirs(workDir)
+        createInputs(inputDir, args.input_files, args.input_size)
+
+        env = clientEnvironment(server, homeDir)
+        clientArgs = ['--no-token-cache'] if args.no_token_cache else []
+        jobId = jobIds[-1]
+
+        # The order matters: later commands depend on earlier ones
+        commands = [
+            ('submit', ['submit', 'albany', inputDir], None),
+            ('list', ['list'], None),
+            ('list-warm', ['list'], None),
+            ('status', ['status', jobId], None),
+            ('download', ['download', jobId], None),
+            ('download-all', ['download', '--all', '-d', 'all'], None),
+            ('delete', ['delete', jobId], 'y\n'),
+            ('clean', ['clean'], 'y\n')
+        ]
+
+        results = []
+        for operation, commandArgs, answer in commands:
+            if args.operations and operation not in args.operations:
+                continue
+            result = runCommand(server, scale, operation, commandArgs, env,
+                                workDir, answer=answer,
+                                clientArgs=clientArgs)
+            printResult(result)
+            results.append(result)
+
+        return results
+    finally:
+        server.stop()
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+
+def printResult(result):
+    """Print a summary of a result to stderr."""
+    status = 'ok' if result['returncode'] == 0 else 'FAILED'
+    print('{:>6d} jobs  {:12s} {:9.3f} s {:8d} requests  {}'.format(
+        result['scale'], result['operation'], result['wallSeconds'],
+        result['requests'], status), file=sys.stderr)
+
+
+def parseScales(value):
+    """Parse a comma-separated list of job counts."""
+    try:
+        scales = [int(x) for x in value.split(',') if x.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid list of scales: ' + value)
+
+    if not scales or min(scales) < 2:
+        raise argparse.ArgumentTypeError('each scale must be at least 2')
+
+    return scales
+
+
+def main():
+    """Run the benchmarks and write the results."""
+    parser = argparse.ArgumentParser(
+        description=('Benchmark the multiscale client against a local mock '
+                     'girder server.'))
+    parser.add_argument('--scales', type=parseScales, default=DEFAULT_SCALES,
+                        help=('A comma-separated list of the numbers of '
+                              'jobs on the server (default: %s).' %
+                              ','.join(str(x) for x in DEFAULT_SCALES)))
+    parser.add_argument('--operations', nargs='+',
+                        help=('Only run these operations (submit, list, '
+                              'list-warm, status, download, download-all, '
+                              'delete, clean).'))
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='The latency added to each request in ms.')
+    parser.add_argument('--bandwidth', type=float,
+                        help=('The bandwidth of the server in MB/s '
+                              '(default: unlimited).'))
+    parser.add_argument('--input-files', type=int, default=4,
+                        help='The number of input files that are submitted.')
+    parser.add_argument('--input-size', type=int, default=1024 ** 2,
+                        help='The size of each input file in bytes.')
+    parser.add_argument('--output-files', type=int, default=2,
+                        help='The number of output files of each job.')
+    parser.add_argument('--output-size', type=int, default=64 * 1024,
+                        help='The size of each output file in bytes.')
+    parser.add_argument('--no-token-cache', action='store_true',
+                        help='Run the client with --no-token-cache.')
+    parser.add_argument('-o', '--output',
+                        help='Write the results to this file instead of '
+                             'the standard output.')
+    args = parser.parse_args()
+
+    report = {
+        'version': RESULTS_VERSION,
+        'date': datetime.utcnow().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'settings': {
+            'latencyMs': args.latency,
+            'bandwidthMBps': args.bandwidth,
+            'inputFiles': args.input_files,
+            'inputSize': args.input_size,
+            'outputFiles': args.output_files,
+            'outputSize': args.output_size,
+            'tokenCache': not args.no_token_cache
+        },
+        'results': []
+    }
+
+    for scale in args.scales:
+        report['results'].extend(benchmarkScale(scale, args))
+
+    if args.output:
+        with open(args.output, 'w') as wf:
+            json.dump(report, wf, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if any(x['returncode'] != 0 for x in report['results']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,29 +12,61 @@ See --help for options.
 # Python2 and python3 compatibility
 from __future__ import print_function
 
+import argparse
 import os
 import sys
+import time
 
-import girder_client
-from girder_client import HttpError
+from datetime import datetime, timedelta
 
-from multiscale_client.utilities.folder_utils import FolderUtils
-from multiscale_client.utilities.progress_bar import progress_bar
-from multiscale_client.utilities.job_utils import JobUtils
-from multiscale_client.utilities.multiscale_utils import MultiscaleUtils
-from multiscale_client.utilities.user_utils import UserUtils
-from multiscale_client.utilities.query_yes_no import query_yes_no
+# Only light modules are imported here so that --help and argument
+# errors are fast. girder_client and the utilities that depend on it
+# are imported by the functions that need them.
+from multiscale_client.utilities.calculations import (
+    CALCULATION_BATCH_REST_PATHS, CALCULATION_REST_PATHS)
+from multiscale_client.utilities.record_writer import RecordWriter
+from multiscale_client.utilities.transfer_defaults import (
+    DEFAULT_DOWNLOAD_WORKERS, DEFAULT_UPLOAD_CHUNK_SIZE,
+    DEFAULT_UPLOAD_WORKERS)
 
 DEFAULT_API_URL = 'http://localhost:8080/api/v1'
 
-SUPPORTED_CALCULATIONS = MultiscaleUtils.CALCULATION_REST_PATHS.keys()
+SUPPORTED_CALCULATIONS = sorted(CALCULATION_REST_PATHS.keys())
 
 
-def getClient(apiUrl, apiKey):
+def authenticate(gc, apiKey, tokenCache=None):
+    """Exchange an api key for a token and set it on a GirderClient.
+
+    If a TokenCache is given, the token is cached along with its expiry.
+    """
+    resp = gc.post('api_key/token', parameters={'key': apiKey})
+    authToken = resp['authToken']
+    gc.setToken(authToken['token'])
+
+    if tokenCache:
+        tokenCache.setToken(gc.urlBase, apiKey, authToken['token'],
+                            authToken.get('expires'))
+
+
+def reauthenticator(apiKey, tokenCache=None):
+    """Get a function that replaces a token the server has rejected.
+
+    The rejected token is dropped from the TokenCache, if one is given.
+    """
+    def reauthenticate(gc):
+        if tokenCache:
+            tokenCache.removeToken(gc.urlBase, apiKey)
+        authenticate(gc, apiKey, tokenCache)
+
+    return reauthenticate
+
+
+def getClient(apiUrl, apiKey, useTokenCache=True, maxRetries=None):
     """Get an authenticated GirderClient object.
 
     Takes an apiUrl and an apiKey and returns an authenticated
-    girder_client.GirderClient object.
+    RetryingGirderClient object, which retries the requests that fail
+    transiently up to 'maxRetries' times.
 
     If the apiUrl is empty or set to "None", the environment variable
     "MULTISCALE_API_URL" will be used. If it is not set, the
@@ -42,7 +74,19 @@ def getClient(apiUrl, apiKey):
 
     If the apiKey is empty or set to "None", the environment variable
     "MULTISCALE_API_KEY" will be used. A valid api key is mandatory.
+
+    If useTokenCache is True, a cached token for this api url and api
+    key is used when one is available and not about to expire. If the
+    server rejects the token (e.g. it was revoked), the client drops it
+    from the cache, authenticates with the api key again, and resends
+    the rejected request.
     """
+    from girder_client import HttpError
+    from multiscale_client.utilities.progress_bar import progress_bar
+    from multiscale_client.utilities.retrying_client import (
+        RetryingGirderClient)
+    from multiscale_client.utilities.token_cache import TokenCache
+
     if not apiUrl:
         apiUrl = os.getenv('MULTISCALE_API_URL')
         if not apiUrl:
@@ -56,11 +100,19 @@ def getClient(apiUrl, apiKey):
 
     progress_bar.reportProgress = sys.stdout.isatty()
 
-    gc = girder_client.GirderClient(apiUrl=apiUrl,
-                                    progressReporterCls=progress_bar)
+    tokenCache = TokenCache() if useTokenCache else None
+    gc = RetryingGirderClient(
+        apiUrl=apiUrl, maxRetries=maxRetries,
+        progressReporterCls=progress_bar,
+        reauthenticate=reauthenticator(apiKey, tokenCache))
+
+    token = tokenCache.getToken(gc.urlBase, apiKey) if tokenCache else None
+    if token:
+        gc.setToken(token)
+        return gc
 
     try:
-        gc.authenticate(apiKey=apiKey)
+        authenticate(gc, apiKey, tokenCache)
     except HttpError as e:
         if e.status == 500:
             print('Error: invalid api key')
@@ -75,49 +127,324 @@ def getClient(apiUrl, apiKey):
     return gc
 
 
+def reportRetries(gc):
+    """Print how many requests were retried, if any.
+
+    This goes to stderr so that it does not mix with machine-readable
+    output.
+    """
+    stats = gc.retryStats()
+    if not stats['retries']:
+        return
+
+    print('Note: retried {} of {} requests ({} retries) after transient '
+          'errors'.format(stats['retriedRequests'], stats['requests'],
+                          stats['retries']), file=sys.stderr)
+    if stats['failedRequests'] or stats['circuitOpens']:
+        print('Note: {} requests failed after their retries, and the '
+              'circuit breaker opened {} times'.format(
+                  stats['failedRequests'], stats['circuitOpens']),
+              file=sys.stderr)
+
+
+def checkCalculationType(calcType):
+    """Check that a calculation type is supported.
+
+    Prints the supported calculations and returns False if it is not.
+    """
+    if calcType in SUPPORTED_CALCULATIONS:
+        return True
+
+    print('Error: unsupported calculation type:', calcType)
+    print('Supported calculations are as follows:')
+    for calc in SUPPORTED_CALCULATIONS:
+        print(calc)
+    print()
+    return False
+
+
+def createUploadingMultiscaleUtils(gc, args):
+    """Create a MultiscaleUtils object with the upload options in args."""
+    from multiscale_client.utilities.multiscale_utils import MultiscaleUtils
+
+    chunkSize = None
+    if args.chunk_size:
+        chunkSize = int(args.chunk_size * 1024 ** 2)
+
+    return MultiscaleUtils(gc, chunkSize=chunkSize,
+                           uploadWorkers=args.upload_workers)
+
+
+def addUploadArguments(parser):
+    """Add the arguments that tune input uploads to a parser."""
+    parser.add_argument('--chunk-size', type=float,
+                        help=('The size of each uploaded chunk in MB '
+                              '(default: %d).' %
+                              (DEFAULT_UPLOAD_CHUNK_SIZE // 1024 ** 2)))
+    parser.add_argument('--upload-workers', type=int,
+                        help=('The number of files to upload at the same '
+                              'time (default: %d).' %
+                              DEFAULT_UPLOAD_WORKERS))
+
+
+# The number of seconds in each unit of --max-run-time
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parseDuration(value):
+    """Parse a duration such as '90', '45m' or '12h' into seconds."""
+    value = value.strip().lower()
+    unit = DURATION_UNITS.get(value[-1:])
+    number = value[:-1] if unit else value
+    try:
+        seconds = int(round(float(number) * (unit or 1)))
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid duration: ' + value)
+
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError('the duration must be positive')
+
+    return seconds
+
+
+def addLimitArguments(parser):
+    """Add the resource limit arguments of the calculations to a parser."""
+    parser.add_argument('--cpus', type=float,
+                        help=('The number of CPUs each calculation may use '
+                              '(e.g. 1.5). The default is set on the '
+                              'server.'))
+    parser.add_argument('--memory', type=int, metavar='MB',
+                        help=('The memory limit of each calculation in MB. '
+                              'The default is set on the server.'))
+    parser.add_argument('--max-run-time', type=parseDuration,
+                        metavar='DURATION',
+                        help=('The maximum run time of each calculation, '
+                              'in seconds or with an s, m, h or d suffix '
+                              '(e.g. 12h). The default is set on the '
+                              'server.'))
+
+
+def addPipelineArguments(parser):
+    """Add the Dream3D pipeline arguments to a parser."""
+    parser.add_argument('--pipelines', nargs='+', metavar='PIPELINE',
+                        help=('The Dream3D pipeline files to run (default: '
+                              'every .json file in the input).'))
+    parser.add_argument('--pipeline-concurrency', type=int, metavar='N',
+                        help=('The number of Dream3D pipelines that run at '
+                              'the same time (default: 1).'))
+
+
+def pipelineOptions(calcType, args):
+    """Get the pipeline options given on the command line.
+
+    Prints an error and returns None if they were given for a
+    calculation other than Dream3D.
+    """
+    options = {
+        'pipelines': [os.path.basename(x) for x in args.pipelines or []],
+        'pipelineConcurrency': args.pipeline_concurrency
+    }
+    if calcType != 'dream3d' and (options['pipelines'] or
+                                  options['pipelineConcurrency']):
+        print('Error: --pipelines and --pipeline-concurrency are only '
+              'supported by dream3d')
+        return None
+
+    return options
+
+
+def addManifestArguments(parser):
+    """Add the output manifest argument to a parser."""
+    parser.add_argument('--output-manifest', metavar='MANIFEST',
+                        help=('A JSON object, or a JSON file, that selects '
+                              'the output files to upload, e.g. '
+                              '\'{"include": ["*.exo"], "maxFileMB": 500}\' '
+                              '(default: the output files of the '
+                              'calculation type).'))
+
+
+def outputManifest(args):
+    """Get the output manifest given on the command line.
+
+    Prints an error and returns False if it cannot be read. Returns
+    None if no manifest was given.
+    """
+    import json
+
+    value = args.output_manifest
+    if value is None:
+        return None
+
+    try:
+        if os.path.isfile(value):
+            with open(value, 'r') as rf:
+                manifest = json.load(rf)
+        else:
+            manifest = json.loads(value)
+    except (IOError, ValueError) as e:
+        print('Error: invalid output manifest:', e)
+        return False
+
+    if not isinstance(manifest, dict):
+        print('Error: the output manifest must be a JSON object')
+        return False
+
+    return manifest
+
+
+def resourceLimits(args):
+    """Get the resource limits given on the command line."""
+    limits = {
+        'cpus': args.cpus,
+        'memoryMB': args.memory,
+        'maxRunSeconds': args.max_run_time
+    }
+    return dict((k, v) for k, v in limits.items() if v is not None)
+
+
+def printSubmitEstimate(gc, calcType, count):
+    """Print when 'count' new jobs of a calculation type would run.
+
+    Nothing is printed if the server cannot make an estimate.
+    """
+    from girder_client import HttpError
+    from multiscale_client.utilities.job_utils import JobUtils
+
+    try:
+        queue = JobUtils(gc).getQueue(calcType, count)
+    except HttpError:
+        # E.g. the server is older than the queue end point
+        return
+
+    for estimate in queue['estimates']:
+        if estimate.get('estimatedWaitSeconds') is not None:
+            print('Estimate for', count, calcType, 'job(s):',
+                  JobUtils.formatEstimate(estimate))
+
+
 def submitFunc(gc, args):
     """Submit a multiscale calculation."""
     calcType = args.calculation_type.lower()
     inputs = args.inputs
 
     # Is this a valid calculation type?
-    if calcType not in SUPPORTED_CALCULATIONS:
-        print('Error: unsupported calculation type:', calcType)
-        print('Supported calculations are as follows:')
-        for calc in SUPPORTED_CALCULATIONS:
-            print(calc)
-        print()
+    if not checkCalculationType(calcType):
         return
 
-    restPath = MultiscaleUtils.CALCULATION_REST_PATHS[calcType]
+    restPath = CALCULATION_REST_PATHS[calcType]
+    options = pipelineOptions(calcType, args)
+    if options is None:
+        return
+
+    options['outputManifest'] = outputManifest(args)
+    if options['outputManifest'] is False:
+        return
+
+    printSubmitEstimate(gc, calcType, 1)
+
+    mu = createUploadingMultiscaleUtils(gc, args)
+    mu.submitCalculation(restPath, inputs, streamOutput=args.stream_output,
+                         compressionLevel=args.compression_level,
+                         limits=resourceLimits(args), **options)
+
+
+def submitBatchFunc(gc, args):
+    """Submit many multiscale calculations of one type at once."""
+    calcType = args.calculation_type.lower()
+
+    if not checkCalculationType(calcType):
+        return
+
+    batchRestPath = CALCULATION_BATCH_REST_PATHS[calcType]
+    options = pipelineOptions(calcType, args)
+    if options is None:
+        return
+
+    options['outputManifest'] = outputManifest(args)
+    if options['outputManifest'] is False:
+        return
+
+    printSubmitEstimate(gc, calcType, len(args.input_dirs))
+
+    mu = createUploadingMultiscaleUtils(gc, args)
+    mu.submitBatch(batchRestPath, args.input_dirs,
+                   streamOutput=args.stream_output,
+                   compressionLevel=args.compression_level,
+                   limits=resourceLimits(args), **options)
 
-    mu = MultiscaleUtils(gc)
-    mu.submitCalculation(restPath, inputs)
+
+# The fields of each job written by list and status with --format
+JOB_INFO_FIELDS = ['jobId', 'status', 'calculationType', 'created',
+                   'updated', 'wallSeconds']
+JOB_STATUS_FIELDS = ['jobId', 'status', 'updated', 'wallSeconds', 'stage',
+                     'message', 'current', 'total']
+
+
+def addFormatArgument(parser):
+    """Add the --format argument to a parser."""
+    parser.add_argument('--format', choices=('text', ) + RecordWriter.FORMATS,
+                        default='text',
+                        help=('The output format. The machine-readable '
+                              'formats are written one record at a time '
+                              '(default: text).'))
 
 
 def printJobInfo(jobInfoList):
     """Print a list of job info.
 
-    Each item in the list should be a dictionary with entries
-    'jobId', 'status', and 'time'. This function will print all of the
-    jobs in a consistent format.
+    Each item in the list (or any iterable) should be a dictionary with
+    entries 'jobId', 'status', and 'time'. This function will print all
+    of the jobs in a consistent format, as they are produced.
+
+    Returns the number of jobs printed. The header is not printed if
+    there are none.
     """
-    print('=' * 59)
-    print('{:30s} {:12s} {:15s}'.format('jobId', 'status', 'run time (wall)'))
-    print('=' * 59)
+    count = 0
     for job in jobInfoList:
+        if count == 0:
+            print('=' * 59)
+            print('{:30s} {:12s} {:15s}'.format('jobId', 'status',
+                                                'run time (wall)'))
+            print('=' * 59)
         print('{:30s} {:12s} {:15s}'.format(job['jobId'], job['status'],
                                             job['time']))
+        count += 1
+
+    return count
 
 
 def statusFunc(gc, args):
-    """Get the status of a multiscale job."""
+    """Get the status of a multiscale job.
+
+    Exits with a non-zero status if the job id is invalid.
+    """
+    from multiscale_client.utilities.job_utils import JobUtils
+
     jobId = args.job_id
     ju = JobUtils(gc)
+
+    if args.format != 'text':
+        progress = ju.getJobProgress(jobId)
+        if not progress:
+            sys.exit(1)
+
+        record = {
+            'jobId': jobId,
+            'status': JobUtils.getJobStatusStr(progress.get('status')),
+            'updated': progress.get('updated'),
+            'wallSeconds': ju.getWallSeconds(jobId),
+            'stage': progress.get('stage'),
+            'message': progress.get('message'),
+            'current': progress.get('current'),
+            'total': progress.get('total')
+        }
+        RecordWriter.writeAll(args.format, JOB_STATUS_FIELDS, [record])
+        return
+
     statusStr = ju.jobStatus(jobId)
 
     if not statusStr:
-        return
+        sys.exit(1)
 
     jobInfoDict = {
         'jobId': jobId,
@@ -127,41 +454,419 @@ def statusFunc(gc, args):
 
     printJobInfo([jobInfoDict])
 
+    progressStr = JobUtils.formatProgress(ju.getJobProgress(jobId))
+    if progressStr and statusStr not in JobUtils.FINISHED_STATUSES:
+        print('Progress:', progressStr)
 
-def listFunc(gc, args):
-    """List all jobs for the current user."""
-    uu = UserUtils(gc)
-    userId = uu.getCurrentUserId()
+
+def waitFunc(gc, args):
+    """Wait for jobs to finish, printing their progress as it changes.
+
+    Exits with a non-zero status if any of the jobs did not succeed, or
+    if the timeout ran out first.
+    """
+    from multiscale_client.utilities.job_utils import JobUtils
 
     ju = JobUtils(gc)
-    jobList = ju.getAllJobsForUser(userId)
+    pending = list(args.job_ids)
+    last = {}
+    failed = []
+    deadline = time.time() + args.timeout if args.timeout else None
+    while pending:
+        for jobId in list(pending):
+            progress = ju.getJobProgress(jobId)
+            if not progress:
+                pending.remove(jobId)
+                failed.append(jobId)
+                continue
+
+            statusStr = JobUtils.getJobStatusStr(progress.get('status'))
+            progressStr = JobUtils.formatProgress(progress)
+            state = (statusStr, progressStr)
+            if last.get(jobId) != state:
+                last[jobId] = state
+                line = '{:30s} {:12s}'.format(jobId, statusStr)
+                if progressStr and statusStr not in JobUtils.FINISHED_STATUSES:
+                    line += ' ' + progressStr
+                print(line.rstrip())
+                sys.stdout.flush()
+
+            if statusStr in JobUtils.FINISHED_STATUSES:
+                pending.remove(jobId)
+                if statusStr != 'SUCCESS':
+                    failed.append(jobId)
+
+        if not pending:
+            break
+
+        if deadline is not None and time.time() >= deadline:
+            print('Timed out waiting for', len(pending), 'job(s)',
+                  file=sys.stderr)
+            sys.exit(2)
+
+        delay = args.interval
+        if deadline is not None:
+            delay = max(0, min(delay, deadline - time.time()))
+        time.sleep(delay)
+
+    if failed:
+        print(len(failed), 'job(s) did not succeed:', ' '.join(failed),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+def queueFunc(gc, args):
+    """Print the queued and running jobs and the wait estimates."""
+    from multiscale_client.utilities.job_utils import JobUtils
+
+    calcType = args.calculation_type
+    if calcType is not None:
+        calcType = calcType.lower()
+        if not checkCalculationType(calcType):
+            return
 
-    if not jobList:
+    queue = JobUtils(gc).getQueue(calcType, args.count)
+
+    print('=' * 59)
+    print('{:20s} {:15s} {:>10s} {:>10s}'.format('queue', 'type', 'queued',
+                                                 'running'))
+    print('=' * 59)
+    for entry in queue['queues']:
+        print('{:20s} {:15s} {:10d} {:10d}'.format(
+            entry['queue'], entry['calculationType'] or '', entry['queued'],
+            entry['running']))
+    if not queue['queues']:
+        print('No jobs are queued or running')
+
+    print()
+    print('Estimates for', args.count, 'new job(s):')
+    for estimate in queue['estimates']:
+        print('{:15s} {}'.format(estimate['calculationType'],
+                                 JobUtils.formatEstimate(estimate)))
+
+
+def parseSince(value):
+    """Parse the argument of --since into an ISO date string (UTC).
+
+    The value may be an ISO date or date and time (e.g. 2018-06-01 or
+    2018-06-01T12:00), or an age such as 30m, 12h or 7d.
+    """
+    units = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+    if value and value[-1] in units and value[:-1].isdigit():
+        delta = timedelta(**{units[value[-1]]: int(value[:-1])})
+        return (datetime.utcnow() - delta).isoformat()
+
+    for fmt in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt).isoformat()
+        except ValueError:
+            continue
+
+    raise argparse.ArgumentTypeError(
+        'invalid date or age: "%s" (examples: 2018-06-01, '
+        '2018-06-01T12:00, 12h, 7d)' % value)
+
+
+def parseStatuses(values):
+    """Parse the arguments of --status into a list of status id numbers.
+
+    Each value may be a single status or a comma-separated list.
+    Returns None if any of the statuses are unknown.
+    """
+    from multiscale_client.utilities.job_utils import JobUtils
+
+    statuses = []
+    for value in values or []:
+        for name in value.split(','):
+            status = JobUtils.getJobStatusId(name.strip())
+            if status is None:
+                print('Error: unknown job status:', name)
+                print('Known statuses are:',
+                      ', '.join(JobUtils.JOB_STATUS.values()))
+                return None
+            statuses.append(status)
+
+    return statuses
+
+
+def openJobIndex(gc, resync=False):
+    """Open the local job index for the current user and sync it."""
+    from multiscale_client.utilities.job_index import JobIndex
+    from multiscale_client.utilities.user_utils import UserUtils
+
+    uu = UserUtils(gc)
+    index = JobIndex(gc, uu.getCurrentUserId())
+    if resync:
+        index.resync()
+    else:
+        index.sync()
+    return index
+
+
+def jobRecords(rows):
+    """Convert rows of the job index into job records, one at a time."""
+    from multiscale_client.utilities.job_index import JobIndex
+    from multiscale_client.utilities.job_utils import JobUtils
+
+    for row in rows:
+        seconds = JobIndex.wallSeconds(row)
+        yield {
+            'jobId': row['jobId'],
+            'status': JobUtils.getJobStatusStr(row['status']),
+            'calculationType': row['calcType'],
+            'created': row['created'],
+            'updated': row['updated'],
+            'wallSeconds': seconds,
+            'time': ('' if seconds is None else
+                     JobUtils.formatWallTime(seconds))
+        }
+
+
+def listFunc(gc, args):
+    """List the jobs for the current user.
+
+    The local job index is synchronized with the server, and the jobs
+    are then filtered locally using the --status, --type, --since and
+    --limit options. The jobs are printed as they are read from the
+    index.
+    """
+    statuses = parseStatuses(args.status)
+    if statuses is None:
+        return
+
+    index = openJobIndex(gc, resync=args.resync)
+    rows = index.iterQuery(statuses=statuses, calcType=args.type,
+                           since=args.since, limit=args.limit,
+                           sort=args.sort)
+
+    if args.format != 'text':
+        RecordWriter.writeAll(args.format, JOB_INFO_FIELDS, jobRecords(rows))
+        return
+
+    if not printJobInfo(jobRecords(rows)):
         print('No jobs found')
+
+
+def statsFields():
+    """Get the fields of the records written by stats with --format."""
+    from multiscale_client.utilities.job_utils import JobUtils
+
+    statuses = [JobUtils.JOB_STATUS[x] for x in sorted(JobUtils.JOB_STATUS)]
+    return (['calculationType', 'count'] + statuses +
+            ['totalWallSeconds', 'meanWallSeconds'])
+
+
+def statsRecords(stats):
+    """Convert the stats of the job index into one record per type."""
+    statuses = statsFields()[2:-2]
+    for calcType in sorted(stats.keys()):
+        entry = stats[calcType]
+        record = {
+            'calculationType': calcType,
+            'count': entry['count'],
+            'totalWallSeconds': entry['totalWallSeconds'],
+            'meanWallSeconds': entry['meanWallSeconds']
+        }
+        for statusStr in statuses:
+            record[statusStr] = entry['statuses'].get(statusStr, 0)
+        yield record
+
+
+def statsFunc(gc, args):
+    """Print job statistics for each calculation type."""
+    from multiscale_client.utilities.job_utils import JobUtils
+
+    statuses = parseStatuses(args.status)
+    if statuses is None:
         return
 
-    jobInfoList = []
-    for jobId in jobList.keys():
-        jobInfoDict = {}
-        jobInfoDict['jobId'] = jobId
-        jobInfoDict['status'] = jobList[jobId]
-        jobInfoDict['time'] = ju.getWallTime(jobId)
-        jobInfoList.append(jobInfoDict)
+    index = openJobIndex(gc, resync=args.resync)
+    stats = index.stats(statuses=statuses, calcType=args.type,
+                        since=args.since)
 
-    printJobInfo(jobInfoList)
+    if args.format != 'text':
+        RecordWriter.writeAll(args.format, statsFields(),
+                              statsRecords(stats))
+        return
+
+    if not stats:
+        print('No jobs found')
+        return
+
+    for calcType in sorted(stats.keys()):
+        entry = stats[calcType]
+        print('=' * 59)
+        print(calcType + ':', entry['count'], 'jobs')
+        print('=' * 59)
+        for statusStr in sorted(entry['statuses'].keys()):
+            print('{:30s} {:d}'.format(statusStr,
+                                       entry['statuses'][statusStr]))
+        print('{:30s} {:s}'.format(
+            'total run time (wall)',
+            JobUtils.formatWallTime(entry['totalWallSeconds'])))
+        if entry['meanWallSeconds'] is not None:
+            print('{:30s} {:s}'.format(
+                'mean run time (wall)',
+                JobUtils.formatWallTime(entry['meanWallSeconds'])))
 
 
 def logFunc(gc, args):
-    """Display the job log for a given job id."""
+    """Display the job log for a given job id.
+
+    Exits with a non-zero status if the job id is invalid.
+    """
+    from multiscale_client.utilities.job_utils import JobUtils
+
     jobId = args.job_id
     ju = JobUtils(gc)
     log = ju.getJobLog(jobId)
+    if log is None:
+        sys.exit(1)
+
+    if args.format != 'text':
+        records = ({'jobId': jobId, 'index': i, 'entry': entry}
+                   for i, entry in enumerate(log))
+        RecordWriter.writeAll(args.format, ['jobId', 'index', 'entry'],
+                              records)
+        return
+
     for entry in log:
         print(entry)
 
 
+def readJobsFile(path):
+    """Read job ids from a file, or from stdin if the path is "-".
+
+    There should be one job id per line. Blank lines and lines starting
+    with "#" are ignored.
+    """
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(path, 'r') as rf:
+            lines = rf.readlines()
+
+    jobIds = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            jobIds.append(line)
+
+    return jobIds
+
+
+def bulkDownloadFunc(gc, args):
+    """Download the input or output of many jobs into <jobId>/ folders.
+
+    The jobs are selected with --all, --status and --jobs-file, using
+    the local job index.
+    """
+    from multiscale_client.utilities.multiscale_utils import MultiscaleUtils
+
+    statuses = parseStatuses(args.status)
+    if statuses is None:
+        return
+
+    index = openJobIndex(gc)
+    rows = index.query(statuses=statuses)
+
+    if args.jobs_file:
+        rowsById = dict((row['jobId'], row) for row in rows)
+        rows = []
+        for jobId in readJobsFile(args.jobs_file):
+            if jobId not in rowsById:
+                print('Warning: skipping job', jobId, '(not a multiscale '
+                      'job of the current user, or filtered out by '
+                      '--status)')
+                continue
+            rows.append(rowsById[jobId])
+
+    folderKey = 'inputFolderId' if args.download_input else 'outputFolderId'
+    folderIds = {}
+    for row in rows:
+        if not row[folderKey]:
+            print('Warning: skipping job', row['jobId'], '(no folder)')
+            continue
+        folderIds[row['jobId']] = row[folderKey]
+
+    if not folderIds:
+        print('No jobs to download')
+        return
+
+    print('Downloading', len(folderIds), 'jobs into', args.dest)
+    mu = MultiscaleUtils(gc)
+    summary = mu.downloadJobFolders(folderIds, args.dest,
+                                    numWorkers=args.download_workers)
+    print('Downloaded {} files ({:.2f} MB). Skipped {} files that were '
+          'already up to date.'.format(summary['downloaded'],
+                                       summary['bytes'] / 1e6,
+                                       summary['skipped']))
+
+
+def printSummaryStats(kind, stats):
+    """Print the statistics of one kind of variable of an output summary."""
+    for name in sorted(stats.keys()):
+        entry = stats[name]
+        print('  {:30s} {:8s} {:>13.6g} {:>13.6g} {:>13.6g}'.format(
+            name, kind, entry['min'], entry['max'], entry['mean']))
+
+
+def summaryFunc(gc, args):
+    """Print the summary of the output of a job."""
+    from multiscale_client.utilities.job_utils import JobUtils
+
+    ju = JobUtils(gc)
+    summary = ju.getJobSummary(args.job_id)
+    if not summary or not summary.get('files'):
+        print('No output summary is available for this job. Summaries are '
+              'only made for Albany and smtk jobs when the output summary '
+              'is enabled on the server.')
+        return
+
+    for fileSummary in summary['files']:
+        print('=' * 83)
+        print(fileSummary.get('name', ''))
+        print('=' * 83)
+        print('  dimensions: {}  nodes: {}  elements: {}  element blocks: '
+              '{}'.format(fileSummary.get('numDimensions'),
+                          fileSummary.get('numNodes'),
+                          fileSummary.get('numElements'),
+                          fileSummary.get('numElementBlocks')))
+        line = '  time steps: {}'.format(fileSummary.get('numTimeSteps'))
+        if 'finalTime' in fileSummary:
+            line += '  time: {:g} to {:g}'.format(fileSummary['firstTime'],
+                                                  fileSummary['finalTime'])
+        print(line)
+
+        variables = fileSummary.get('variables', {})
+        if not any(variables.values()):
+            continue
+
+        print()
+        print('  Values at the final time step:')
+        print('  {:30s} {:8s} {:>13s} {:>13s} {:>13s}'.format(
+            'variable', 'type', 'min', 'max', 'mean'))
+        for kind in ('global', 'nodal', 'element'):
+            printSummaryStats(kind, variables.get(kind, {}))
+
+
 def downloadFunc(gc, args):
     """Download the input or output of a specified job."""
+    from multiscale_client.utilities.job_utils import JobUtils
+    from multiscale_client.utilities.multiscale_utils import MultiscaleUtils
+
+    bulk = args.all or args.status or args.jobs_file
+    if bulk and args.job_id:
+        print('Error: a job id cannot be combined with --all, --status or '
+              '--jobs-file')
+        return
+    elif bulk:
+        bulkDownloadFunc(gc, args)
+        return
+    elif not args.job_id:
+        print('Error: a job id, --all, --status or --jobs-file is required')
+        return
+
     jobId = args.job_id
     download_input = args.download_input
 
@@ -180,6 +885,8 @@ def downloadFunc(gc, args):
 
 def cancelFunc(gc, args):
     """Cancel a running or inactive job."""
+    from multiscale_client.utilities.job_utils import JobUtils
+
     jobId = args.job_id
     ju = JobUtils(gc)
     ju.cancelJob(jobId)
@@ -187,6 +894,13 @@ def cancelFunc(gc, args):
 
 def deleteFunc(gc, args):
     """Delete a job and all of its input and output."""
+    from multiscale_client.utilities.folder_utils import FolderUtils
+    from multiscale_client.utilities.job_index import JobIndex
+    from multiscale_client.utilities.job_utils import JobUtils
+    from multiscale_client.utilities.multiscale_utils import MultiscaleUtils
+    from multiscale_client.utilities.user_utils import UserUtils
+    from multiscale_client.utilities.query_yes_no import query_yes_no
+
     jobId = args.job_id
     ju = JobUtils(gc)
 
@@ -220,6 +934,9 @@ def deleteFunc(gc, args):
     if deleteFolderId:
         fu.deleteFolder(deleteFolderId)
 
+    uu = UserUtils(gc)
+    JobIndex(gc, uu.getCurrentUserId()).removeJobs([jobId])
+
 
 def cleanFunc(gc, args):
     """Delete all jobs that are not inactive, queued, or running.
@@ -227,6 +944,13 @@ def cleanFunc(gc, args):
     This will also delete all input and output for each job that
     is deleted.
     """
+    from multiscale_client.utilities.folder_utils import FolderUtils
+    from multiscale_client.utilities.job_index import JobIndex
+    from multiscale_client.utilities.job_utils import JobUtils
+    from multiscale_client.utilities.multiscale_utils import MultiscaleUtils
+    from multiscale_client.utilities.user_utils import UserUtils
+    from multiscale_client.utilities.query_yes_no import query_yes_no
+
     uu = UserUtils(gc)
     userId = uu.getCurrentUserId()
 
@@ -238,36 +962,36 @@ def cleanFunc(gc, args):
     if not query_yes_no(question, default='no'):
         return
 
+    # Ask the server, since the index only has the multiscale jobs that
+    # this client has synced
     ju = JobUtils(gc)
     jobList = ju.getAllJobsForUser(userId)
 
     if not jobList:
         return
 
+    index = JobIndex(gc, userId)
+    keepStatuses = ('INACTIVE', 'QUEUED', 'RUNNING')
     mu = MultiscaleUtils(gc)
     fu = FolderUtils(gc)
-    for jobId in jobList.keys():
-        if jobList[jobId] == 'INACTIVE':
+    for jobId, statusStr in jobList.items():
+        if statusStr in keepStatuses:
             continue
-        elif jobList[jobId] == 'QUEUED':
-            continue
-        elif jobList[jobId] == 'RUNNING':
-            continue
-        else:
-            folderId = None
-            if mu.isMultiscaleJob(jobId):
-                folderId = mu.getJobFolderId(jobId)
 
-            ju.deleteJob(jobId)
+        folderId = None
+        if mu.isMultiscaleJob(jobId):
+            folderId = mu.getJobFolderId(jobId)
 
-            if folderId:
-                fu.deleteFolder(folderId)
+        ju.deleteJob(jobId)
+
+        if folderId:
+            fu.deleteFolder(folderId)
+
+        index.removeJobs([jobId])
 
 
 def main():
     """Perform the main client function."""
-    import argparse
-
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-k', '--api-key',
@@ -280,6 +1004,16 @@ def main():
                              'The default is the local host. '
                              'Note: the url normally ends in /api/v1')
 
+    parser.add_argument('--no-token-cache', action='store_true',
+                        help='Always authenticate with the api key instead '
+                             'of reusing a cached authentication token.')
+
+    parser.add_argument('--max-retries', type=int,
+                        help='How many times to retry a request that fails '
+                             'with a transient error, such as a 502 or a '
+                             'dropped connection (default: 6). Use 0 to '
+                             'disable the retries.')
+
     sub = parser.add_subparsers()
     submit = sub.add_parser('submit', help=('Submit a multiscale job along '
                                             'with its input folder.'))
@@ -297,28 +1031,159 @@ def main():
             'Girder and used for the '
             'simulation. Alternatively, a variable list of'
             'files may be used instead of a directory.'), nargs='*')
+    submit.add_argument('-s', '--stream-output', action='store_true',
+                        help=('Upload completed output files while the '
+                              'calculation is still running.'))
+    submit.add_argument('-c', '--compression-level', type=int,
+                        choices=range(10),
+                        help=('The compression level (1-9) for NetCDF and '
+                              'HDF5 output files, or 0 to disable '
+                              'compression. The default is set on the '
+                              'server.'))
+    addLimitArguments(submit)
+    addPipelineArguments(submit)
+    addManifestArguments(submit)
+    addUploadArguments(submit)
     submit.set_defaults(func=submitFunc)
 
+    submitBatch = sub.add_parser('submit-batch',
+                                 help=('Submit one job of the same type for '
+                                       'each of several input folders.'))
+    submitBatch.add_argument(
+        'calculation_type',
+        help=(
+            'The type of simulation to '
+            'perform. Current supported '
+            'types are: ' +
+            ', '.join(SUPPORTED_CALCULATIONS)))
+    submitBatch.add_argument(
+        'input_dirs', help=(
+            'The directories containing the input files for each job. '
+            'One job is created for each directory.'), nargs='+')
+    submitBatch.add_argument('-s', '--stream-output', action='store_true',
+                             help=('Upload completed output files while the '
+                                   'calculations are still running.'))
+    submitBatch.add_argument('-c', '--compression-level', type=int,
+                             choices=range(10),
+                             help=('The compression level (1-9) for NetCDF '
+                                   'and HDF5 output files, or 0 to disable '
+                                   'compression. The default is set on the '
+                                   'server.'))
+    addLimitArguments(submitBatch)
+    addPipelineArguments(submitBatch)
+    addManifestArguments(submitBatch)
+    addUploadArguments(submitBatch)
+    submitBatch.set_defaults(func=submitBatchFunc)
+
     status = sub.add_parser('status', help='Get the job status for a '
                                            'given job id.')
     status.add_argument('job_id', help='The job id')
+    addFormatArgument(status)
     status.set_defaults(func=statusFunc)
 
+    queue = sub.add_parser('queue', help=('Print the number of queued and '
+                                          'running jobs, and estimate when '
+                                          'new jobs would start and '
+                                          'finish.'))
+    queue.add_argument('calculation_type', nargs='?',
+                       help='Only estimate for this calculation type.')
+    queue.add_argument('--count', type=int, default=1,
+                       help=('The number of new jobs to estimate for, e.g. '
+                             'the size of a batch (default: 1).'))
+    queue.set_defaults(func=queueFunc)
+
+    wait = sub.add_parser('wait', help=('Wait for jobs to finish and print '
+                                        'their progress as it changes.'))
+    wait.add_argument('job_ids', nargs='+', metavar='job_id',
+                      help='The job ids')
+    wait.add_argument('--interval', type=parseDuration, default=5,
+                      help=('How often to check the jobs, e.g. 30s or 1m '
+                            '(default: 5 seconds).'))
+    wait.add_argument('--timeout', type=parseDuration,
+                      help=('Stop waiting after this long, e.g. 2h, and '
+                            'exit with status 2 (default: wait forever).'))
+    wait.set_defaults(func=waitFunc)
+
     listJobs = sub.add_parser('list', help='Get the list of jobs and their '
                                            'statuses for the current user.')
+    listJobs.add_argument('--status', action='append',
+                          help=('Only list jobs with this status (e.g. '
+                                'SUCCESS). May be repeated or given as a '
+                                'comma-separated list.'))
+    listJobs.add_argument('--type', choices=SUPPORTED_CALCULATIONS,
+                          help='Only list jobs of this calculation type.')
+    listJobs.add_argument('--since', type=parseSince,
+                          help=('Only list jobs updated since this UTC date '
+                                '(e.g. 2018-06-01 or 2018-06-01T12:00) or '
+                                'within this age (e.g. 12h or 7d).'))
+    listJobs.add_argument('--limit', type=int,
+                          help='The maximum number of jobs to list.')
+    listJobs.add_argument('--sort', choices=['created', 'wall'],
+                          default='created',
+                          help=('List the newest jobs first (created, the '
+                                'default) or the longest running first '
+                                '(wall).'))
+    listJobs.add_argument('--resync', action='store_true',
+                          help=('Rebuild the local job index from scratch '
+                                '(e.g. if jobs were deleted elsewhere).'))
+    addFormatArgument(listJobs)
     listJobs.set_defaults(func=listFunc)
 
+    stats = sub.add_parser('stats', help=('Print job statistics for each '
+                                          'calculation type.'))
+    stats.add_argument('--status', action='append',
+                       help=('Only include jobs with this status. May be '
+                             'repeated or given as a comma-separated list.'))
+    stats.add_argument('--type', choices=SUPPORTED_CALCULATIONS,
+                       help='Only include jobs of this calculation type.')
+    stats.add_argument('--since', type=parseSince,
+                       help=('Only include jobs updated since this UTC date '
+                             'or within this age (e.g. 7d).'))
+    stats.add_argument('--resync', action='store_true',
+                       help='Rebuild the local job index from scratch.')
+    addFormatArgument(stats)
+    stats.set_defaults(func=statsFunc)
+
     log = sub.add_parser('log', help='Print the log for a given job id.')
     log.add_argument('job_id', help='The job id')
+    addFormatArgument(log)
     log.set_defaults(func=logFunc)
 
+    summary = sub.add_parser('summary', help=('Print the summary of the '
+                                              'output of a job (mesh size, '
+                                              'time steps and variable '
+                                              'ranges) without downloading '
+                                              'it.'))
+    summary.add_argument('job_id', help='The job id')
+    summary.set_defaults(func=summaryFunc)
+
     download = sub.add_parser('download', help=('Download the output folder '
                                                 'for a given multiscale '
-                                                'job id.'))
-    download.add_argument('job_id', help='The job id')
+                                                'job id, or for many jobs.'))
+    download.add_argument('job_id', nargs='?', help='The job id')
     download.add_argument('-i', '--download-input', action='store_true',
                           help=('Instead of downloading the output for this '
                                 'job, download the input.'))
+    download.add_argument('--all', action='store_true',
+                          help=('Download all of the multiscale jobs of the '
+                                'current user. Each job is downloaded into '
+                                'a folder named after its job id.'))
+    download.add_argument('--status', action='append',
+                          help=('Download the jobs with this status (e.g. '
+                                'SUCCESS). May be repeated or given as a '
+                                'comma-separated list.'))
+    download.add_argument('--jobs-file',
+                          help=('Download the jobs listed in this file, one '
+                                'job id per line ("-" for stdin).'))
+    download.add_argument('-d', '--dest', default='.',
+                          help=('The directory into which many jobs are '
+                                'downloaded (default: the current '
+                                'directory). Files that are already there '
+                                'and up to date are skipped.'))
+    download.add_argument('--download-workers', type=int,
+                          help=('The number of files to download at the '
+                                'same time (default: %d).' %
+                                DEFAULT_DOWNLOAD_WORKERS))
     download.set_defaults(func=downloadFunc)
 
     cancel = sub.add_parser('cancel', help='Cancel a job for a given job id.')
@@ -342,12 +1207,16 @@ def main():
 
     apiKey = args.api_key
     apiUrl = args.api_url
-    gc = getClient(apiUrl, apiKey)
+    gc = getClient(apiUrl, apiKey, useTokenCache=not args.no_token_cache,
+                   maxRetries=args.max_retries)
 
     if not gc:
         sys.exit()
 
-    args.func(gc, args)
+    try:
+        args.func(gc, args)
+    finally:
+        reportRetries(gc)
 
 
 if __name__ == '__main__':
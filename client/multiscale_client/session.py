@@ -0,0 +1,324 @@
+"""An API for running multiscale calculations from a Python program.
+
+A MultiscaleSession authenticates once and reuses the same connection
+for every request. Its submit(), wait() and download() methods return
+futures, so many jobs can be run at the same time from one process:
+
+    from concurrent.futures import as_completed
+    from multiscale_client.session import MultiscaleSession
+
+    with MultiscaleSession(apiUrl, apiKey) as session:
+        jobIds = [session.submit('albany', d).result() for d in dirs]
+        waits = {session.wait(x): x for x in jobIds}
+        for future in as_completed(waits):
+            if future.result() == 'SUCCESS':
+                session.download(waits[future], 'results').result()
+
+On python 2, this requires the "futures" package.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import os
+import sys
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from .client import DEFAULT_API_URL, authenticate, reauthenticator
+from .utilities.calculations import (
+    CALCULATION_BATCH_REST_PATHS, CALCULATION_REST_PATHS)
+from .utilities.job_utils import JobUtils
+from .utilities.multiscale_utils import MultiscaleUtils
+from .utilities.retrying_client import RetryingGirderClient
+from .utilities.token_cache import TokenCache
+
+
+class MultiscaleSession:
+    """A connection to a girder server for submitting multiscale jobs.
+
+    Submissions and downloads run in a pool of 'numWorkers' threads.
+    Waits do not take a thread each: one background thread polls the
+    server every 'pollInterval' seconds for the jobs that changed since
+    its last poll, and completes the futures of the jobs that finished.
+    So hundreds of jobs can be waited on at once.
+
+    'chunkSize' (in bytes) and 'uploadWorkers' tune the uploads of the
+    input files, as in MultiscaleUtils. Requests that fail transiently
+    are retried up to 'maxRetries' times (see RetryingGirderClient).
+    """
+
+    DEFAULT_NUM_WORKERS = 8
+    DEFAULT_POLL_INTERVAL = 5
+
+    # The job fields needed to follow the jobs that are waited on
+    POLL_FIELDS = ['status', 'updated']
+
+    def __init__(self, apiUrl=None, apiKey=None, gc=None, numWorkers=None,
+                 pollInterval=None, chunkSize=None, uploadWorkers=None,
+                 useTokenCache=True, maxRetries=None):
+        """Connect and authenticate, or use an authenticated GirderClient.
+
+        If 'gc' is not given, 'apiUrl' and 'apiKey' default to the
+        MULTISCALE_API_URL and MULTISCALE_API_KEY environment variables,
+        as for the command line client.
+        """
+        self.numWorkers = numWorkers or MultiscaleSession.DEFAULT_NUM_WORKERS
+        self.pollInterval = (pollInterval or
+                             MultiscaleSession.DEFAULT_POLL_INTERVAL)
+
+        if gc is None:
+            gc = MultiscaleSession._connect(apiUrl, apiKey, useTokenCache,
+                                            maxRetries)
+        self.gc = gc
+
+        # Every thread shares one pool of persistent connections
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.numWorkers * 4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._sessionContext = self.gc.session(session)
+        self._sessionContext.__enter__()
+
+        self.mu = MultiscaleUtils(self.gc, chunkSize=chunkSize,
+                                  uploadWorkers=uploadWorkers)
+        self.ju = JobUtils(self.gc)
+        self._executor = ThreadPoolExecutor(max_workers=self.numWorkers)
+
+        # The futures of the jobs that are waited on, by job id
+        self._waits = {}
+        self._since = None
+        self._lock = threading.Lock()
+        self._wakeUp = threading.Event()
+        self._closed = False
+        self._poller = None
+
+    @staticmethod
+    def _connect(apiUrl, apiKey, useTokenCache, maxRetries):
+        """Get an authenticated RetryingGirderClient object."""
+        apiUrl = apiUrl or os.getenv('MULTISCALE_API_URL') or DEFAULT_API_URL
+        apiKey = apiKey or os.getenv('MULTISCALE_API_KEY')
+        if not apiKey:
+            raise ValueError('An api key is required')
+
+        tokenCache = TokenCache() if useTokenCache else None
+        gc = RetryingGirderClient(
+            apiUrl=apiUrl, maxRetries=maxRetries,
+            reauthenticate=reauthenticator(apiKey, tokenCache))
+        token = tokenCache.getToken(gc.urlBase, apiKey) if tokenCache else None
+        if token:
+            gc.setToken(token)
+        else:
+            authenticate(gc, apiKey, tokenCache)
+
+        return gc
+
+    def __enter__(self):
+        """Use the session as a context manager, which closes it."""
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        """Close the session."""
+        self.close()
+
+    def close(self, wait=True):
+        """Stop the session.
+
+        If 'wait' is True, the submissions and downloads that were
+        started are finished first. Waits that have not completed are
+        canceled.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            waits = [x for futures in self._waits.values() for x in futures]
+            self._waits = {}
+
+        for future in waits:
+            future.cancel()
+
+        self._wakeUp.set()
+        self._executor.shutdown(wait=wait)
+        if self._poller is not None:
+            self._poller.join()
+        self._sessionContext.__exit__(None, None, None)
+
+    def retryStats(self):
+        """Get the numbers of requests and retries of the session.
+
+        Returns None if the GirderClient that was given does not retry.
+        """
+        retryStats = getattr(self.gc, 'retryStats', None)
+        return retryStats() if retryStats else None
+
+    def submit(self, calcType, inputs, **options):
+        """Upload the inputs of a calculation and submit it.
+
+        'inputs' is a directory, whose contents will be uploaded, or a
+        list of files and directories. 'options' are the keyword
+        arguments of MultiscaleUtils.submitCalculation(). The upload is
+        not resumable by default, since the same inputs may be submitted
+        several times at once.
+
+        Returns a future of the job id.
+        """
+        options.setdefault('resumable', False)
+        restPath = CALCULATION_REST_PATHS[calcType.lower()]
+        return self._executor.submit(self.mu.submitCalculation, restPath,
+                                     inputs, **options)
+
+    def submitBatch(self, calcType, inputsList, **options):
+        """Submit many calculations of one type in a single request.
+
+        'inputsList' has the inputs of each job, as in submit(). Returns
+        a future of the list of job ids.
+        """
+        batchRestPath = CALCULATION_BATCH_REST_PATHS[calcType.lower()]
+        return self._executor.submit(self.mu.submitBatch, batchRestPath,
+                                     inputsList, **options)
+
+    def wait(self, jobId):
+        """Wait for a job to finish.
+
+        Returns a future of the final status string of the job
+        ('SUCCESS', 'ERROR' or 'CANCELED'). The future fails with a
+        ValueError if the job id is invalid.
+        """
+        future = Future()
+        progress = self.ju.getJobProgress(jobId)
+        if not progress:
+            future.set_exception(ValueError('Invalid job id: ' + jobId))
+            return future
+
+        statusStr = JobUtils.getJobStatusStr(progress.get('status'))
+        if statusStr in JobUtils.FINISHED_STATUSES:
+            future.set_result(statusStr)
+            return future
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The session is closed')
+
+            self._waits.setdefault(jobId, []).append(future)
+            # Changes to the job after this will be seen by the next poll
+            updated = progress.get('updated')
+            if updated and (self._since is None or updated < self._since):
+                self._since = updated
+
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll,
+                                                name='multiscale-wait')
+                self._poller.daemon = True
+                self._poller.start()
+
+        return future
+
+    def download(self, jobId, destDir='.', downloadInput=False):
+        """Download the output (or input) of a job into <destDir>/<jobId>/.
+
+        Files that were already downloaded are skipped. Returns a future
+        of the local directory.
+        """
+        folderType = 'input' if downloadInput else 'output'
+
+        def work():
+            folderId = self.mu.getInputOrOutputFolderId(jobId, folderType)
+            if folderId is None:
+                raise ValueError('The job has no %s folder: %s' %
+                                 (folderType, jobId))
+            self.mu.downloadJobFolders({jobId: folderId}, destDir)
+            localDir = os.path.join(destDir, jobId)
+            # The folder may be empty
+            if not os.path.isdir(localDir):
+                os.makedirs(localDir)
+            return localDir
+
+        return self._executor.submit(work)
+
+    def run(self, calcType, inputs, destDir='.', **options):
+        """Submit a calculation, wait for it, and download its output.
+
+        Returns a future of the local output directory. The future fails
+        with a RuntimeError if the job does not succeed.
+        """
+        result = Future()
+
+        def chain(future, then):
+            if result.cancelled():
+                return
+            elif future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                try:
+                    then(future.result())
+                except Exception as e:
+                    result.set_exception(e)
+
+        def downloaded(localDir):
+            result.set_result(localDir)
+
+        def finished(jobId, statusStr):
+            if statusStr != 'SUCCESS':
+                raise RuntimeError('Job %s finished with status %s' %
+                                   (jobId, statusStr))
+            self.download(jobId, destDir).add_done_callback(
+                lambda x: chain(x, downloaded))
+
+        def submitted(jobId):
+            self.wait(jobId).add_done_callback(
+                lambda x: chain(x, lambda y: finished(jobId, y)))
+
+        self.submit(calcType, inputs, **options).add_done_callback(
+            lambda x: chain(x, submitted))
+        return result
+
+    def _poll(self):
+        """Complete the futures of the waited jobs as they finish."""
+        while True:
+            self._wakeUp.wait(self.pollInterval)
+            with self._lock:
+                if self._closed:
+                    return
+                since = self._since
+                jobIds = set(self._waits)
+
+            if not jobIds:
+                continue
+
+            finished = {}
+            newest = since
+            try:
+                for job in self.ju.iterJobs(
+                        since=since, fields=MultiscaleSession.POLL_FIELDS):
+                    updated = job.get('updated')
+                    if updated and (newest is None or updated > newest):
+                        newest = updated
+                    statusStr = JobUtils.getJobStatusStr(job.get('status'))
+                    if (job['_id'] in jobIds and
+                            statusStr in JobUtils.FINISHED_STATUSES):
+                        finished[job['_id']] = statusStr
+            except Exception as e:
+                # The jobs are polled again after the next interval
+                print('Warning: failed to poll the jobs:', e,
+                      file=sys.stderr)
+                continue
+
+            with self._lock:
+                if self._since == since:
+                    self._since = newest
+                futures = [(future, finished[jobId])
+                           for jobId in finished
+                           for future in self._waits.pop(jobId, [])]
+
+            for future, statusStr in futures:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(statusStr)
@@ -0,0 +1,17 @@
+"""The calculation types supported by the multiscale end points.
+
+This module has no dependencies so that the command line interface can
+list the supported calculations without importing girder_client.
+"""
+
+CALCULATION_REST_PATHS = {
+    'albany': '/multiscale/run_albany',
+    'dream3d': '/multiscale/run_dream3d',
+    'smtk': '/multiscale/run_smtk_mesh_placement'
+}
+
+CALCULATION_BATCH_REST_PATHS = {
+    'albany': '/multiscale/run_albany_batch',
+    'dream3d': '/multiscale/run_dream3d_batch',
+    'smtk': '/multiscale/run_smtk_mesh_placement_batch'
+}
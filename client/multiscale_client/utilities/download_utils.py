@@ -0,0 +1,172 @@
+"""Download utility functions for communicating with girder."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import hashlib
+import os
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from .transfer_defaults import DEFAULT_DOWNLOAD_WORKERS
+
+
+class DownloadUtils:
+    """Utility functions for concurrent downloads of girder folders.
+
+    Folders are downloaded with the same layout as
+    GirderClient.downloadFolderRecursive(), but the files of all of the
+    folders are downloaded by a pool of workers and reported with a
+    single progress bar. Local files that already match the files on
+    girder are skipped.
+    """
+
+    FILE_DOWNLOAD_PATH = 'file/{id}/download'
+
+    DEFAULT_NUM_WORKERS = DEFAULT_DOWNLOAD_WORKERS
+
+    # The size of the blocks that are read from downloads and local files
+    BUFFER_SIZE = 1024 ** 2
+
+    def __init__(self, gc, numWorkers=None):
+        """Initialize with an authenticated GirderClient object.
+
+        'numWorkers' is the number of files that are downloaded at the
+        same time.
+        """
+        self.gc = gc
+        self.numWorkers = numWorkers or DownloadUtils.DEFAULT_NUM_WORKERS
+
+    def listFolderFiles(self, folderId, localDir):
+        """List the files in a girder folder, recursively.
+
+        Returns a list of (file document, local path) tuples, where the
+        local paths are inside of 'localDir'. An item holding a single
+        file of the same name becomes a file, and other items become
+        directories, as with GirderClient.downloadFolderRecursive().
+        """
+        files = []
+        for folder in self.gc.listFolder(folderId):
+            subDir = os.path.join(localDir,
+                                  self.gc.transformFilename(folder['name']))
+            files.extend(self.listFolderFiles(folder['_id'], subDir))
+
+        for item in self.gc.listItem(folderId):
+            itemName = self.gc.transformFilename(item['name'])
+            itemFiles = list(self.gc.listFile(item['_id']))
+            if len(itemFiles) == 1 and itemFiles[0]['name'] == item['name']:
+                files.append((itemFiles[0], os.path.join(localDir, itemName)))
+                continue
+
+            for fileDoc in itemFiles:
+                files.append((fileDoc, os.path.join(
+                    localDir, itemName,
+                    self.gc.transformFilename(fileDoc['name']))))
+
+        return files
+
+    @staticmethod
+    def localFileMatches(fileDoc, localPath):
+        """Check whether a local file is the same as a file on girder.
+
+        The sha512 checksum is compared if girder provides it (with the
+        hashsum_download plugin). Otherwise, only the sizes are compared.
+        """
+        if not os.path.isfile(localPath):
+            return False
+
+        if os.path.getsize(localPath) != fileDoc.get('size'):
+            return False
+
+        checksum = fileDoc.get('sha512')
+        if not checksum:
+            return True
+
+        sha = hashlib.sha512()
+        with open(localPath, 'rb') as rf:
+            for block in iter(lambda: rf.read(DownloadUtils.BUFFER_SIZE),
+                              b''):
+                sha.update(block)
+
+        return sha.hexdigest() == checksum
+
+    def downloadFile(self, fileDoc, localPath, onProgress=None):
+        """Download a file from girder to a local path.
+
+        The file is written next to 'localPath' and moved into place once
+        it is complete, so an interrupted download never looks complete.
+        'onProgress' is called with the number of bytes of each block.
+        """
+        directory = os.path.dirname(localPath)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another worker may have just created it
+                if not os.path.isdir(directory):
+                    raise
+
+        path = DownloadUtils.FILE_DOWNLOAD_PATH.format(id=fileDoc['_id'])
+        resp = self.gc.sendRestRequest('GET', path, stream=True,
+                                       jsonResp=False)
+
+        tmpPath = localPath + '.part'
+        with open(tmpPath, 'wb') as wf:
+            for block in resp.iter_content(
+                    chunk_size=DownloadUtils.BUFFER_SIZE):
+                wf.write(block)
+                if onProgress:
+                    onProgress(len(block))
+
+        if os.path.exists(localPath):
+            os.remove(localPath)
+        os.rename(tmpPath, localPath)
+
+    def downloadFolders(self, folders):
+        """Download several girder folders concurrently.
+
+        'folders' is a list of (folder id, local directory) tuples. The
+        contents of each folder (not the folder itself) are downloaded
+        into its local directory.
+
+        Returns a dictionary with the number of files that were
+        'downloaded' and 'skipped', and the number of bytes downloaded.
+        """
+        pool = ThreadPool(self.numWorkers)
+        try:
+            # Listing the folders takes a few requests each, so it is
+            # spread over the workers as well.
+            listings = pool.map(lambda x: self.listFolderFiles(*x), folders)
+            files = [entry for listing in listings for entry in listing]
+
+            matches = pool.map(
+                lambda x: DownloadUtils.localFileMatches(*x), files)
+            toDownload = [entry for entry, match in zip(files, matches)
+                          if not match]
+
+            summary = {
+                'downloaded': len(toDownload),
+                'skipped': len(files) - len(toDownload),
+                'bytes': sum(x[0].get('size', 0) for x in toDownload)
+            }
+            if not toDownload:
+                return summary
+
+            lock = threading.Lock()
+            label = 'Downloading %d files' % len(toDownload)
+            with self.gc.progressReporterCls(
+                    label=label, length=summary['bytes']) as reporter:
+
+                def onProgress(numBytes):
+                    with lock:
+                        reporter.update(numBytes)
+
+                # map() re-raises the first exception from the workers
+                pool.map(lambda x: self.downloadFile(x[0], x[1], onProgress),
+                         toDownload)
+
+            return summary
+        finally:
+            pool.close()
+            pool.join()
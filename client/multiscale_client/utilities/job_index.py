@@ -0,0 +1,237 @@
+"""A local SQLite index of multiscale job meta data."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import os
+import sqlite3
+import time
+
+from .job_utils import JobUtils
+
+
+class JobIndex:
+    """A local index of the current user's multiscale jobs.
+
+    The index is kept in an SQLite database and is synchronized
+    incrementally: only the jobs that were updated since the last sync
+    are requested from the server. Listing, filtering and statistics
+    can then be done locally.
+
+    Jobs deleted by other clients cannot be seen by an incremental sync.
+    Use resync() to rebuild the index from scratch.
+    """
+
+    INDEX_FILE = os.path.join(os.path.expanduser('~'), '.multiscale_client',
+                              'jobs.sqlite')
+
+    # The job fields that are needed to fill in the index. The
+    # timestamps are only used for jobs without the run time fields.
+    SYNC_FIELDS = ['status', 'created', 'updated', 'runStarted', 'runEnded',
+                   'timestamps', 'meta']
+
+    # The orders that iterQuery() may list the jobs in
+    SORT_CREATED = 'created'
+    SORT_WALL_TIME = 'wall'
+    SORTS = (SORT_CREATED, SORT_WALL_TIME)
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            source TEXT NOT NULL,
+            jobId TEXT NOT NULL,
+            status INTEGER,
+            calcType TEXT,
+            inputFolderId TEXT,
+            outputFolderId TEXT,
+            created TEXT,
+            updated TEXT,
+            runStarted REAL,
+            runEnded REAL,
+            PRIMARY KEY (source, jobId))''',
+        '''CREATE INDEX IF NOT EXISTS jobs_created
+            ON jobs (source, created)''',
+        '''CREATE TABLE IF NOT EXISTS syncs (
+            source TEXT PRIMARY KEY,
+            lastUpdated TEXT)'''
+    ]
+
+    def __init__(self, gc, userId, path=None):
+        """Initialize with an authenticated GirderClient and the user id.
+
+        Jobs from different servers and users are kept apart in the index.
+        """
+        self.gc = gc
+        self.source = gc.urlBase + '|' + str(userId)
+        self.path = path or JobIndex.INDEX_FILE
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        for statement in JobIndex.SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+    def lastUpdated(self):
+        """Get the latest update time of any job seen by a sync."""
+        row = self.db.execute('SELECT lastUpdated FROM syncs WHERE source = ?',
+                              (self.source, )).fetchone()
+        return row['lastUpdated'] if row else None
+
+    @staticmethod
+    def _row(job):
+        """Get the column values for a job document."""
+        settings = job.get('meta', {}).get('multiscale_settings', {})
+        startTime, endTime = JobUtils.runTimesFromJob(job)
+        return {
+            'jobId': job['_id'],
+            'status': job.get('status'),
+            'calcType': settings.get('calculationType'),
+            'inputFolderId': settings.get('inputFolderId'),
+            'outputFolderId': settings.get('outputFolderId'),
+            'created': job.get('created'),
+            'updated': job.get('updated'),
+            'runStarted': (JobUtils.datetimeToEpoch(startTime)
+                           if startTime else None),
+            'runEnded': JobUtils.datetimeToEpoch(endTime) if endTime else None
+        }
+
+    def sync(self):
+        """Fetch the jobs updated since the last sync into the index.
+
+        Returns the number of jobs that were added or updated.
+        """
+        since = self.lastUpdated()
+        ju = JobUtils(self.gc)
+
+        count = 0
+        newest = since
+        for job in ju.iterJobs(since=since, fields=JobIndex.SYNC_FIELDS):
+            row = JobIndex._row(job)
+            row['source'] = self.source
+            self.db.execute(
+                'INSERT OR REPLACE INTO jobs (source, jobId, status, '
+                'calcType, inputFolderId, outputFolderId, created, updated, '
+                'runStarted, runEnded) VALUES (:source, :jobId, :status, '
+                ':calcType, :inputFolderId, :outputFolderId, :created, '
+                ':updated, :runStarted, :runEnded)', row)
+            count += 1
+            if row['updated'] and (newest is None or row['updated'] > newest):
+                newest = row['updated']
+
+        if newest is not None:
+            self.db.execute(
+                'INSERT OR REPLACE INTO syncs (source, lastUpdated) '
+                'VALUES (?, ?)', (self.source, newest))
+        self.db.commit()
+        return count
+
+    def resync(self):
+        """Rebuild the index for this user from scratch."""
+        self.db.execute('DELETE FROM jobs WHERE source = ?', (self.source, ))
+        self.db.execute('DELETE FROM syncs WHERE source = ?', (self.source, ))
+        self.db.commit()
+        return self.sync()
+
+    def removeJobs(self, jobIds):
+        """Remove jobs from the index (e.g. after deleting them)."""
+        self.db.executemany(
+            'DELETE FROM jobs WHERE source = ? AND jobId = ?',
+            [(self.source, jobId) for jobId in jobIds])
+        self.db.commit()
+
+    @staticmethod
+    def wallSeconds(row):
+        """Get the wall time of an indexed job in seconds, or None."""
+        if row['runStarted'] is None:
+            return None
+
+        end = row['runEnded']
+        if end is None:
+            end = time.time()
+        return end - row['runStarted']
+
+    def iterQuery(self, statuses=None, calcType=None, since=None,
+                  limit=None, sort=SORT_CREATED):
+        """Iterate over the indexed jobs, newest first.
+
+        The filters are the same as for JobUtils.iterJobs(). If 'sort' is
+        SORT_WALL_TIME, the jobs are listed longest running first
+        instead, followed by the jobs that have not run. Yields a
+        dictionary with the indexed columns for each job. The rows are
+        read from the database as they are needed.
+        """
+        sql = 'SELECT * FROM jobs WHERE source = ?'
+        args = [self.source]
+        if statuses:
+            sql += ' AND status IN (%s)' % ','.join('?' * len(statuses))
+            args.extend(statuses)
+        if calcType:
+            sql += ' AND calcType = ?'
+            args.append(calcType)
+        if since:
+            sql += ' AND updated >= ?'
+            args.append(since)
+        if sort == JobIndex.SORT_WALL_TIME:
+            # Jobs that are still running have run until now. Jobs that
+            # have not run have a NULL wall time, which comes last.
+            sql += (' ORDER BY COALESCE(runEnded, ?) - runStarted DESC,'
+                    ' created DESC, jobId DESC')
+            args.append(time.time())
+        else:
+            sql += ' ORDER BY created DESC, jobId DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(limit)
+
+        for row in self.db.execute(sql, args):
+            yield dict(row)
+
+    def query(self, **filters):
+        """Query the indexed jobs, newest first.
+
+        'filters' are the same as for iterQuery(). Returns a list of
+        dictionaries with the indexed columns.
+        """
+        return list(self.iterQuery(**filters))
+
+    def stats(self, **filters):
+        """Get job statistics for each calculation type.
+
+        'filters' are the same as for iterQuery(). Returns a dictionary of
+        calculation types to dictionaries with the number of jobs in each
+        status ('statuses'), the total number of jobs ('count'), and the
+        total and mean wall times in seconds of the jobs that have run.
+        """
+        output = {}
+        for row in self.iterQuery(**filters):
+            calcType = row['calcType'] or 'unknown'
+            entry = output.setdefault(calcType, {
+                'count': 0,
+                'statuses': {},
+                'totalWallSeconds': 0.0,
+                'meanWallSeconds': None,
+                'numWithWallTime': 0
+            })
+            entry['count'] += 1
+            statusStr = JobUtils.getJobStatusStr(row['status']) or 'UNKNOWN'
+            entry['statuses'][statusStr] = (
+                entry['statuses'].get(statusStr, 0) + 1)
+
+            seconds = JobIndex.wallSeconds(row)
+            if seconds is not None:
+                entry['totalWallSeconds'] += seconds
+                entry['numWithWallTime'] += 1
+
+        for entry in output.values():
+            if entry['numWithWallTime']:
+                entry['meanWallSeconds'] = (entry['totalWallSeconds'] /
+                                            entry['numWithWallTime'])
+
+        return output
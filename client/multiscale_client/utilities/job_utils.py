@@ -7,6 +7,7 @@ from girder_client import HttpError
 
 from datetime import datetime, timedelta
 
+import json
 import sys
 USING_PYTHON3 = sys.version_info >= (3, 2)
 
@@ -20,6 +21,13 @@ class JobUtils:
     JOB_LIST_PATH = '/job'
     JOB_ID_PATH = '/job/{id}'
     JOB_CANCEL_PATH = '/job/{id}/cancel'
+    MULTISCALE_JOBS_PATH = '/multiscale/jobs'
+    MULTISCALE_JOB_SUMMARY_PATH = '/multiscale/jobs/{id}/summary'
+    MULTISCALE_JOB_PROGRESS_PATH = '/multiscale/jobs/{id}/progress'
+    MULTISCALE_QUEUE_PATH = '/multiscale/queue'
+
+    # The number of jobs requested per page when listing jobs
+    PAGE_SIZE = 100
 
     JOB_STATUS = {
         0: 'INACTIVE',
@@ -36,6 +44,9 @@ class JobUtils:
         824: 'CANCELING'
     }
 
+    # The statuses of jobs that will not change any more
+    FINISHED_STATUSES = ('SUCCESS', 'ERROR', 'CANCELED')
+
     def __init__(self, gc):
         """Initialize with an authenticated GirderClient object."""
         self.gc = gc
@@ -48,6 +59,18 @@ class JobUtils:
 
         return JobUtils.JOB_STATUS.get(status, '')
 
+    @staticmethod
+    def getJobStatusId(statusStr):
+        """Get a job status id number from a status string.
+
+        Returns None if the status string is unknown.
+        """
+        for status, name in JobUtils.JOB_STATUS.items():
+            if name == statusStr.upper():
+                return status
+
+        return None
+
     def jobStatus(self, jobId):
         """Get a job status string from a job id number."""
         params = {'id': jobId}
@@ -55,7 +78,7 @@ class JobUtils:
             resp = self.gc.get(JobUtils.JOB_ID_PATH, parameters=params)
         except HttpError as e:
             if e.status == 400:
-                print('Error. invalid job id:', jobId)
+                print('Error. invalid job id:', jobId, file=sys.stderr)
                 return {}
             raise
 
@@ -95,15 +118,63 @@ class JobUtils:
 
         return output
 
+    def iterJobs(self, statuses=None, calcType=None, since=None,
+                 limit=None, fields=None):
+        """Iterate over the current user's multiscale jobs, newest first.
+
+        The filtering is done on the server, and the jobs are requested
+        one page at a time, so only the jobs that are needed are fetched.
+
+        'statuses' is a list of status id numbers, 'calcType' is a
+        calculation type, 'since' is an ISO date string for the earliest
+        update time, 'limit' is the maximum number of jobs, and 'fields'
+        is a list of the job fields that are needed.
+        """
+        params = {}
+        if statuses:
+            params['statuses'] = json.dumps(statuses)
+        if calcType:
+            params['calculationType'] = calcType
+        if since:
+            params['updatedSince'] = since
+        if fields:
+            params['fields'] = json.dumps(fields)
+
+        count = 0
+        cursor = None
+        while True:
+            pageSize = JobUtils.PAGE_SIZE
+            if limit is not None:
+                pageSize = min(pageSize, limit - count)
+                if pageSize <= 0:
+                    return
+
+            params['limit'] = pageSize
+            if cursor:
+                params['cursor'] = cursor
+
+            resp = self.gc.get(JobUtils.MULTISCALE_JOBS_PATH,
+                               parameters=params)
+            for job in resp.get('jobs', []):
+                count += 1
+                yield job
+
+            cursor = resp.get('cursor')
+            if not cursor:
+                return
+
     def getJobLog(self, jobId):
-        """Get the log for a given jobId."""
+        """Get the log for a given jobId.
+
+        Returns None if the job id is invalid.
+        """
         params = {'id': jobId}
         try:
             resp = self.gc.get(JobUtils.JOB_ID_PATH, parameters=params)
         except HttpError as e:
             if e.status == 400:
-                print('Error. invalid job id:', jobId)
-                return {}
+                print('Error. invalid job id:', jobId, file=sys.stderr)
+                return None
             raise
 
         if not resp:
@@ -112,6 +183,72 @@ class JobUtils:
         log = resp.get('log', '')
         return log
 
+    def getJobSummary(self, jobId):
+        """Get the summary of the output of a job.
+
+        Returns None if the output has not been summarized.
+        """
+        path = JobUtils.MULTISCALE_JOB_SUMMARY_PATH.format(id=jobId)
+        try:
+            return self.gc.get(path)
+        except HttpError as e:
+            if e.status == 400:
+                print('Error. invalid job id:', jobId, file=sys.stderr)
+                return None
+            raise
+
+    def getJobProgress(self, jobId):
+        """Get the status and the latest progress event of a job.
+
+        This does not download the log of the job. Returns None if the
+        job id is invalid.
+        """
+        path = JobUtils.MULTISCALE_JOB_PROGRESS_PATH.format(id=jobId)
+        try:
+            return self.gc.get(path)
+        except HttpError as e:
+            if e.status == 400:
+                print('Error. invalid job id:', jobId, file=sys.stderr)
+                return None
+            raise
+
+    @staticmethod
+    def formatProgress(progress):
+        """Format the progress returned by getJobProgress() for display.
+
+        Returns an empty string if the job has not reported any progress.
+        """
+        if not progress or not progress.get('message'):
+            return ''
+
+        # The message already holds the percentage of stages with a total
+        return progress['message']
+
+    def getQueue(self, calcType=None, count=1):
+        """Get the queue depth and the wait estimates for new jobs.
+
+        'count' is the number of new jobs to estimate for. If 'calcType'
+        is given, only its estimate is returned.
+        """
+        params = {'count': count}
+        if calcType:
+            params['calculationType'] = calcType
+
+        return self.gc.get(JobUtils.MULTISCALE_QUEUE_PATH, parameters=params)
+
+    @staticmethod
+    def formatEstimate(estimate):
+        """Format an estimate returned by getQueue() for display."""
+        if estimate.get('estimatedWaitSeconds') is None:
+            return 'no estimate (no recent successful jobs)'
+
+        wait = estimate['estimatedWaitSeconds']
+        start = 'now' if wait < 1 else 'in ' + JobUtils.formatWallTime(wait)
+        finish = JobUtils.formatWallTime(estimate['estimatedFinishSeconds'])
+        median = JobUtils.formatWallTime(estimate['medianWallSeconds'])
+        return ('starts {}, finishes in {} (median run time {} of {} '
+                'jobs)'.format(start, finish, median, estimate['samples']))
+
     def cancelJob(self, jobId):
         """Cancel a job given its jobId."""
         params = {'id': jobId}
@@ -119,7 +256,7 @@ class JobUtils:
             return self.gc.put(JobUtils.JOB_CANCEL_PATH, parameters=params)
         except HttpError as e:
             if e.status == 400:
-                print('Error. invalid job id:', jobId)
+                print('Error. invalid job id:', jobId, file=sys.stderr)
                 return {}
             raise
 
@@ -130,7 +267,7 @@ class JobUtils:
             return self.gc.delete(JobUtils.JOB_ID_PATH, parameters=params)
         except HttpError as e:
             if e.status == 400:
-                print('Error. invalid job id:', jobId)
+                print('Error. invalid job id:', jobId, file=sys.stderr)
                 return {}
             raise
 
@@ -147,15 +284,17 @@ class JobUtils:
         See this issue:
         https://stackoverflow.com/questions/28331512/how-to-convert-python-isoformat-string-back-into-datetime-object
         """
+        # Times that fall on a whole second have no fractional part
+        fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in isoStr else '%Y-%m-%dT%H:%M:%S'
         if USING_PYTHON3:
             # Python3 can use %z
             split = isoStr.rsplit(':', 1)
             modifiedStr = str(split[0] + split[1])
-            return datetime.strptime(modifiedStr, '%Y-%m-%dT%H:%M:%S.%f%z')
+            return datetime.strptime(modifiedStr, fmt + '%z')
         else:
             # Python2 cannot use %z. Remove the timezone characters.
             modifiedStr = str(isoStr)[:-6]
-            return datetime.strptime(modifiedStr, '%Y-%m-%dT%H:%M:%S.%f')
+            return datetime.strptime(modifiedStr, fmt)
 
     def getWallTime(self, jobId):
         """Get the elapsed walltime for which a job has been running.
@@ -170,16 +309,52 @@ class JobUtils:
             resp = self.gc.get(JobUtils.JOB_ID_PATH, parameters=params)
         except HttpError as e:
             if e.status == 400:
-                print('Error. invalid job id:', jobId)
+                print('Error. invalid job id:', jobId, file=sys.stderr)
                 return {}
             raise
 
         if not resp:
             return ''
 
-        timestamps = resp.get('timestamps', None)
+        return JobUtils.wallTimeFromJob(resp)
+
+    def getWallSeconds(self, jobId):
+        """Get the elapsed walltime of a job in seconds.
+
+        Returns None if the job has not started running.
+        """
+        params = {'id': jobId}
+        try:
+            resp = self.gc.get(JobUtils.JOB_ID_PATH, parameters=params)
+        except HttpError as e:
+            if e.status == 400:
+                print('Error. invalid job id:', jobId, file=sys.stderr)
+                return None
+            raise
+
+        if not resp:
+            return None
+
+        return JobUtils.wallSecondsFromJob(resp)
+
+    @staticmethod
+    def runTimesFromJob(job):
+        """Get the times at which a job started and stopped running.
+
+        The server keeps these in the 'runStarted' and 'runEnded' fields
+        of multiscale jobs. Otherwise (e.g. for older servers), they are
+        found in the 'timestamps' of the job document.
+
+        Returns a tuple of datetimes. Either may be None if the job has
+        not started or stopped running yet.
+        """
+        if 'runStarted' in job:
+            return tuple(JobUtils.isoStrToDatetime(job[x]) if job.get(x)
+                         else None for x in ('runStarted', 'runEnded'))
+
+        timestamps = job.get('timestamps', None)
         if not timestamps:
-            return ''
+            return None, None
 
         startTime = None
         endTime = None
@@ -193,8 +368,35 @@ class JobUtils:
                 endTime = JobUtils.isoStrToDatetime(stamp.get('time', ''))
                 break
 
+        return startTime, endTime
+
+    @staticmethod
+    def datetimeToEpoch(dt):
+        """Convert a naive UTC or timezone aware datetime to epoch time."""
+        if dt.tzinfo is not None:
+            dt = dt.replace(tzinfo=None) - dt.utcoffset()
+        return (dt - datetime(1970, 1, 1)).total_seconds()
+
+    @staticmethod
+    def formatWallTime(seconds):
+        """Format a number of seconds in H:M:S format."""
+        return str(timedelta(seconds=int(seconds)))
+
+    @staticmethod
+    def wallSecondsFromJob(job):
+        """Get the elapsed walltime in seconds from a job document.
+
+        The job document must contain its run time fields or its
+        'timestamps' (see runTimesFromJob). Returns None if the job has
+        not started running.
+        """
+        if job.get('wallSeconds') is not None:
+            return job['wallSeconds']
+
+        startTime, endTime = JobUtils.runTimesFromJob(job)
+
         if not startTime:
-            return ''
+            return None
 
         if not endTime:
             if USING_PYTHON3:
@@ -203,6 +405,20 @@ class JobUtils:
                 # Python2 does not have timezone objects
                 endTime = datetime.utcnow()
 
-        td = endTime - startTime
+        return (endTime - startTime).total_seconds()
+
+    @staticmethod
+    def wallTimeFromJob(job):
+        """Get the elapsed walltime from a job document.
+
+        The job document must contain its run time fields or its
+        'timestamps' (see runTimesFromJob).
+
+        Returns a string with the walltime in H:M:S format.
+        """
+        seconds = JobUtils.wallSecondsFromJob(job)
+        if seconds is None:
+            return ''
+
         # Remove the microseconds before returning
-        return str(timedelta(days=td.days, seconds=td.seconds))
+        return JobUtils.formatWallTime(seconds)
@@ -5,28 +5,39 @@ from __future__ import print_function
 
 from girder_client import HttpError
 
+from . import calculations
+from .download_utils import DownloadUtils
 from .folder_utils import FolderUtils
 from .job_utils import JobUtils
+from .upload_utils import UploadUtils
 from .user_utils import UserUtils
 
+import json
 import os
+import threading
 
 
 class MultiscaleUtils:
     """Utility functions for performing multiscale operations on girder."""
 
-    CALCULATION_REST_PATHS = {
-        'albany': '/multiscale/run_albany',
-        'dream3d': '/multiscale/run_dream3d',
-        'smtk': '/multiscale/run_smtk_mesh_placement'
-    }
+    CALCULATION_REST_PATHS = calculations.CALCULATION_REST_PATHS
+    CALCULATION_BATCH_REST_PATHS = calculations.CALCULATION_BATCH_REST_PATHS
 
     BASE_FOLDER_NAME = 'multiscale_data'
     MAX_JOBS = 10000
 
-    def __init__(self, gc):
-        """Initialize with an authenticated GirderClient object."""
+    # Keeps concurrent submissions from picking the same job folder name
+    _jobFolderLock = threading.Lock()
+
+    def __init__(self, gc, chunkSize=None, uploadWorkers=None):
+        """Initialize with an authenticated GirderClient object.
+
+        'chunkSize' (in bytes) and 'uploadWorkers' (the number of files
+        uploaded at the same time) tune the uploads of input files.
+        """
         self.gc = gc
+        self.chunkSize = chunkSize
+        self.uploadWorkers = uploadWorkers
 
     def getBaseFolder(self):
         """Get the base folder for multiscale data on girder."""
@@ -38,32 +49,53 @@ class MultiscaleUtils:
             parentType='user', reuseExisting=True,
             public=False)
 
-    def createNewJobFolder(self):
-        """Create a new job folder for a calculation on girder.
+    def createNewJobFolders(self, count):
+        """Create new job folders for calculations on girder.
 
-        Returns the new folder.
+        The base folder is only listed once, so this is much faster than
+        calling createNewJobFolder() 'count' times.
+
+        Returns a list of the new folders, or None if there are not
+        enough job names left.
         """
+        with MultiscaleUtils._jobFolderLock:
+            return self._createNewJobFolders(count)
+
+    def _createNewJobFolders(self, count):
         baseFolder = self.getBaseFolder()
         baseFolderId = baseFolder['_id']
 
-        folderNames = []
+        folderNames = set()
         for folder in self.gc.listFolder(baseFolderId):
-            folderNames.append(folder['name'])
+            folderNames.add(folder['name'])
 
         baseName = 'job_'
-        workingDirName = ''
+        workingDirNames = []
         for i in range(1, MultiscaleUtils.MAX_JOBS + 1):
+            if len(workingDirNames) == count:
+                break
             tmpName = baseName + str(i)
             if tmpName not in folderNames:
-                workingDirName = tmpName
-                break
+                workingDirNames.append(tmpName)
 
-        if not workingDirName:
+        if len(workingDirNames) < count:
             print('Error: the maximum number of jobs has been exceeded.',
                   '\nPlease delete some jobs in your folder.')
             return
 
-        return self.gc.createFolder(baseFolderId, workingDirName)
+        return [self.gc.createFolder(baseFolderId, name)
+                for name in workingDirNames]
+
+    def createNewJobFolder(self):
+        """Create a new job folder for a calculation on girder.
+
+        Returns the new folder.
+        """
+        folders = self.createNewJobFolders(1)
+        if not folders:
+            return
+
+        return folders[0]
 
     def isMultiscaleJob(self, jobId):
         """Check to see if the given jobId is for a multiscale job."""
@@ -151,7 +183,13 @@ class MultiscaleUtils:
         the folder for the job output.
         """
         outputFolderId = self.getOutputFolderId(jobId)
+        return self.getJobFolderIdFromOutputFolderId(outputFolderId)
 
+    def getJobFolderIdFromOutputFolderId(self, outputFolderId):
+        """Get the job folder id for a job's output folder id.
+
+        See getJobFolderId() for details.
+        """
         fu = FolderUtils(self.gc)
         folder = fu.getFolder(outputFolderId)
 
@@ -212,27 +250,86 @@ class MultiscaleUtils:
 
         return folderName
 
-    def uploadInputFiles(self, inputs, inputFolderId):
+    def downloadJobFolders(self, folderIds, destDir='.', numWorkers=None):
+        """Download the input or output folders of many jobs concurrently.
+
+        'folderIds' is a dictionary of job ids to the ids of the folders
+        to download. The contents of each folder are downloaded into
+        '<destDir>/<jobId>/'. Files that were already downloaded are
+        skipped, so an interrupted download can simply be repeated.
+
+        Returns a dictionary with the number of files that were
+        'downloaded' and 'skipped', and the number of bytes downloaded.
+        """
+        folders = [(folderId, os.path.join(destDir, jobId))
+                   for jobId, folderId in sorted(folderIds.items())]
+        du = DownloadUtils(self.gc, numWorkers)
+        return du.downloadFolders(folders)
+
+    def uploadInputFiles(self, inputs, inputFolderId, submission=None,
+                         submissionKey=None):
         """Upload a local directory or a variable list of files.
 
         inputs should be a single directory or a list of files to upload.
 
         The contents of any directories will be uploaded (not the directory
         itself).
+
+        If 'submission' and 'submissionKey' are given, the upload progress
+        is saved so that it may be resumed if it is interrupted.
+        """
+        upu = UploadUtils(self.gc, self.chunkSize, self.uploadWorkers)
+        upu.uploadInputs(inputs, inputFolderId, submission, submissionKey)
+
+    def _getResumableSubmission(self, submissionKey):
+        """Get an interrupted submission that can be resumed, if any.
+
+        The submission is only used if its folders still exist on girder.
         """
-        if not isinstance(inputs, list):
-            inputs = [inputs]
-
-        for item in inputs:
-            if os.path.isdir(item):
-                self.gc.upload(item + '/*', inputFolderId)
-            elif os.path.isfile(item):
-                self.gc.upload(item, inputFolderId)
-            else:
-                print('Warning: file/dir does not exist:', item)
-                print('Skipping over unknown file/dir.')
-
-    def submitCalculation(self, restPath, inputs):
+        submission = UploadUtils.getPendingSubmission(submissionKey)
+        if not submission:
+            return
+
+        fu = FolderUtils(self.gc)
+        try:
+            for key in ('workingFolderId', 'inputFolderId',
+                        'outputFolderId'):
+                fu.getFolder(submission[key])
+        except (HttpError, KeyError):
+            UploadUtils.clearPendingSubmission(submissionKey)
+            return
+
+        return submission
+
+    @staticmethod
+    def _calculationParams(streamOutput=False, compressionLevel=None,
+                           limits=None, pipelines=None,
+                           pipelineConcurrency=None, outputManifest=None):
+        """Get the query parameters of a calculation end point."""
+        params = {}
+        if streamOutput:
+            params['streamOutput'] = 'true'
+
+        if compressionLevel is not None:
+            params['compressionLevel'] = compressionLevel
+
+        params.update(limits or {})
+
+        if pipelines:
+            params['pipelines'] = json.dumps(list(pipelines))
+
+        if pipelineConcurrency is not None:
+            params['pipelineConcurrency'] = pipelineConcurrency
+
+        if outputManifest is not None:
+            params['outputManifest'] = json.dumps(outputManifest)
+
+        return params
+
+    def submitCalculation(self, restPath, inputs, streamOutput=False,
+                          compressionLevel=None, limits=None, pipelines=None,
+                          pipelineConcurrency=None, outputManifest=None,
+                          resumable=True):
         """Submit a given calculation to the girder server.
 
         'restPath' should be one of the rest paths given at the top of
@@ -241,32 +338,121 @@ class MultiscaleUtils:
         'inputs' should be a list of input files or directories. Input files
         will be uploaded directly. A directory will have its contents
         uploaded.
-        """
-        baseFolderName = MultiscaleUtils.BASE_FOLDER_NAME
 
-        # Create a new working directory... job_1, job_2, etc.
-        workingFolder = self.createNewJobFolder()
-        workingFolderName = workingFolder['name']
-        workingFolderId = workingFolder['_id']
+        If 'streamOutput' is True, completed output files will be uploaded
+        while the calculation is still running.
+
+        'compressionLevel' is the deflate level (0-9) used on the server to
+        compress NetCDF and HDF5 output. If it is None, the server default
+        is used.
+
+        'limits' is a dictionary of resource limits ('cpus', 'memoryMB'
+        and 'maxRunSeconds') that override the server defaults.
 
-        # Create an input and output folder in the working directory
-        inputFolder = self.gc.createFolder(workingFolderId, 'input')
-        outputFolder = self.gc.createFolder(workingFolderId, 'output')
+        For Dream3D, 'pipelines' is the list of pipeline files to run (all
+        of them by default), and 'pipelineConcurrency' the number of
+        pipelines that run at the same time.
 
-        inputFolderId = inputFolder['_id']
-        outputFolderId = outputFolder['_id']
+        'outputManifest' is a dictionary that selects the output files
+        to upload ('include' and 'exclude' glob patterns, 'maxFileMB'
+        and 'maxTotalMB'). If it is None, the server default is used.
 
-        params = {
-            'inputFolderId': inputFolderId,
-            'outputFolderId': outputFolderId
-        }
+        If 'resumable' is True, the state of the upload is saved so that
+        submitting the same inputs again resumes it if it is interrupted.
+        Use False when the same inputs may be submitted concurrently.
+        """
+        baseFolderName = MultiscaleUtils.BASE_FOLDER_NAME
+        submissionKey = None
+        submission = None
+        if resumable:
+            submissionKey = UploadUtils.submissionKey(restPath, inputs)
+            submission = self._getResumableSubmission(submissionKey)
+
+        if submission:
+            print('Resuming the interrupted submission in:',
+                  baseFolderName + '/' + submission['workingFolderName'])
+        else:
+            # Create a new working directory... job_1, job_2, etc.
+            workingFolder = self.createNewJobFolder()
+
+            # Create an input and output folder in the working directory
+            inputFolder = self.gc.createFolder(workingFolder['_id'], 'input')
+            outputFolder = self.gc.createFolder(workingFolder['_id'],
+                                                'output')
+
+            submission = {
+                'workingFolderId': workingFolder['_id'],
+                'workingFolderName': workingFolder['name'],
+                'inputFolderId': inputFolder['_id'],
+                'outputFolderId': outputFolder['_id'],
+                'files': {}
+            }
+            if resumable:
+                UploadUtils.savePendingSubmission(submissionKey, submission)
+
+        workingFolderName = submission['workingFolderName']
+        inputFolderId = submission['inputFolderId']
+        outputFolderId = submission['outputFolderId']
+
+        params = MultiscaleUtils._calculationParams(
+            streamOutput, compressionLevel, limits, pipelines,
+            pipelineConcurrency, outputManifest)
+        params['inputFolderId'] = inputFolderId
+        params['outputFolderId'] = outputFolderId
 
         # Upload the jobs and submit
-        self.uploadInputFiles(inputs, inputFolderId)
+        self.uploadInputFiles(inputs, inputFolderId, submission,
+                              submissionKey)
         job = self.gc.post(restPath, parameters=params)
+        if resumable:
+            UploadUtils.clearPendingSubmission(submissionKey)
 
         print('Job submitted:', job['_id'])
         print('Girder working directory:',
               baseFolderName + '/' + workingFolderName)
 
         return job['_id']
+
+    def submitBatch(self, batchRestPath, inputsList, streamOutput=False,
+                    compressionLevel=None, limits=None, pipelines=None,
+                    pipelineConcurrency=None, outputManifest=None):
+        """Submit many calculations of one type in a single request.
+
+        'batchRestPath' should be one of the rest paths given at the top
+        of this class definition in 'CALCULATION_BATCH_REST_PATHS'
+
+        'inputsList' is a list with one entry per job. Each entry is either
+        a directory, whose contents will be uploaded, or a list of files
+        and directories, as in submitCalculation(), which also describes
+        the other arguments.
+
+        Returns the list of job ids.
+        """
+        baseFolderName = MultiscaleUtils.BASE_FOLDER_NAME
+
+        workingFolders = self.createNewJobFolders(len(inputsList))
+        if not workingFolders:
+            return []
+
+        folders = []
+        for workingFolder, inputs in zip(workingFolders, inputsList):
+            workingFolderId = workingFolder['_id']
+            inputFolder = self.gc.createFolder(workingFolderId, 'input')
+            outputFolder = self.gc.createFolder(workingFolderId, 'output')
+            self.uploadInputFiles(inputs, inputFolder['_id'])
+            folders.append({
+                'inputFolderId': inputFolder['_id'],
+                'outputFolderId': outputFolder['_id']
+            })
+
+        params = MultiscaleUtils._calculationParams(
+            streamOutput, compressionLevel, limits, pipelines,
+            pipelineConcurrency, outputManifest)
+
+        jobIds = self.gc.post(batchRestPath, parameters=params, json=folders)
+
+        for jobId, workingFolder in zip(jobIds, workingFolders):
+            print('Job submitted:', jobId,
+                  '(' + baseFolderName + '/' + workingFolder['name'] + ')')
+
+        return jobIds
@@ -0,0 +1,79 @@
+"""Write records in machine-readable formats (JSON, NDJSON and CSV)."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import csv
+import json
+import sys
+
+from collections import OrderedDict
+
+
+class RecordWriter:
+    """Write dictionaries to a stream one at a time.
+
+    Each record is written as soon as it is given, so a listing of any
+    length never has to be held in memory. Only the keys in 'fields'
+    are written, in that order. Missing values are written as null, or
+    as empty CSV cells.
+
+    The formats are:
+
+        json    A JSON array, with one record per line.
+        ndjson  One JSON object per line.
+        csv     A header row followed by one row per record.
+    """
+
+    FORMATS = ('json', 'ndjson', 'csv')
+
+    def __init__(self, fmt, fields, stream=None):
+        """Initialize with the format, the fields and the output stream."""
+        if fmt not in RecordWriter.FORMATS:
+            raise ValueError('Unknown output format: ' + str(fmt))
+
+        self.fmt = fmt
+        self.fields = list(fields)
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self._csv = None
+
+    def _ordered(self, record):
+        return OrderedDict((x, record.get(x)) for x in self.fields)
+
+    def write(self, record):
+        """Write a record."""
+        if self.fmt == 'csv':
+            if self._csv is None:
+                self._csv = csv.writer(self.stream, lineterminator='\n')
+                self._csv.writerow(self.fields)
+            self._csv.writerow([record.get(x) for x in self.fields])
+        elif self.fmt == 'ndjson':
+            self.stream.write(json.dumps(self._ordered(record)) + '\n')
+        else:
+            self.stream.write('[\n' if self.count == 0 else ',\n')
+            self.stream.write(json.dumps(self._ordered(record)))
+
+        self.count += 1
+
+    def close(self):
+        """Finish the output (e.g. close the JSON array)."""
+        if self.fmt == 'json':
+            self.stream.write('[]\n' if self.count == 0 else '\n]\n')
+        elif self.fmt == 'csv' and self._csv is None:
+            # Write the header even if there are no records
+            csv.writer(self.stream, lineterminator='\n').writerow(self.fields)
+
+        self.stream.flush()
+
+    @staticmethod
+    def writeAll(fmt, fields, records, stream=None):
+        """Write every record of an iterable (e.g. a generator).
+
+        Returns the number of records written.
+        """
+        writer = RecordWriter(fmt, fields, stream)
+        for record in records:
+            writer.write(record)
+        writer.close()
+        return writer.count
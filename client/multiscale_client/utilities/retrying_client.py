@@ -0,0 +1,270 @@
+"""A GirderClient that retries the requests that fail transiently."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import random
+import threading
+import time
+
+import requests
+
+from girder_client import GirderClient, HttpError
+from requests.adapters import HTTPAdapter
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request while the circuit is open."""
+
+
+class CircuitBreaker:
+    """Stop sending requests to a server that keeps failing.
+
+    After 'failureThreshold' transient failures in a row, the circuit
+    opens and requests are refused without being sent. After
+    'resetSeconds', a single request is let through to probe the server:
+    the circuit closes if it gets a response, and opens again otherwise.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failureThreshold=10, resetSeconds=30):
+        """Initialize with the failures that open the circuit and the wait."""
+        self.failureThreshold = failureThreshold
+        self.resetSeconds = resetSeconds
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.openedAt = None
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Check whether a request may be sent now."""
+        with self._lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+
+            if (self.state == CircuitBreaker.OPEN and
+                    time.time() - self.openedAt >= self.resetSeconds):
+                # This request is the probe
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+
+            return False
+
+    def recordSuccess(self):
+        """Record that the server responded."""
+        with self._lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+
+    def recordFailure(self):
+        """Record a transient failure, which may open the circuit."""
+        with self._lock:
+            self.failures += 1
+            if (self.state == CircuitBreaker.HALF_OPEN or
+                    (self.state == CircuitBreaker.CLOSED and
+                     self.failures >= self.failureThreshold)):
+                self.state = CircuitBreaker.OPEN
+                self.openedAt = time.time()
+                self.opens += 1
+
+
+class RetryingGirderClient(GirderClient):
+    """A GirderClient with connection pooling, retries and a circuit breaker.
+
+    Every request of the client goes through sendRestRequest(), so the
+    utilities get these for free:
+
+    - The connections are kept alive and reused, from a pool of up to
+      'poolSize' connections.
+    - Requests that fail with a connection error, a timeout or one of
+      the TRANSIENT_STATUSES are retried up to 'maxRetries' times, with
+      jittered exponential backoff. Requests that are not idempotent
+      (e.g. POST) are only retried if the server cannot have acted on
+      them, and requests with a streamed body are never retried.
+    - A CircuitBreaker stops requests from being sent to a server that
+      keeps failing. Refused requests are retried like the others, and
+      raise a CircuitOpenError once their retries run out.
+    - If 'reauthenticate' is given, it is called with the client when
+      the server rejects the token with a 401, and should set a new
+      token. The rejected request is then sent once more.
+
+    The numbers of requests and retries are counted in retryStats().
+    """
+
+    DEFAULT_MAX_RETRIES = 6
+    DEFAULT_POOL_SIZE = 10
+
+    # The backoff before the n-th retry is between half and all of
+    # min(MAX_DELAY, BASE_DELAY * 2 ** n) seconds
+    BASE_DELAY = 0.5
+    MAX_DELAY = 30
+
+    TRANSIENT_STATUSES = (429, 502, 503, 504)
+
+    # Statuses with which the server refuses a request without acting
+    # on it, so that even a POST may be retried
+    REFUSED_STATUSES = (429, 503)
+
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, apiUrl=None, maxRetries=None, poolSize=None,
+                 breaker=None, reauthenticate=None, **kwargs):
+        """Initialize with the api url and the retry and pool options.
+
+        The other keyword arguments are those of GirderClient.
+        """
+        super(RetryingGirderClient, self).__init__(apiUrl=apiUrl, **kwargs)
+        if maxRetries is None:
+            maxRetries = RetryingGirderClient.DEFAULT_MAX_RETRIES
+        self.maxRetries = maxRetries
+        self.breaker = breaker or CircuitBreaker()
+        self.reauthenticate = reauthenticate
+        self._authLock = threading.Lock()
+
+        poolSize = poolSize or RetryingGirderClient.DEFAULT_POOL_SIZE
+        self._pooledSession = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self._pooledSession.mount('http://', adapter)
+        self._pooledSession.mount('https://', adapter)
+
+        self._stats = {
+            'requests': 0,
+            'retriedRequests': 0,
+            'retries': 0,
+            'failedRequests': 0
+        }
+        self._statsLock = threading.Lock()
+
+    def _requestFunc(self, method):
+        # A session given to session() takes precedence over the pool
+        session = self._session or self._pooledSession
+        return getattr(session, method.lower())
+
+    def retryStats(self):
+        """Get the numbers of requests, retries and circuit openings.
+
+        'failedRequests' counts the requests that still failed
+        transiently after their retries (or could not be retried).
+        """
+        with self._statsLock:
+            stats = dict(self._stats)
+        stats['circuitOpens'] = self.breaker.opens
+        return stats
+
+    def _count(self, **counts):
+        with self._statsLock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def _renewToken(self, rejectedToken):
+        """Get a new token after 'rejectedToken' was rejected.
+
+        Returns False if no new token can be requested, e.g. because the
+        rejected request was sent without a token (such as the one that
+        requests a new token).
+        """
+        if self.reauthenticate is None or not rejectedToken:
+            return False
+
+        with self._authLock:
+            if self.token == rejectedToken:
+                self.setToken('')
+                self.reauthenticate(self)
+            # Otherwise, another thread has already renewed it
+
+        return True
+
+    @staticmethod
+    def isTransient(error):
+        """Check whether a request error may go away if it is retried."""
+        if isinstance(error, HttpError):
+            return error.status in RetryingGirderClient.TRANSIENT_STATUSES
+
+        return isinstance(error, (requests.ConnectionError,
+                                  requests.Timeout))
+
+    @staticmethod
+    def _replayable(data, files):
+        """Check whether a request body can be sent again."""
+        return not files and (data is None or not hasattr(data, 'read'))
+
+    @staticmethod
+    def _canRetry(method, error):
+        """Check whether a request may be retried after a transient error."""
+        if method.upper() in RetryingGirderClient.IDEMPOTENT_METHODS:
+            return True
+
+        # The server cannot have acted on these
+        if isinstance(error, (CircuitOpenError, requests.ConnectTimeout)):
+            return True
+
+        return (isinstance(error, HttpError) and
+                error.status in RetryingGirderClient.REFUSED_STATUSES)
+
+    @staticmethod
+    def backoff(attempt, error=None):
+        """Get the number of seconds to wait before a retry.
+
+        The Retry-After header of the response is honored, up to
+        MAX_DELAY.
+        """
+        response = getattr(error, 'response', None)
+        retryAfter = (response.headers.get('Retry-After')
+                      if response is not None else None)
+        if retryAfter and retryAfter.isdigit():
+            return min(float(retryAfter), RetryingGirderClient.MAX_DELAY)
+
+        delay = min(RetryingGirderClient.MAX_DELAY,
+                    RetryingGirderClient.BASE_DELAY * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def sendRestRequest(self, method, path, parameters=None, data=None,
+                        files=None, json=None, headers=None, jsonResp=True,
+                        **kwargs):
+        """Send a request as GirderClient does, retrying transient errors."""
+        replayable = RetryingGirderClient._replayable(data, files)
+        self._count(requests=1)
+        attempt = 0
+        renewedToken = False
+        while True:
+            token = self.token
+            if not self.breaker.allow():
+                error = CircuitOpenError(
+                    'The circuit breaker is open after repeated failures of '
+                    'the server: %s %s' % (method, path))
+            else:
+                try:
+                    result = super(RetryingGirderClient, self).sendRestRequest(
+                        method, path, parameters=parameters, data=data,
+                        files=files, json=json, headers=headers,
+                        jsonResp=jsonResp, **kwargs)
+                except Exception as e:
+                    if not RetryingGirderClient.isTransient(e):
+                        # The server is up (e.g. it rejected the request)
+                        self.breaker.recordSuccess()
+                        if (isinstance(e, HttpError) and e.status == 401 and
+                                replayable and not renewedToken and
+                                self._renewToken(token)):
+                            # The server did not act on the request
+                            renewedToken = True
+                            continue
+                        raise
+
+                    self.breaker.recordFailure()
+                    error = e
+                else:
+                    self.breaker.recordSuccess()
+                    return result
+
+            if (attempt >= self.maxRetries or not replayable or
+                    not RetryingGirderClient._canRetry(method, error)):
+                self._count(failedRequests=1)
+                raise error
+
+            self._count(retries=1, retriedRequests=int(attempt == 0))
+            time.sleep(RetryingGirderClient.backoff(attempt, error))
+            attempt += 1
@@ -0,0 +1,114 @@
+"""An on-disk cache of girder authentication tokens."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import time
+
+from .job_utils import JobUtils
+
+
+class TokenCache:
+    """A cache of the tokens obtained by exchanging api keys.
+
+    Exchanging an api key for a token requires a round trip to the
+    server, which dominates the run time of short commands. The tokens
+    are cached in a file that only the current user may read, keyed by
+    the api url and a hash of the api key (the api keys themselves are
+    never written to disk). A token is only reused until shortly before
+    it expires.
+    """
+
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.multiscale_client')
+    CACHE_FILE = os.path.join(CACHE_DIR, 'tokens.json')
+
+    # Tokens that expire within this many seconds are not reused
+    EXPIRY_MARGIN = 300
+
+    def __init__(self, path=None):
+        """Initialize with the path of the cache file."""
+        self.path = path or TokenCache.CACHE_FILE
+
+    @staticmethod
+    def cacheKey(apiUrl, apiKey):
+        """Get the key of the token for an api url and api key."""
+        digest = hashlib.sha256(apiKey.encode('utf-8')).hexdigest()
+        return apiUrl.rstrip('/') + '|' + digest
+
+    def _load(self):
+        """Load the cached tokens, or an empty dictionary."""
+        try:
+            with open(self.path, 'r') as rf:
+                tokens = json.load(rf)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        return tokens if isinstance(tokens, dict) else {}
+
+    def _save(self, tokens):
+        """Save the cached tokens, readable by the current user only."""
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        # Write a private temporary file, then replace the cache with it
+        tmpPath = self.path + '.tmp'
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        fd = os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as wf:
+            json.dump(tokens, wf)
+
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmpPath, self.path)
+
+    def getToken(self, apiUrl, apiKey):
+        """Get a cached token that is still valid, or None."""
+        entry = self._load().get(TokenCache.cacheKey(apiUrl, apiKey))
+        if not entry or not entry.get('token'):
+            return None
+
+        expires = entry.get('expires')
+        if expires is None or expires - TokenCache.EXPIRY_MARGIN < time.time():
+            return None
+
+        return entry['token']
+
+    def setToken(self, apiUrl, apiKey, token, expires):
+        """Cache a token along with its expiry time (an iso string)."""
+        try:
+            expiresEpoch = JobUtils.datetimeToEpoch(
+                JobUtils.isoStrToDatetime(expires))
+        except (TypeError, ValueError):
+            # Do not cache tokens of unknown lifetime
+            return
+
+        tokens = self._load()
+        now = time.time()
+        # Drop the tokens that have expired while we are at it
+        tokens = dict((key, value) for key, value in tokens.items()
+                      if value.get('expires', 0) > now)
+        tokens[TokenCache.cacheKey(apiUrl, apiKey)] = {
+            'token': token,
+            'expires': expiresEpoch
+        }
+
+        try:
+            self._save(tokens)
+        except (IOError, OSError) as e:
+            print('Warning: failed to cache the authentication token:', e)
+
+    def removeToken(self, apiUrl, apiKey):
+        """Remove a token from the cache (e.g. if it has been revoked)."""
+        tokens = self._load()
+        if tokens.pop(TokenCache.cacheKey(apiUrl, apiKey), None) is None:
+            return
+
+        try:
+            self._save(tokens)
+        except (IOError, OSError):
+            pass
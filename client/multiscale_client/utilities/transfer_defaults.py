@@ -0,0 +1,14 @@
+"""The defaults of the file transfers of the client.
+
+This module has no dependencies so that the command line interface can
+show the defaults in its help without importing the transfer utilities.
+"""
+
+# The number of files that are downloaded at the same time
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+# The size of each uploaded chunk, in bytes
+DEFAULT_UPLOAD_CHUNK_SIZE = 64 * 1024 ** 2
+
+# The number of files that are uploaded at the same time
+DEFAULT_UPLOAD_WORKERS = 4
@@ -0,0 +1,328 @@
+"""Upload utility functions for communicating with girder."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from .transfer_defaults import (DEFAULT_UPLOAD_CHUNK_SIZE,
+                                DEFAULT_UPLOAD_WORKERS)
+
+
+class UploadUtils:
+    """Utility functions for resumable, concurrent uploads to girder.
+
+    Girder requires the chunks of a single file to be received in order,
+    so each file is sent one chunk at a time while several files are
+    uploaded concurrently. The state of unfinished submissions is saved
+    to disk so that an interrupted upload can be resumed from the offset
+    that the server has already received.
+    """
+
+    FILE_PATH = '/file'
+    FILE_CHUNK_PATH = '/file/chunk'
+    FILE_OFFSET_PATH = '/file/offset'
+
+    STATE_DIR = os.path.join(os.path.expanduser('~'), '.multiscale_client')
+    STATE_FILE = os.path.join(STATE_DIR, 'uploads.json')
+
+    DEFAULT_CHUNK_SIZE = DEFAULT_UPLOAD_CHUNK_SIZE
+    DEFAULT_NUM_WORKERS = DEFAULT_UPLOAD_WORKERS
+
+    _stateLock = threading.Lock()
+
+    def __init__(self, gc, chunkSize=None, numWorkers=None):
+        """Initialize with an authenticated GirderClient object.
+
+        'chunkSize' is in bytes, and 'numWorkers' is the number of files
+        that are uploaded at the same time.
+        """
+        self.gc = gc
+        self.chunkSize = chunkSize or UploadUtils.DEFAULT_CHUNK_SIZE
+        self.numWorkers = numWorkers or UploadUtils.DEFAULT_NUM_WORKERS
+
+    @staticmethod
+    def _loadState():
+        """Load all of the saved submission states."""
+        if not os.path.isfile(UploadUtils.STATE_FILE):
+            return {}
+
+        try:
+            with open(UploadUtils.STATE_FILE, 'r') as rf:
+                return json.load(rf)
+        except (IOError, ValueError):
+            print('Warning: ignoring unreadable upload state file:',
+                  UploadUtils.STATE_FILE)
+            return {}
+
+    @staticmethod
+    def _saveState(state):
+        """Save all of the submission states."""
+        if not os.path.isdir(UploadUtils.STATE_DIR):
+            os.makedirs(UploadUtils.STATE_DIR)
+
+        tmpFile = UploadUtils.STATE_FILE + '.tmp'
+        with open(tmpFile, 'w') as wf:
+            json.dump(state, wf)
+        os.rename(tmpFile, UploadUtils.STATE_FILE)
+
+    @staticmethod
+    def submissionKey(restPath, inputs):
+        """Get the key identifying a submission of these inputs."""
+        if not isinstance(inputs, list):
+            inputs = [inputs]
+        return json.dumps([restPath] + [os.path.abspath(x) for x in inputs])
+
+    @staticmethod
+    def getPendingSubmission(key):
+        """Get the saved state of an unfinished submission, or None."""
+        with UploadUtils._stateLock:
+            return UploadUtils._loadState().get(key)
+
+    @staticmethod
+    def savePendingSubmission(key, submission):
+        """Save the state of an unfinished submission."""
+        with UploadUtils._stateLock:
+            state = UploadUtils._loadState()
+            state[key] = submission
+            UploadUtils._saveState(state)
+
+    @staticmethod
+    def clearPendingSubmission(key):
+        """Forget about a submission once it has been completed."""
+        with UploadUtils._stateLock:
+            state = UploadUtils._loadState()
+            if state.pop(key, None) is not None:
+                UploadUtils._saveState(state)
+
+    @staticmethod
+    def listLocalFiles(inputs):
+        """Get (local path, relative directory) for each file to upload.
+
+        Directories are walked recursively, and their contents (not the
+        directory itself) are uploaded, as with GirderClient.upload().
+        """
+        if not isinstance(inputs, list):
+            inputs = [inputs]
+
+        files = []
+        for item in inputs:
+            if os.path.isdir(item):
+                for root, dirs, names in os.walk(item):
+                    dirs.sort()
+                    relDir = os.path.relpath(root, item)
+                    if relDir == '.':
+                        relDir = ''
+                    for name in sorted(names):
+                        files.append((os.path.join(root, name), relDir))
+            elif os.path.isfile(item):
+                files.append((item, ''))
+            else:
+                print('Warning: file/dir does not exist:', item)
+                print('Skipping over unknown file/dir.')
+
+        return files
+
+    def _initUpload(self, localPath, itemId):
+        """Start a new upload of a local file into an item.
+
+        Returns the upload document, or the file document if the file
+        was empty and the upload is already complete.
+        """
+        params = {
+            'parentType': 'item',
+            'parentId': itemId,
+            'name': os.path.basename(localPath),
+            'size': os.path.getsize(localPath)
+        }
+        return self.gc.post(UploadUtils.FILE_PATH, parameters=params)
+
+    def _serverOffset(self, uploadId):
+        """Get how many bytes of an upload the server has received.
+
+        Returns None if the upload no longer exists on the server.
+        """
+        try:
+            resp = self.gc.get(UploadUtils.FILE_OFFSET_PATH,
+                               parameters={'uploadId': uploadId})
+        except Exception:
+            return None
+
+        return resp.get('offset')
+
+    def _finalizedFile(self, itemId, localPath):
+        """Find the file that a finished upload of 'localPath' created.
+
+        Girder removes an upload once its last chunk has been received,
+        so an upload that is gone may have been finalized even though
+        its response never arrived. Returns the file document or None.
+        """
+        name = os.path.basename(localPath)
+        size = os.path.getsize(localPath)
+        try:
+            for fileDoc in self.gc.listFile(itemId):
+                if fileDoc['name'] == name and fileDoc['size'] == size:
+                    return fileDoc
+        except Exception:
+            # The item is gone too
+            pass
+
+        return None
+
+    def _sendChunks(self, localPath, uploadId, offset):
+        """Send a local file to an upload, starting at 'offset'.
+
+        Returns the file document once the last chunk has been sent.
+        """
+        size = os.path.getsize(localPath)
+        resp = None
+        with open(localPath, 'rb') as rf:
+            rf.seek(offset)
+            while offset < size:
+                chunk = rf.read(self.chunkSize)
+                params = {'uploadId': uploadId, 'offset': offset}
+                resp = self.gc.post(UploadUtils.FILE_CHUNK_PATH,
+                                    parameters=params, data=chunk)
+                offset += len(chunk)
+
+        return resp
+
+    def uploadFile(self, localPath, folderId, fileState, onChange=None):
+        """Upload a single local file into a girder folder.
+
+        'fileState' is a dictionary describing any previous attempt at
+        uploading this file. It is updated in place, and 'onChange' is
+        called whenever it changes so that it may be saved.
+
+        Returns the number of bytes that were sent.
+        """
+        st = os.stat(localPath)
+        signature = [st.st_size, st.st_mtime]
+        if fileState.get('signature') != signature:
+            # The local file is new or has changed. Start over.
+            fileState.clear()
+            fileState['signature'] = signature
+
+        if fileState.get('fileId'):
+            # Already uploaded by a previous attempt
+            return 0
+
+        offset = None
+        uploadId = fileState.get('uploadId')
+        if uploadId:
+            offset = self._serverOffset(uploadId)
+
+        if uploadId and (offset is None or offset >= st.st_size):
+            # The upload may have been finalized by the server. Older
+            # states did not record the item.
+            itemId = fileState.get('itemId') or self.gc.createItem(
+                folderId, os.path.basename(localPath),
+                reuseExisting=True)['_id']
+            fileDoc = self._finalizedFile(itemId, localPath)
+            if fileDoc is not None:
+                fileState['fileId'] = fileDoc['_id']
+                fileState.pop('uploadId', None)
+                if onChange:
+                    onChange()
+                return 0
+
+            if offset is not None:
+                # Every byte was received, but no file was created
+                offset = None
+
+        if offset is None:
+            item = self.gc.createItem(folderId, os.path.basename(localPath),
+                                      reuseExisting=True)
+            fileState['itemId'] = item['_id']
+            upload = self._initUpload(localPath, item['_id'])
+            if upload.get('_modelType') == 'file':
+                # Empty files are complete as soon as they are created
+                fileState['fileId'] = upload['_id']
+                if onChange:
+                    onChange()
+                return 0
+
+            uploadId = upload['_id']
+            offset = 0
+            fileState['uploadId'] = uploadId
+            if onChange:
+                onChange()
+
+        fileDoc = self._sendChunks(localPath, uploadId, offset)
+        fileState['fileId'] = fileDoc['_id'] if fileDoc else None
+        fileState.pop('uploadId', None)
+        if onChange:
+            onChange()
+
+        return st.st_size - offset
+
+    def uploadInputs(self, inputs, folderId, submission=None,
+                     submissionKey=None):
+        """Upload a local directory or a variable list of files.
+
+        The contents of any directories will be uploaded (not the directory
+        itself), and several files are uploaded at the same time.
+
+        If 'submission' and 'submissionKey' are given, the progress of each
+        file is recorded in submission['files'] and saved, so that an
+        interrupted upload can be resumed later.
+        """
+        files = UploadUtils.listLocalFiles(inputs)
+        if not files:
+            return
+
+        if submission is None:
+            submission = {}
+        fileStates = submission.setdefault('files', {})
+
+        def onChange():
+            if submissionKey is not None:
+                UploadUtils.savePendingSubmission(submissionKey, submission)
+
+        # Create the sub folders first, so that the workers do not race
+        folderIds = {'': folderId}
+        for localPath, relDir in files:
+            parentId = folderId
+            subPath = ''
+            for name in relDir.split(os.sep) if relDir else []:
+                subPath = os.path.join(subPath, name)
+                if subPath not in folderIds:
+                    folderIds[subPath] = self.gc.createFolder(
+                        parentId, name, reuseExisting=True)['_id']
+                parentId = folderIds[subPath]
+
+        lock = threading.Lock()
+
+        def work(entry):
+            localPath, relDir = entry
+            key = os.path.abspath(localPath)
+            with lock:
+                fileState = fileStates.setdefault(key, {})
+
+            def locked():
+                with lock:
+                    onChange()
+
+            start = time.time()
+            sent = self.uploadFile(localPath, folderIds[relDir], fileState,
+                                   onChange=locked)
+            elapsed = max(time.time() - start, 1e-6)
+            if sent:
+                print('Uploaded {} ({:.2f} MB at {:.2f} MB/s)'.format(
+                    localPath, sent / 1e6, sent / 1e6 / elapsed))
+            else:
+                print('Nothing to send for', localPath,
+                      '(empty or already uploaded)')
+
+        pool = ThreadPool(min(self.numWorkers, len(files)))
+        try:
+            # map() re-raises the first exception from the workers
+            pool.map(work, files)
+        finally:
+            pool.close()
+            pool.join()
@@ -8,6 +8,7 @@ import re
 from setuptools import setup, find_packages
 
 install_reqs = [
+    'futures; python_version < "3"',
     'girder_client>=2.4.0',
 ]
 # FIXME: Add a readme sometime
@@ -0,0 +1,70 @@
+"""Tests for writing records in machine-readable formats."""
+
+import json
+
+import pytest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from multiscale_client.utilities.record_writer import RecordWriter
+
+FIELDS = ['_id', 'status', 'title']
+
+RECORDS = [
+    {'_id': 'a', 'status': 3, 'title': 'albany, run 1', 'extra': 1},
+    {'_id': 'b', 'status': 4}
+]
+
+
+def writeAll(fmt, records):
+    stream = StringIO()
+    count = RecordWriter.writeAll(fmt, FIELDS, iter(records), stream)
+    assert count == len(records)
+    return stream.getvalue()
+
+
+def test_json():
+    output = writeAll('json', RECORDS)
+
+    assert json.loads(output) == [
+        {'_id': 'a', 'status': 3, 'title': 'albany, run 1'},
+        {'_id': 'b', 'status': 4, 'title': None}
+    ]
+    # One record per line, with the fields in order
+    assert output.splitlines()[1].startswith('{"_id": "a", "status": 3')
+
+
+def test_json_without_records():
+    assert json.loads(writeAll('json', [])) == []
+
+
+def test_ndjson():
+    lines = writeAll('ndjson', RECORDS).splitlines()
+
+    assert [json.loads(x) for x in lines] == [
+        {'_id': 'a', 'status': 3, 'title': 'albany, run 1'},
+        {'_id': 'b', 'status': 4, 'title': None}
+    ]
+
+
+def test_ndjson_without_records():
+    assert writeAll('ndjson', []) == ''
+
+
+def test_csv():
+    assert writeAll('csv', RECORDS) == (
+        '_id,status,title\n'
+        'a,3,"albany, run 1"\n'
+        'b,4,\n')
+
+
+def test_csv_without_records():
+    assert writeAll('csv', []) == '_id,status,title\n'
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        RecordWriter('xml', FIELDS)
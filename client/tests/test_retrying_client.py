@@ -0,0 +1,171 @@
+"""Tests for retrying the requests of the client and the circuit breaker."""
+
+import io
+
+import pytest
+import requests
+
+from girder_client import HttpError
+
+from multiscale_client.utilities import retrying_client
+from multiscale_client.utilities.retrying_client import (
+    CircuitBreaker, CircuitOpenError, RetryingGirderClient)
+
+
+def makeResponse(status):
+    """Make a response with a status code and an empty JSON body."""
+    response = requests.Response()
+    response.status_code = status
+    response.url = 'http://girder/api/v1/path'
+    response._content = b'{}'
+    return response
+
+
+class FakeSession(object):
+    """Answer each request with the next outcome of a list.
+
+    An outcome is a status code or an exception to raise.
+    """
+
+    def __init__(self, outcomes):
+        """Initialize with the outcomes of the requests, in order."""
+        self.outcomes = list(outcomes)
+        self.tokens = []
+
+    def request(self, url, headers=None, **kwargs):
+        """Send a request."""
+        self.tokens.append(headers.get('Girder-Token'))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return makeResponse(outcome)
+
+    get = head = options = put = post = delete = patch = request
+
+
+@pytest.fixture(autouse=True)
+def noBackoff(monkeypatch):
+    monkeypatch.setattr(retrying_client.time, 'sleep', lambda seconds: None)
+
+
+def makeClient(outcomes, **kwargs):
+    client = RetryingGirderClient(apiUrl='http://girder/api/v1', **kwargs)
+    client._pooledSession = FakeSession(outcomes)
+    return client
+
+
+def test_transient_errors_are_retried():
+    client = makeClient([503, requests.ConnectionError(), 200])
+
+    assert client.get('path') == {}
+    assert client.retryStats() == {
+        'requests': 1,
+        'retriedRequests': 1,
+        'retries': 2,
+        'failedRequests': 0,
+        'circuitOpens': 0
+    }
+
+
+def test_other_errors_are_not_retried():
+    client = makeClient([404, 200])
+
+    with pytest.raises(HttpError) as e:
+        client.get('path')
+    assert e.value.status == 404
+    assert client.retryStats()['retries'] == 0
+
+
+def test_retries_run_out():
+    client = makeClient([502] * 3, maxRetries=2)
+
+    with pytest.raises(HttpError):
+        client.put('path')
+    assert client.retryStats()['retries'] == 2
+    assert client.retryStats()['failedRequests'] == 1
+
+
+@pytest.mark.parametrize('error', [
+    502, 504, requests.ConnectionError(), requests.ReadTimeout()
+])
+def test_post_is_not_retried_if_the_server_may_have_acted(error):
+    client = makeClient([error, 200])
+
+    with pytest.raises((HttpError, requests.RequestException)):
+        client.post('path')
+    assert client.retryStats()['retries'] == 0
+
+
+@pytest.mark.parametrize('error', [429, 503, requests.ConnectTimeout()])
+def test_post_is_retried_if_the_server_refused_it(error):
+    client = makeClient([error, 200])
+
+    assert client.post('path') == {}
+    assert client.retryStats()['retries'] == 1
+
+
+def test_streamed_bodies_are_not_retried():
+    client = makeClient([503, 200])
+
+    with pytest.raises(HttpError):
+        client.put('path', data=io.BytesIO(b'chunk'))
+
+
+def test_rejected_token_is_renewed_once():
+    def reauthenticate(client):
+        client.setToken('renewed')
+
+    client = makeClient([401, 200], reauthenticate=reauthenticate)
+    client.setToken('expired')
+
+    assert client.get('path') == {}
+    assert client._pooledSession.tokens == ['expired', 'renewed']
+
+    client = makeClient([401, 401, 200], reauthenticate=reauthenticate)
+    client.setToken('expired')
+    with pytest.raises(HttpError) as e:
+        client.get('path')
+    assert e.value.status == 401
+
+
+def test_open_circuit_refuses_requests():
+    breaker = CircuitBreaker(failureThreshold=2, resetSeconds=30)
+    client = makeClient([503, 503], maxRetries=3, breaker=breaker)
+
+    with pytest.raises(CircuitOpenError):
+        client.get('path')
+    assert breaker.state == CircuitBreaker.OPEN
+    assert client.retryStats()['circuitOpens'] == 1
+    # Only the requests before the circuit opened were sent
+    assert len(client._pooledSession.tokens) == 2
+
+
+def test_circuit_breaker_probes_after_the_reset_time(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retrying_client.time, 'time', lambda: now[0])
+
+    breaker = CircuitBreaker(failureThreshold=3, resetSeconds=30)
+    for _ in range(2):
+        breaker.recordFailure()
+    assert breaker.allow()
+
+    breaker.recordFailure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    now[0] += 30
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe is let through
+    assert not breaker.allow()
+
+    # A failed probe opens the circuit again
+    breaker.recordFailure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opens == 2
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.recordSuccess()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
@@ -0,0 +1,154 @@
+"""Tests for the run time fields of jobs and listing them by wall time."""
+
+import datetime
+
+import pytest
+
+from bson.objectid import ObjectId
+
+from girder.plugins.jobs.constants import JobStatus
+from girder.plugins.multiscale import walltime
+from girder.plugins.multiscale.endpoints import listing
+
+START = datetime.datetime(2018, 1, 1, 12, 0, 0)
+
+
+def stamps(*statusSeconds):
+    """Make job timestamps from (status, seconds after START) tuples."""
+    return [{'status': status,
+             'time': START + datetime.timedelta(seconds=seconds)}
+            for status, seconds in statusSeconds]
+
+
+def at(seconds):
+    return START + datetime.timedelta(seconds=seconds)
+
+
+def test_run_time_fields_of_a_queued_job():
+    job = {'timestamps': stamps((JobStatus.QUEUED, 0))}
+
+    assert walltime.runTimeFields(job) == {
+        'runStarted': None,
+        'runEnded': None,
+        'wallSeconds': None
+    }
+
+
+def test_run_time_fields_of_a_running_job():
+    job = {'timestamps': stamps((JobStatus.QUEUED, 0),
+                                (JobStatus.RUNNING, 5),
+                                (820, 6))}
+
+    assert walltime.runTimeFields(job) == {
+        'runStarted': at(5),
+        'runEnded': None,
+        'wallSeconds': None
+    }
+
+
+def test_run_time_fields_of_a_finished_job():
+    # The worker stages (fetching input, pushing output) are still
+    # running, and the job stops at its first other status
+    job = {'timestamps': stamps((JobStatus.QUEUED, 0),
+                                (JobStatus.RUNNING, 5),
+                                (820, 6),
+                                (JobStatus.RUNNING, 7),
+                                (823, 60),
+                                (JobStatus.SUCCESS, 65.5),
+                                (JobStatus.ERROR, 70))}
+
+    assert walltime.runTimeFields(job) == {
+        'runStarted': at(5),
+        'runEnded': at(65.5),
+        'wallSeconds': 60.5
+    }
+
+
+def test_run_time_fields_of_a_job_canceled_before_it_ran():
+    job = {'timestamps': stamps((JobStatus.QUEUED, 0),
+                                (JobStatus.CANCELED, 3))}
+
+    assert walltime.runTimeFields(job)['wallSeconds'] is None
+
+
+class FakeJobModel(object):
+    """Find jobs in a list with the queries of listJobs."""
+
+    def __init__(self, jobs):
+        """Initialize with the jobs to find."""
+        self.jobs = jobs
+
+    def find(self, query, sort=None, limit=0, fields=None):
+        """Find the jobs that match the wall time query, in sort order."""
+        def matches(job):
+            if job['wallSeconds'] is None:
+                return False
+
+            if '$or' not in query:
+                return True
+
+            before, tie = query['$or']
+            return (job['wallSeconds'] < before['wallSeconds']['$lt'] or
+                    (job['wallSeconds'] == tie['wallSeconds'] and
+                     job['_id'] < tie['_id']['$lt']))
+
+        found = sorted((x for x in self.jobs if matches(x)),
+                       key=lambda x: (x['wallSeconds'], x['_id']),
+                       reverse=True)
+        return found[:limit]
+
+
+@pytest.fixture
+def jobModel(monkeypatch):
+    """Make listJobs find the jobs of a new FakeJobModel."""
+    model = FakeJobModel([])
+    monkeypatch.setattr(listing, 'Job', lambda: model)
+    return model
+
+
+def test_wall_seconds_cursor_round_trip(jobModel):
+    # Ties in the wall time are broken by the job id, and the wall
+    # times survive the cursor without losing precision
+    wallSeconds = [0.1, 2.0 / 3, 2.0 / 3, 2.0 / 3, 5, 1e-7, None, 12.25]
+    jobModel.jobs.extend({'_id': ObjectId(), 'wallSeconds': x}
+                         for x in wallSeconds)
+    user = {'_id': ObjectId()}
+
+    listed = []
+    cursor = None
+    while True:
+        page = listing.listJobs(user, limit=2, cursor=cursor,
+                                sort=listing.SORT_WALL_SECONDS)
+        listed.extend(page['jobs'])
+        cursor = page['cursor']
+        if cursor is None:
+            break
+
+        assert cursor.rsplit(',', 1)[1] == str(page['jobs'][-1]['_id'])
+
+    expected = sorted((x for x in jobModel.jobs
+                       if x['wallSeconds'] is not None),
+                      key=lambda x: (x['wallSeconds'], x['_id']),
+                      reverse=True)
+    assert listed == expected
+
+
+def test_wall_seconds_cursor_query():
+    jobId = ObjectId()
+    query = listing.buildJobQuery({'_id': ObjectId()},
+                                  cursor='%r,%s' % (2.0 / 3, jobId),
+                                  sort=listing.SORT_WALL_SECONDS)
+
+    assert query['wallSeconds'] == {'$ne': None}
+    assert query['$or'] == [
+        {'wallSeconds': {'$lt': 2.0 / 3}},
+        {'wallSeconds': 2.0 / 3, '_id': {'$lt': jobId}}
+    ]
+
+
+@pytest.mark.parametrize('cursor', ['nope', '1.5', 'x,%s' % ObjectId(),
+                                    '1.5,nope'])
+def test_invalid_wall_seconds_cursor(cursor):
+    with pytest.raises(listing.RestException):
+        listing.buildJobQuery({'_id': ObjectId()}, cursor=cursor,
+                              sort=listing.SORT_WALL_SECONDS)
@@ -1,8 +1,25 @@
 """Initialize the Multiscale end points."""
 
+from girder.plugins.jobs.models.job import Job
+
+from . import retention
+from . import settings  # noqa: F401 (registers the setting validators)
+from . import walltime
 from .endpoints.multiscale import MultiscaleEndpoints
 
 
 def load(info):
     """Load the end points."""
+    # Used by the paginated job listing
+    Job().ensureIndex(([('userId', 1), ('_id', -1)], {}))
+    # Used by the wall time history of the queue estimates
+    Job().ensureIndex(([('meta.multiscale_settings.calculationType', 1),
+                        ('status', 1), ('_id', -1)], {}))
+    # Used by the job listing sorted by wall time
+    Job().ensureIndex(([('userId', 1), ('wallSeconds', -1), ('_id', -1)],
+                       {}))
+
     info['apiRoot'].multiscale = MultiscaleEndpoints()
+
+    retention.scheduleSweeps()
+    walltime.bindEvents()
@@ -0,0 +1,101 @@
+"""Create and enqueue many multiscale jobs at once."""
+
+import datetime
+import uuid
+
+from girder.models.token import Token
+from girder.plugins.jobs.constants import JobStatus
+from girder.plugins.jobs.models.job import Job
+from girder.plugins.worker import utils as workerUtils
+
+from girder_worker.docker.tasks import docker_run
+
+from . import tasks
+from . import utils
+from ..walltime import RUN_TIME_FIELDS
+
+# The scope girder_worker gives the client tokens of single jobs
+CLIENT_TOKEN_SCOPE = 'jobs.rest.create_job'
+
+
+def createJobs(user, calculationType, folderPairs, taskList):
+    """Create and save the job documents for a batch.
+
+    'folderPairs' is a list of (inputFolderId, outputFolderId) tuples,
+    and 'taskList' the (image, kwargs) tuples of their tasks. The
+    multiscale meta data is set on the jobs when they are created.
+
+    The jobs are saved through the job model, so they are validated and
+    the save events attach their jobInfoSpec, as for single jobs.
+
+    Returns the list of jobs.
+    """
+    jobs = []
+    for (inputFolderId, outputFolderId), (image, kwargs) in zip(
+            folderPairs, taskList):
+        otherFields = {
+            'celeryTaskId': str(uuid.uuid4()),
+            'meta': {
+                'multiscale_settings': utils.multiscaleSettings(
+                    inputFolderId, outputFolderId, calculationType, image)
+            }
+        }
+        # The jobs have not run yet (see walltime.py)
+        otherFields.update(dict.fromkeys(RUN_TIME_FIELDS))
+        jobs.append(Job().createJob(
+            title=tasks.celeryTask(kwargs).name, type='celery',
+            handler='celery_handler', user=user,
+            otherFields=otherFields))
+
+    return jobs
+
+
+def enqueueJobs(user, jobs, taskList):
+    """Send the tasks for already created jobs to the broker.
+
+    'taskList' is a list of (image, kwargs) tuples for docker_run (or
+    warm_docker_run, see tasks.celeryTask), in the same order as 'jobs'.
+    All of the messages are published through a single producer. Each
+    job reports back with its own job token, and the whole batch shares
+    one client token with the same scope girder_worker gives single
+    jobs.
+    """
+    clientToken = Token().createToken(user=user, scope=CLIENT_TOKEN_SCOPE)
+    apiUrl = workerUtils.getWorkerApiUrl()
+
+    with docker_run.app.producer_or_acquire() as producer:
+        for job, (image, kwargs) in zip(jobs, taskList):
+            tasks.celeryTask(kwargs).apply_async(
+                args=(image, ), kwargs=kwargs, task_id=job['celeryTaskId'],
+                producer=producer,
+                headers={
+                    'jobInfoSpec': (job.get('jobInfoSpec') or
+                                    workerUtils.jobInfoSpec(job))
+                },
+                girder_client_token=str(clientToken['_id']),
+                girder_api_url=apiUrl)
+
+    # Mark them as queued, unless a worker has already picked them up
+    now = datetime.datetime.utcnow()
+    Job().collection.update_many(
+        {'_id': {'$in': [job['_id'] for job in jobs]},
+         'status': JobStatus.INACTIVE},
+        {'$set': {'status': JobStatus.QUEUED, 'updated': now},
+         '$push': {'timestamps': {'status': JobStatus.QUEUED, 'time': now}}})
+
+
+def scheduleBatch(user, calculationType, folderPairs, **options):
+    """Create and enqueue one job per pair of input and output folders.
+
+    'calculationType' is one of the keys of tasks.CALCULATION_TASKS, and
+    its task function is called with each pair of folders along with
+    'options'.
+
+    Returns the list of job ids.
+    """
+    taskFunc = tasks.CALCULATION_TASKS[calculationType]
+    taskList = [taskFunc(inputFolderId, outputFolderId, **options)
+                for inputFolderId, outputFolderId in folderPairs]
+    jobs = createJobs(user, calculationType, folderPairs, taskList)
+    enqueueJobs(user, jobs, taskList)
+    return [str(job['_id']) for job in jobs]
@@ -0,0 +1,200 @@
+"""Queue depth and wait time estimates for multiscale jobs.
+
+The run time of each calculation type is estimated by the median wall
+time of its recent successful jobs. The jobs in each celery queue are
+then simulated, in the order they were created, on as many workers as
+there are jobs running in the queue (at least one), to estimate when a
+new job would start and finish.
+"""
+
+import datetime
+import heapq
+
+from girder.exceptions import RestException
+from girder.plugins.jobs.constants import JobStatus
+from girder.plugins.jobs.models.job import Job
+
+from . import tasks
+from ..walltime import RUNNING_STATUSES, runTimes
+
+# The queue of jobs that were not sent to a specific celery queue
+DEFAULT_QUEUE = 'celery'
+
+# The number of recent successful jobs the run time is estimated from
+HISTORY_SIZE = 50
+
+# The statuses of jobs that are waiting for a worker
+WAITING_STATUSES = (JobStatus.INACTIVE, JobStatus.QUEUED)
+
+# The maximum number of jobs a batch estimate may be made for
+MAX_COUNT = 10000
+
+
+def median(values):
+    """Get the median of a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def wallTimeHistory(calculationType):
+    """Get the wall times in seconds of recent successful jobs."""
+    jobs = Job().find({
+        'meta.multiscale_settings.calculationType': calculationType,
+        'status': JobStatus.SUCCESS
+    }, sort=[('_id', -1)], limit=HISTORY_SIZE, fields=['wallSeconds'])
+
+    return [job['wallSeconds'] for job in jobs
+            if job.get('wallSeconds') is not None]
+
+
+def activeJobs():
+    """Get the multiscale jobs that are waiting or running, oldest first."""
+    return Job().find({
+        'meta.multiscale_settings': {'$exists': True},
+        'status': {'$in': list(WAITING_STATUSES + RUNNING_STATUSES)}
+    }, sort=[('_id', 1)], fields=['status', 'runStarted', 'timestamps',
+                                  'celeryQueue',
+                                  'meta.multiscale_settings.calculationType'])
+
+
+def estimateQueue(calculationType=None, count=1, now=None):
+    """Report the queued and running jobs and estimate the wait times.
+
+    Returns a dictionary with a list of 'queues', with the number of
+    'queued' and 'running' jobs of each calculation type in each celery
+    queue, and a list of 'estimates' for each calculation type (or only
+    'calculationType'). Each estimate holds the median wall time of the
+    calculation type, and when 'count' new jobs of it would start and
+    finish, as times and as seconds from now. These are None if there
+    is no history to estimate from.
+    """
+    if calculationType is not None and \
+            calculationType not in tasks.CALCULATION_TASKS:
+        raise RestException('Unknown calculation type: %s' % calculationType)
+
+    if not 1 <= count <= MAX_COUNT:
+        raise RestException('count must be between 1 and %d.' % MAX_COUNT)
+
+    now = now or datetime.datetime.utcnow()
+    calcTypes = sorted(tasks.CALCULATION_TASKS)
+    wallSeconds = {}
+    samples = {}
+    for calcType in calcTypes:
+        history = wallTimeHistory(calcType)
+        wallSeconds[calcType] = median(history)
+        samples[calcType] = len(history)
+
+    counts = {}
+    queues = {}
+    for job in activeJobs():
+        calcType = job['meta']['multiscale_settings'].get('calculationType')
+        queue = job.get('celeryQueue') or DEFAULT_QUEUE
+        entry = counts.setdefault((calcType, queue), {
+            'calculationType': calcType,
+            'queue': queue,
+            'queued': 0,
+            'running': 0
+        })
+        jobs = queues.setdefault(queue, {'running': [], 'waiting': []})
+        if job['status'] in RUNNING_STATUSES:
+            entry['running'] += 1
+            start = job.get('runStarted')
+            if start is None:
+                # The run time fields may not be filled in yet
+                start = runTimes(job)[0]
+            jobs['running'].append((calcType, start))
+        else:
+            entry['queued'] += 1
+            jobs['waiting'].append(calcType)
+
+    # New jobs are sent to the default queue
+    freeAt = simulateQueue(queues.get(DEFAULT_QUEUE), wallSeconds, now)
+
+    estimates = []
+    for calcType in calcTypes:
+        if calculationType is not None and calcType != calculationType:
+            continue
+
+        estimate = {
+            'calculationType': calcType,
+            'count': count,
+            'medianWallSeconds': wallSeconds[calcType],
+            'samples': samples[calcType],
+            'estimatedStart': None,
+            'estimatedFinish': None,
+            'estimatedWaitSeconds': None,
+            'estimatedFinishSeconds': None
+        }
+        if freeAt is not None and wallSeconds[calcType] is not None:
+            start, finish = simulateBatch(freeAt, wallSeconds[calcType],
+                                          count)
+            estimate['estimatedStart'] = now + datetime.timedelta(
+                seconds=start)
+            estimate['estimatedFinish'] = now + datetime.timedelta(
+                seconds=finish)
+            estimate['estimatedWaitSeconds'] = start
+            estimate['estimatedFinishSeconds'] = finish
+        estimates.append(estimate)
+
+    return {
+        'time': now,
+        'queues': sorted(counts.values(), key=lambda x: (
+            x['queue'], x['calculationType'] or '')),
+        'estimates': estimates
+    }
+
+
+def simulateQueue(jobs, wallSeconds, now):
+    """Simulate the jobs of a queue on its workers.
+
+    Returns a heap with the number of seconds from now until each worker
+    is free, or None if the run time of a job in the queue is unknown.
+    """
+    if not jobs:
+        return [0.0]
+
+    freeAt = []
+    for calcType, start in jobs['running']:
+        seconds = wallSeconds.get(calcType)
+        if seconds is None:
+            return None
+        elapsed = (now - start).total_seconds() if start else 0.0
+        freeAt.append(max(seconds - elapsed, 0.0))
+
+    # There is one worker per running job. If no job is waiting, or if
+    # none is running, assume that one more worker is free.
+    if not freeAt or not jobs['waiting']:
+        freeAt.append(0.0)
+
+    heapq.heapify(freeAt)
+    for calcType in jobs['waiting']:
+        seconds = wallSeconds.get(calcType)
+        if seconds is None:
+            return None
+        heapq.heappush(freeAt, heapq.heappop(freeAt) + seconds)
+
+    return freeAt
+
+
+def simulateBatch(freeAt, seconds, count):
+    """Estimate when 'count' jobs that take 'seconds' start and finish.
+
+    Returns the number of seconds from now until the first job starts
+    and until the last one finishes.
+    """
+    freeAt = list(freeAt)
+    start = freeAt[0]
+    finish = 0.0
+    for _ in range(count):
+        end = heapq.heappop(freeAt) + seconds
+        finish = max(finish, end)
+        heapq.heappush(freeAt, end)
+
+    return start, finish
@@ -0,0 +1,63 @@
+"""Verify and pre-pull the calculation images on all of the workers.
+
+The image of each calculation type is sent to every worker with a
+celery remote control command (see multiscale_worker.images). Workers
+that do not reply within the timeout are not in the report, and
+neither are workers without the multiscale worker extensions, which
+reply with an error.
+"""
+
+from girder.exceptions import RestException
+from girder.plugins.worker import getCeleryApp
+
+from multiscale_worker.images import PREPARE_COMMAND
+
+from . import tasks
+
+# How long to wait for the replies of the workers, in seconds
+DEFAULT_TIMEOUT = 5
+MAX_TIMEOUT = 60
+
+
+def prepareImages(calculationTypes=None, pull=False,
+                  timeout=DEFAULT_TIMEOUT):
+    """Check that every worker has the images, and optionally pull them.
+
+    Pulls run in the background on the workers, so call this again
+    without 'pull' to see when they are done.
+
+    Returns a dictionary with the image of each calculation type, the
+    status of each image on each worker (by worker name), and whether
+    every worker that replied has every image.
+    """
+    calculationTypes = calculationTypes or sorted(tasks.CALCULATION_TASKS)
+    unknown = set(calculationTypes) - set(tasks.CALCULATION_TASKS)
+    if unknown:
+        raise RestException('Unknown calculation types: %s' %
+                            ', '.join(sorted(unknown)))
+
+    if not 0 < timeout <= MAX_TIMEOUT:
+        raise RestException('timeout must be between 0 and %d.' %
+                            MAX_TIMEOUT)
+
+    images = {x: tasks.calculationImage(x) for x in calculationTypes}
+    references = sorted(set(images.values()))
+    replies = getCeleryApp().control.broadcast(
+        PREPARE_COMMAND, arguments={'images': references, 'pull': pull},
+        reply=True, timeout=timeout)
+
+    # Each reply maps the name of a worker to its report
+    workers = {}
+    for reply in replies or []:
+        workers.update(reply)
+
+    ready = bool(workers) and all(
+        'error' not in report and
+        all(report.get(x, {}).get('present') for x in references)
+        for report in workers.values())
+
+    return {
+        'images': images,
+        'workers': workers,
+        'ready': ready
+    }
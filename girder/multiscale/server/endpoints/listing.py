@@ -0,0 +1,114 @@
+"""Filtered, paginated listing of multiscale jobs."""
+
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+
+from girder.exceptions import RestException
+from girder.plugins.jobs.models.job import Job
+
+# The fields that are returned when no projection is requested. The
+# log is deliberately left out, since it is by far the largest field.
+DEFAULT_FIELDS = ('_id', 'status', 'created', 'updated', 'timestamps',
+                  'title', 'meta', 'runStarted', 'runEnded', 'wallSeconds')
+
+MAX_LIMIT = 1000
+
+# The orders jobs may be listed in. Sorting by wall time only lists the
+# jobs that have stopped running (see walltime.py).
+SORT_CREATED = 'created'
+SORT_WALL_SECONDS = 'wallSeconds'
+SORTS = (SORT_CREATED, SORT_WALL_SECONDS)
+
+
+def buildJobQuery(user, statuses=None, calculationType=None,
+                  createdSince=None, createdBefore=None, updatedSince=None,
+                  updatedBefore=None, cursor=None, sort=SORT_CREATED):
+    """Build the mongo query for listing a user's multiscale jobs."""
+    query = {
+        'userId': user['_id'],
+        'meta.multiscale_settings': {'$exists': True}
+    }
+
+    if statuses:
+        try:
+            query['status'] = {'$in': [int(x) for x in statuses]}
+        except (TypeError, ValueError):
+            raise RestException(
+                'statuses must be a list of job status codes.', 400)
+
+    if calculationType:
+        query['meta.multiscale_settings.calculationType'] = calculationType
+
+    for field, since, before in (('created', createdSince, createdBefore),
+                                 ('updated', updatedSince, updatedBefore)):
+        if since is not None or before is not None:
+            query[field] = {}
+            if since is not None:
+                query[field]['$gte'] = since
+            if before is not None:
+                query[field]['$lt'] = before
+
+    if sort == SORT_WALL_SECONDS:
+        query['wallSeconds'] = {'$ne': None}
+
+    if cursor:
+        try:
+            if sort == SORT_WALL_SECONDS:
+                # The cursor is "<wall seconds>,<job id>"
+                seconds, jobId = cursor.rsplit(',', 1)
+                seconds = float(seconds)
+                query['$or'] = [
+                    {'wallSeconds': {'$lt': seconds}},
+                    {'wallSeconds': seconds, '_id': {'$lt': ObjectId(jobId)}}
+                ]
+            else:
+                query['_id'] = {'$lt': ObjectId(cursor)}
+        except (InvalidId, TypeError, ValueError):
+            raise RestException('Invalid cursor: %s' % cursor)
+
+    return query
+
+
+def listJobs(user, limit=100, fields=None, sort=SORT_CREATED, **filters):
+    """List a page of a user's multiscale jobs.
+
+    The jobs are listed newest first, or longest running first if
+    'sort' is SORT_WALL_SECONDS. 'fields' is a list of the job fields
+    to return ('_id' is always returned). 'filters' are passed to
+    buildJobQuery().
+
+    Returns a dictionary with the list of 'jobs' and the 'cursor' to
+    pass in to get the next page, which is None on the last page.
+    """
+    if limit < 1 or limit > MAX_LIMIT:
+        raise RestException('limit must be between 1 and %d.' % MAX_LIMIT)
+
+    if sort not in SORTS:
+        raise RestException('sort must be one of %s.' % ', '.join(SORTS))
+
+    projection = list(fields) if fields else list(DEFAULT_FIELDS)
+    required = ['_id']
+    if sort == SORT_WALL_SECONDS:
+        # The cursor is made from the wall time
+        required.append('wallSeconds')
+    projection.extend(x for x in required if x not in projection)
+
+    query = buildJobQuery(user, sort=sort, **filters)
+    order = [('_id', -1)]
+    if sort == SORT_WALL_SECONDS:
+        order.insert(0, ('wallSeconds', -1))
+    # Ask for one extra job to know whether there is another page
+    jobs = list(Job().find(query, sort=order, limit=limit + 1,
+                           fields=projection))
+
+    cursor = None
+    if len(jobs) > limit:
+        jobs = jobs[:limit]
+        cursor = str(jobs[-1]['_id'])
+        if sort == SORT_WALL_SECONDS:
+            cursor = '%r,%s' % (jobs[-1]['wallSeconds'], cursor)
+
+    return {
+        'jobs': jobs,
+        'cursor': cursor
+    }
@@ -1,26 +1,157 @@
 """End points for our multiscale operations."""
 
+import six
+
 from girder.api import access
+from girder.constants import AccessType
 from girder.api.describe import Description, autoDescribeRoute
 from girder.api.rest import Resource, filtermodel
-
-from girder_worker.docker.tasks import docker_run
-from girder_worker.docker.transforms import (
-    TemporaryVolume,
-    VolumePath
-)
-from girder_worker.docker.transforms.girder import (
-    GirderUploadVolumePathToFolder,
-    GirderFolderIdToVolume
-)
+from girder.exceptions import RestException
+from girder.models.setting import Setting
 
 from girder.plugins.jobs.models.job import Job
 
+from .. import retention
+from . import batch
+from . import estimates
+from . import images
+from . import listing
+from . import tasks
 from . import utils
+from ..settings import PluginSettings
+
+STREAM_OUTPUT_DESCRIPTION = ('Upload completed output files while the '
+                             'calculation is still running, instead of '
+                             'uploading everything after it finishes.')
+COMPRESSION_LEVEL_DESCRIPTION = ('The deflate level (1-9) used to repack '
+                                 'NetCDF (e.g. Exodus) and HDF5 (e.g. '
+                                 'Dream3D) output before it is uploaded. '
+                                 '0 disables compression. Defaults to the '
+                                 'multiscale.output_compression_level '
+                                 'setting.')
+CPUS_DESCRIPTION = ('The number of CPUs the calculation may use (e.g. 1.5). '
+                    'Defaults to the limit of the calculation type in the '
+                    'multiscale.resource_limits setting.')
+MEMORY_DESCRIPTION = ('The memory limit of the calculation in MB. Defaults '
+                      'to the limit of the calculation type in the '
+                      'multiscale.resource_limits setting.')
+MAX_RUN_SECONDS_DESCRIPTION = ('The maximum run time of the calculation in '
+                               'seconds, after which it is stopped. '
+                               'Defaults to the limit of the calculation '
+                               'type in the multiscale.resource_limits '
+                               'setting.')
+PIPELINES_DESCRIPTION = ('A JSON list of the Dream3D pipeline files (e.g. '
+                         '["mesh.json", "stats.json"]) in the input folder '
+                         'to run. By default, every .json file in the '
+                         'input folder is run.')
+PIPELINE_CONCURRENCY_DESCRIPTION = ('The number of Dream3D pipelines that '
+                                    'run at the same time.')
+OUTPUT_MANIFEST_DESCRIPTION = ('A JSON object that selects the output files '
+                               'to upload, with lists of "include" and '
+                               '"exclude" glob patterns, and the '
+                               '"maxFileMB" and "maxTotalMB" size limits. '
+                               'Replaces the default manifest of the '
+                               'calculation type.')
+BATCH_FOLDERS_DESCRIPTION = ('A JSON list of objects, each with an '
+                             '"inputFolderId" and an "outputFolderId". '
+                             'One job is created for each object.')
+
+# The maximum number of jobs that may be created in one batch
+MAX_BATCH_SIZE = 10000
+
+# The maximum number of Dream3D pipelines that may run at the same time
+MAX_PIPELINE_CONCURRENCY = 32
+
+
+def _describeLimits(description):
+    """Add the resource limit parameters of the run end points."""
+    return (
+        description
+        .param('cpus', CPUS_DESCRIPTION, paramType='query',
+               dataType='number', required=False)
+        .param('memoryMB', MEMORY_DESCRIPTION, paramType='query',
+               dataType='integer', required=False)
+        .param('maxRunSeconds', MAX_RUN_SECONDS_DESCRIPTION,
+               paramType='query', dataType='integer', required=False))
+
+
+def _describeManifest(description):
+    """Add the output manifest parameter of the run end points."""
+    return description.jsonParam(
+        'outputManifest', OUTPUT_MANIFEST_DESCRIPTION, paramType='query',
+        requireObject=True, required=False)
+
+
+def _describeBatch(description):
+    """Add the parameters that are common to all batch end points."""
+    return _describeManifest(_describeLimits(
+        description
+        .jsonParam('folders', BATCH_FOLDERS_DESCRIPTION, paramType='body',
+                   requireArray=True)
+        .param('streamOutput', STREAM_OUTPUT_DESCRIPTION,
+               paramType='query', dataType='boolean', required=False,
+               default=False)
+        .param('compressionLevel', COMPRESSION_LEVEL_DESCRIPTION,
+               paramType='query', dataType='integer', required=False)))
+
+
+def _describePipelines(description):
+    """Add the pipeline parameters of the Dream3D end points."""
+    return (
+        description
+        .jsonParam('pipelines', PIPELINES_DESCRIPTION, paramType='query',
+                   requireArray=True, required=False)
+        .param('pipelineConcurrency', PIPELINE_CONCURRENCY_DESCRIPTION,
+               paramType='query', dataType='integer', required=False,
+               default=1))
+
+
+def _pipelineOptions(pipelines, pipelineConcurrency):
+    """Validate the pipeline parameters and get the task options."""
+    if not 1 <= pipelineConcurrency <= MAX_PIPELINE_CONCURRENCY:
+        raise RestException('pipelineConcurrency must be between 1 and %d.' %
+                            MAX_PIPELINE_CONCURRENCY)
+
+    if pipelines is not None:
+        for pipeline in pipelines:
+            if (not isinstance(pipeline, six.string_types) or
+                    not pipeline.endswith('.json') or '/' in pipeline or
+                    pipeline.startswith('.')):
+                raise RestException('Each pipeline must be the name of a '
+                                    '.json file in the input folder.')
+
+        if not pipelines:
+            raise RestException('At least one pipeline is required.')
 
-ALBANY_IMAGE = 'openchemistry/albany'
-DREAM3D_IMAGE = 'openchemistry/dream3d'
-SMTK_IMAGE = 'openchemistry/smtk'
+        if len(set(pipelines)) != len(pipelines):
+            raise RestException('Each pipeline may only be listed once.')
+
+    return {
+        'pipelines': pipelines,
+        'pipelineConcurrency': pipelineConcurrency
+    }
+
+
+def _folderPairs(folders):
+    """Validate the folders of a batch and get (input, output) tuples."""
+    if not folders:
+        raise RestException('At least one pair of folders is required.')
+
+    if len(folders) > MAX_BATCH_SIZE:
+        raise RestException('A batch may contain at most %d jobs.' %
+                            MAX_BATCH_SIZE)
+
+    pairs = []
+    for entry in folders:
+        if (not isinstance(entry, dict) or
+                not entry.get('inputFolderId') or
+                not entry.get('outputFolderId')):
+            raise RestException('Each entry in folders must have an '
+                                '"inputFolderId" and an "outputFolderId".')
+        pairs.append((str(entry['inputFolderId']),
+                      str(entry['outputFolderId'])))
+
+    return pairs
 
 
 class MultiscaleEndpoints(Resource):
@@ -35,10 +166,38 @@ class MultiscaleEndpoints(Resource):
                    self.run_dream3d)
         self.route('POST', ('run_smtk_mesh_placement', ),
                    self.run_smtk_mesh_placement)
+        self.route('POST', ('run_albany_batch', ),
+                   self.run_albany_batch)
+        self.route('POST', ('run_dream3d_batch', ),
+                   self.run_dream3d_batch)
+        self.route('POST', ('run_smtk_mesh_placement_batch', ),
+                   self.run_smtk_mesh_placement_batch)
+        self.route('GET', ('jobs', ),
+                   self.list_jobs)
+        self.route('GET', ('queue', ),
+                   self.get_queue)
+        self.route('GET', ('jobs', ':id', 'progress'),
+                   self.get_progress)
+        self.route('GET', ('jobs', ':id', 'summary'),
+                   self.get_summary)
+        self.route('PUT', ('jobs', ':id', 'summary'),
+                   self.set_summary)
+        self.route('PUT', ('jobs', ':id', 'upload_stats'),
+                   self.set_upload_stats)
+        self.route('PUT', ('jobs', ':id', 'timing'),
+                   self.set_timing)
+        self.route('PUT', ('jobs', ':id', 'image'),
+                   self.set_image)
+        self.route('GET', ('retention', ),
+                   self.get_retention_report)
+        self.route('POST', ('retention', 'sweep'),
+                   self.sweep_retention)
+        self.route('POST', ('images', 'prepare'),
+                   self.prepare_images)
 
     @access.token
     @filtermodel(model=Job)
-    @autoDescribeRoute(
+    @autoDescribeRoute(_describeManifest(_describeLimits(
         Description('Run Albany from a girder folder')
         .param('inputFolderId', 'The id of the input folder on girder.'
                '"input.yaml" must be inside, along with any other '
@@ -46,80 +205,82 @@ class MultiscaleEndpoints(Resource):
                'specified output folder.',
                paramType='query', dataType='string', required='True')
         .param('outputFolderId', 'The id of the output folder on girder.',
-               paramType='query', dataType='string', required='True'))
-    def run_albany(self, params):
+               paramType='query', dataType='string', required='True')
+        .param('streamOutput', STREAM_OUTPUT_DESCRIPTION,
+               paramType='query', dataType='boolean', required=False,
+               default=False)
+        .param('compressionLevel', COMPRESSION_LEVEL_DESCRIPTION,
+               paramType='query', dataType='integer', required=False))))
+    def run_albany(self, streamOutput, compressionLevel, cpus, memoryMB,
+                   maxRunSeconds, outputManifest, params):
         """Run albany on a folder that is on girder.
 
         Will store the output in the specified output folder.
         """
         inputFolderId = params.get('inputFolderId')
         outputFolderId = params.get('outputFolderId')
-        filename = 'input.yaml'
-        folder_name = 'workingDir'
-        volume = GirderFolderIdToVolume(
-            inputFolderId,
-            volume=TemporaryVolume.default,
-            folder_name=folder_name)
-        outputDir = inputFolderId + '/' + folder_name + '/output.exo'
-        volumepath = VolumePath(outputDir, volume=TemporaryVolume.default)
-        result = docker_run.delay(
-            ALBANY_IMAGE, pull_image=False, container_args=[filename],
-            entrypoint='/usr/local/albany/bin/AlbanyT', remove_container=True,
-            working_dir=volume,
-            girder_result_hooks=[
-                GirderUploadVolumePathToFolder(volumepath, outputFolderId)
-            ])
+        limits = utils.getResourceLimits(
+            'albany', cpus=cpus, memoryMB=memoryMB,
+            maxRunSeconds=maxRunSeconds)
+        utils.validateOutputManifest(outputManifest)
+        image, kwargs = tasks.albanyTask(
+            inputFolderId, outputFolderId, streamOutput=streamOutput,
+            compressionLevel=compressionLevel, limits=limits,
+            outputManifest=outputManifest)
+        result = tasks.celeryTask(kwargs).delay(image, **kwargs)
 
         # Set the multiscale meta data and return the job
         jobId = result.job['_id']
         return utils.setMultiscaleMetaData(jobId, inputFolderId,
-                                           outputFolderId)
+                                           outputFolderId, 'albany', image)
 
     @access.token
     @filtermodel(model=Job)
-    @autoDescribeRoute(
+    @autoDescribeRoute(_describeManifest(_describePipelines(_describeLimits(
         Description('Run Dream3D from a girder folder')
-        .param('inputFolderId', 'The id of the input folder on girder.'
-               '"input.json" must be inside, along with any other '
-               'necessary input files. Note: all output must be saved '
+        .param('inputFolderId', 'The id of the input folder on girder. '
+               'The pipeline (.json) files must be inside, along with any '
+               'other necessary input files. Note: all output must be saved '
                'in a directory called \'./output/\' - only files from this '
-               'directory will be uploaded to the output folder on girder.',
+               'directory will be uploaded to the output folder on girder. '
+               'When several pipelines are run, the output of each one is '
+               'in a subfolder named after the pipeline.',
                paramType='query', dataType='string', required='True')
         .param('outputFolderId', 'The id of the output folder on girder.',
-               paramType='query', dataType='string', required='True'))
-    def run_dream3d(self, params):
+               paramType='query', dataType='string', required='True')
+        .param('streamOutput', STREAM_OUTPUT_DESCRIPTION,
+               paramType='query', dataType='boolean', required=False,
+               default=False)
+        .param('compressionLevel', COMPRESSION_LEVEL_DESCRIPTION,
+               paramType='query', dataType='integer', required=False)))))
+    def run_dream3d(self, streamOutput, compressionLevel, cpus, memoryMB,
+                    maxRunSeconds, pipelines, pipelineConcurrency,
+                    outputManifest, params):
         """Run Dream3D on a folder that is on girder.
 
         Will store the output in the specified output folder.
         """
         inputFolderId = params.get('inputFolderId')
         outputFolderId = params.get('outputFolderId')
-        folder_name = 'workingDir'
-        volume = GirderFolderIdToVolume(
-            inputFolderId,
-            volume=TemporaryVolume.default,
-            folder_name=folder_name)
-        outputDir = inputFolderId + '/' + folder_name + '/output'
-        volumepath = VolumePath(outputDir, volume=TemporaryVolume.default)
-        result = docker_run.delay(
-            DREAM3D_IMAGE, pull_image=False,
-            container_args=[
-                '-c',
-                'bash /root/runPipelineRunner $(ls *.json | head -1)'
-            ],
-            remove_container=True, working_dir=volume, entrypoint='bash',
-            girder_result_hooks=[
-                GirderUploadVolumePathToFolder(volumepath, outputFolderId)
-            ])
+        limits = utils.getResourceLimits(
+            'dream3d', cpus=cpus, memoryMB=memoryMB,
+            maxRunSeconds=maxRunSeconds)
+        utils.validateOutputManifest(outputManifest)
+        image, kwargs = tasks.dream3dTask(
+            inputFolderId, outputFolderId, streamOutput=streamOutput,
+            compressionLevel=compressionLevel, limits=limits,
+            outputManifest=outputManifest,
+            **_pipelineOptions(pipelines, pipelineConcurrency))
+        result = tasks.celeryTask(kwargs).delay(image, **kwargs)
 
         # Set the multiscale meta data and return the job
         jobId = result.job['_id']
         return utils.setMultiscaleMetaData(jobId, inputFolderId,
-                                           outputFolderId)
+                                           outputFolderId, 'dream3d', image)
 
     @access.token
     @filtermodel(model=Job)
-    @autoDescribeRoute(
+    @autoDescribeRoute(_describeManifest(_describeLimits(
         Description('Run smtk mesh placement from a girder folder')
         .param('inputFolderId', 'The id of the input folder on girder.'
                '"input.json" must be inside, along with any other '
@@ -127,41 +288,298 @@ class MultiscaleEndpoints(Resource):
                'specified output folder.',
                paramType='query', dataType='string', required='True')
         .param('outputFolderId', 'The id of the output folder on girder.',
-               paramType='query', dataType='string', required='True'))
-    def run_smtk_mesh_placement(self, params):
+               paramType='query', dataType='string', required='True')
+        .param('streamOutput', STREAM_OUTPUT_DESCRIPTION,
+               paramType='query', dataType='boolean', required=False,
+               default=False)
+        .param('compressionLevel', COMPRESSION_LEVEL_DESCRIPTION,
+               paramType='query', dataType='integer', required=False))))
+    def run_smtk_mesh_placement(self, streamOutput, compressionLevel, cpus,
+                                memoryMB, maxRunSeconds, outputManifest,
+                                params):
         """Run an smtk mesh placement on a folder that is on girder.
 
         Will store the output in the specified output folder.
         """
         inputFolderId = params.get('inputFolderId')
         outputFolderId = params.get('outputFolderId')
-        folder_name = 'workingDir'
-        volume = GirderFolderIdToVolume(
-            inputFolderId,
-            volume=TemporaryVolume.default,
-            folder_name=folder_name)
-        outputDir = inputFolderId + '/' + folder_name + '/output/'
-        volumepath = VolumePath(outputDir, volume=TemporaryVolume.default)
-        result = docker_run.delay(
-            SMTK_IMAGE,
-            pull_image=False,
-            container_args=[
-                '-c',
-                ('. ~/setupEnvironment; '
-                 'python /usr/local/afrl-automation/runner.py input.json; '
-                 'mkdir output; '
-                 'mv input.yaml output/; '
-                 'mv elastic.yaml output/;'
-                 'mv *BC.exo output/')],
-            entrypoint='bash',
-            remove_container=True,
-            working_dir=volume,
-            girder_result_hooks=[
-                GirderUploadVolumePathToFolder(
-                    volumepath,
-                    outputFolderId)])
+        limits = utils.getResourceLimits(
+            'smtk', cpus=cpus, memoryMB=memoryMB,
+            maxRunSeconds=maxRunSeconds)
+        utils.validateOutputManifest(outputManifest)
+        image, kwargs = tasks.smtkMeshPlacementTask(
+            inputFolderId, outputFolderId, streamOutput=streamOutput,
+            compressionLevel=compressionLevel, limits=limits,
+            outputManifest=outputManifest)
+        result = tasks.celeryTask(kwargs).delay(image, **kwargs)
 
         # Set the multiscale meta data and return the job
         jobId = result.job['_id']
         return utils.setMultiscaleMetaData(jobId, inputFolderId,
-                                           outputFolderId)
+                                           outputFolderId, 'smtk', image)
+
+    @access.token
+    @autoDescribeRoute(
+        _describeBatch(Description(
+            'Run Albany on many girder folders. Returns the list of '
+            'job ids.')))
+    def run_albany_batch(self, folders, streamOutput, compressionLevel, cpus,
+                         memoryMB, maxRunSeconds, outputManifest):
+        """Run albany on each pair of input and output folders."""
+        limits = utils.getResourceLimits(
+            'albany', cpus=cpus, memoryMB=memoryMB,
+            maxRunSeconds=maxRunSeconds)
+        utils.validateOutputManifest(outputManifest)
+        return batch.scheduleBatch(
+            self.getCurrentUser(), 'albany', _folderPairs(folders),
+            streamOutput=streamOutput, compressionLevel=compressionLevel,
+            limits=limits, outputManifest=outputManifest)
+
+    @access.token
+    @autoDescribeRoute(
+        _describePipelines(_describeBatch(Description(
+            'Run Dream3D on many girder folders. Returns the list of '
+            'job ids.'))))
+    def run_dream3d_batch(self, folders, streamOutput, compressionLevel,
+                          cpus, memoryMB, maxRunSeconds, outputManifest,
+                          pipelines, pipelineConcurrency):
+        """Run Dream3D on each pair of input and output folders."""
+        limits = utils.getResourceLimits(
+            'dream3d', cpus=cpus, memoryMB=memoryMB,
+            maxRunSeconds=maxRunSeconds)
+        utils.validateOutputManifest(outputManifest)
+        return batch.scheduleBatch(
+            self.getCurrentUser(), 'dream3d', _folderPairs(folders),
+            streamOutput=streamOutput, compressionLevel=compressionLevel,
+            limits=limits, outputManifest=outputManifest,
+            **_pipelineOptions(pipelines, pipelineConcurrency))
+
+    @access.token
+    @autoDescribeRoute(
+        _describeBatch(Description(
+            'Run smtk mesh placements on many girder folders. Returns the '
+            'list of job ids.')))
+    def run_smtk_mesh_placement_batch(self, folders, streamOutput,
+                                      compressionLevel, cpus, memoryMB,
+                                      maxRunSeconds, outputManifest):
+        """Run an smtk mesh placement on each pair of folders."""
+        limits = utils.getResourceLimits(
+            'smtk', cpus=cpus, memoryMB=memoryMB,
+            maxRunSeconds=maxRunSeconds)
+        utils.validateOutputManifest(outputManifest)
+        return batch.scheduleBatch(
+            self.getCurrentUser(), 'smtk',
+            _folderPairs(folders), streamOutput=streamOutput,
+            compressionLevel=compressionLevel, limits=limits,
+            outputManifest=outputManifest)
+
+    @access.token
+    @autoDescribeRoute(
+        Description('List the multiscale jobs of the current user, newest '
+                    'first. Returns an object with the page of "jobs" and '
+                    'the "cursor" for the next page (null on the last '
+                    'page).')
+        .notes('With sort=wallSeconds, only the jobs that have stopped '
+               'running are listed, longest running first.')
+        .jsonParam('statuses', 'A JSON list of job status codes to include.',
+                   paramType='query', requireArray=True, required=False)
+        .param('calculationType', 'Only include jobs of this calculation '
+               'type (e.g. "albany").', paramType='query', required=False)
+        .param('createdSince', 'Only include jobs created at or after this '
+               'time.', paramType='query', dataType='dateTime',
+               required=False)
+        .param('createdBefore', 'Only include jobs created before this '
+               'time.', paramType='query', dataType='dateTime',
+               required=False)
+        .param('updatedSince', 'Only include jobs updated at or after this '
+               'time.', paramType='query', dataType='dateTime',
+               required=False)
+        .param('updatedBefore', 'Only include jobs updated before this '
+               'time.', paramType='query', dataType='dateTime',
+               required=False)
+        .param('cursor', 'The cursor returned with the previous page.',
+               paramType='query', required=False)
+        .param('sort', 'The order of the jobs.', paramType='query',
+               required=False, enum=listing.SORTS,
+               default=listing.SORT_CREATED)
+        .param('limit', 'The maximum number of jobs to return (at most '
+               '%d).' % listing.MAX_LIMIT, paramType='query',
+               dataType='integer', required=False, default=100)
+        .jsonParam('fields', 'A JSON list of the job fields to return. By '
+                   'default, everything except the log is returned.',
+                   paramType='query', requireArray=True, required=False))
+    def list_jobs(self, statuses, calculationType, createdSince,
+                  createdBefore, updatedSince, updatedBefore, cursor, sort,
+                  limit, fields):
+        """List a filtered page of the current user's multiscale jobs."""
+        return listing.listJobs(
+            self.getCurrentUser(), limit=limit, fields=fields, sort=sort,
+            statuses=statuses, calculationType=calculationType,
+            createdSince=createdSince, createdBefore=createdBefore,
+            updatedSince=updatedSince, updatedBefore=updatedBefore,
+            cursor=cursor)
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Get the number of queued and running multiscale jobs, '
+                    'and estimate when new jobs would start and finish.')
+        .notes('The run time of each calculation type is the median wall '
+               'time of its last %d successful jobs. The estimates are '
+               'null when a calculation type has no history yet.' %
+               estimates.HISTORY_SIZE)
+        .param('calculationType', 'Only estimate for this calculation type '
+               '(e.g. "albany").', paramType='query', required=False)
+        .param('count', 'The number of new jobs to estimate for, e.g. the '
+               'size of a batch.', paramType='query', dataType='integer',
+               required=False, default=1))
+    def get_queue(self, calculationType, count):
+        """Report the queue depth and the estimated wait times."""
+        return estimates.estimateQueue(calculationType, count)
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Get the status and the progress of a multiscale job, '
+                    'without its log.')
+        .notes('The progress "stage" is "staging", "solving" or '
+               '"uploading", or null before the job starts. "total" is 0 '
+               'when the length of the stage is unknown.')
+        .param('id', 'The id of the job.', paramType='path'))
+    def get_progress(self, id):
+        """Get the status and the latest progress event of a job."""
+        job = Job().load(id, user=self.getCurrentUser(),
+                         level=AccessType.READ, fields=utils.PROGRESS_FIELDS,
+                         exc=True)
+        return utils.jobProgress(job)
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Get the summary of the output of a multiscale job. '
+                    'Returns null if the output has not been summarized.')
+        .modelParam('id', 'The id of the job.', model=Job,
+                    level=AccessType.READ))
+    def get_summary(self, job):
+        """Get the output summary stored in the meta data of a job."""
+        return job.get('meta', {}).get('multiscale_summary')
+
+    @access.token
+    @autoDescribeRoute(
+        Description('Set the summary of the output of a multiscale job.')
+        .notes('This is called by the worker once the output has been '
+               'summarized. It accepts the job token as well as the '
+               'token of a user with write access to the job.')
+        .modelParam('id', 'The id of the job.', model=Job, force=True)
+        .jsonParam('summary', 'The summary as a JSON object with a list of '
+                   '"files".', paramType='body', requireObject=True))
+    def set_summary(self, job, summary):
+        """Store the output summary in the meta data of a job."""
+        self._requireJobWriteAccess(job)
+        utils.setOutputSummary(job, summary)
+        return summary
+
+    @access.token
+    @autoDescribeRoute(
+        Description('Set the statistics of the output upload of a multiscale '
+                    'job.')
+        .notes('This is called by the worker once the output has been '
+               'uploaded. It accepts the job token as well as the token of '
+               'a user with write access to the job.')
+        .modelParam('id', 'The id of the job.', model=Job, force=True)
+        .jsonParam('stats', 'The statistics as a JSON object with the number '
+                   'of "files", the "bytes", the "seconds" and the '
+                   '"bytesPerSecond" of the upload.', paramType='body',
+                   requireObject=True))
+    def set_upload_stats(self, job, stats):
+        """Store the upload statistics in the meta data of a job."""
+        self._requireJobWriteAccess(job)
+        utils.setUploadStats(job, stats)
+        return stats
+
+    @access.token
+    @autoDescribeRoute(
+        Description('Set the queue and start timing of a multiscale job.')
+        .notes('This is called by the worker when a job that ran in a warm '
+               'container finishes. It accepts the job token as well as the '
+               'token of a user with write access to the job.')
+        .modelParam('id', 'The id of the job.', model=Job, force=True)
+        .jsonParam('timing', 'The timing as a JSON object, e.g. with '
+                   '"queueToStartSeconds", "runSeconds" and whether the '
+                   'container was "warm".', paramType='body',
+                   requireObject=True))
+    def set_timing(self, job, timing):
+        """Store the run timing in the meta data of a job."""
+        self._requireJobWriteAccess(job)
+        utils.setRunTiming(job, timing)
+        return timing
+
+    @access.token
+    @autoDescribeRoute(
+        Description('Set the docker image that ran a multiscale job.')
+        .notes('This is called by the worker before it runs the job, with '
+               'the image that the reference of the job resolved to on the '
+               'worker. It accepts the job token as well as the token of a '
+               'user with write access to the job.')
+        .modelParam('id', 'The id of the job.', model=Job, force=True)
+        .jsonParam('image', 'The image as a JSON object with its '
+                   '"reference", its "id" and its "repoDigests".',
+                   paramType='body', requireObject=True))
+    def set_image(self, job, image):
+        """Store the resolved image in the meta data of a job."""
+        self._requireJobWriteAccess(job)
+        utils.setResolvedImage(job, image)
+        return image
+
+    def _requireJobWriteAccess(self, job):
+        """Require the job token or write access to a job."""
+        user = self.getCurrentUser()
+        if user is None:
+            # Job tokens may only update their own job
+            self.ensureTokenScopes('jobs.job_' + str(job['_id']))
+        else:
+            Job().requireAccess(job, user, level=AccessType.WRITE)
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get the report of the last retention sweep.')
+        .notes('The report holds the number of jobs and folders that were '
+               'deleted, the bytes that were reclaimed, and the number of '
+               'jobs deleted for each reason ("maxAge" or "maxMBPerUser").'))
+    def get_retention_report(self):
+        """Get the report of the last retention sweep."""
+        return Setting().get(PluginSettings.RETENTION_REPORT)
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Delete the finished jobs and job folders that the '
+                    'retention policy does not keep, and return a report.')
+        .notes('The policy is set in the multiscale.retention setting. '
+               'Sweeps also run in the background every '
+               '"sweepIntervalHours" of the policy.')
+        .param('dryRun', 'Only report what would be deleted.',
+               paramType='query', dataType='boolean', required=False,
+               default=False))
+    def sweep_retention(self, dryRun):
+        """Run a retention sweep now."""
+        return retention.sweep(dryRun=dryRun)
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Verify or pre-pull the calculation images on all of '
+                    'the workers.')
+        .notes('The image of each calculation type is set in the '
+               'multiscale.images setting. The report holds the status of '
+               'each image on each worker that replied, and whether they '
+               'are all "ready". Pulls run in the background, so call this '
+               'again without "pull" to see when they are done.')
+        .jsonParam('calculationTypes', 'The calculation types whose images '
+                   'to prepare, as a JSON list (default: all of them).',
+                   paramType='query', required=False, requireArray=True)
+        .param('pull', 'Start pulling the images that a worker is missing.',
+               paramType='query', dataType='boolean', required=False,
+               default=False)
+        .param('timeout', 'How long to wait for the replies of the workers, '
+               'in seconds.', paramType='query', dataType='number',
+               required=False, default=images.DEFAULT_TIMEOUT))
+    def prepare_images(self, calculationTypes, pull, timeout):
+        """Check the images on the workers and optionally pull them."""
+        return images.prepareImages(calculationTypes, pull=pull,
+                                    timeout=timeout)
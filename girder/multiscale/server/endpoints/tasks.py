@@ -0,0 +1,260 @@
+"""The docker_run arguments for each multiscale calculation.
+
+Each function takes the input and output folder ids of a calculation
+and returns a tuple of the docker image and the keyword arguments for
+docker_run, so that the same calculation can be scheduled by both the
+single and the batch end points. The images default to the tags below,
+and may be pinned to digests with the multiscale.images setting (see
+calculationImage). 'limits' are the resource limits of the container,
+from utils.getResourceLimits(). 'outputManifest' selects the output
+files to upload (see multiscale_worker.manifest), and defaults to the
+manifest of the calculation type below.
+
+The arguments are for docker_run, unless the job runs in a warm
+container, in which case they are for warm_docker_run (see celeryTask).
+"""
+
+import time
+
+from girder.models.setting import Setting
+from girder_worker.docker.tasks import docker_run
+from girder_worker.docker.transforms import VolumePath
+
+from multiscale_worker.pool import warm_docker_run
+from multiscale_worker.progress import AlbanyProgressStdOut
+
+from . import utils
+from ..settings import PluginSettings
+
+ALBANY_IMAGE = 'openchemistry/albany'
+DREAM3D_IMAGE = 'openchemistry/dream3d'
+SMTK_IMAGE = 'openchemistry/smtk'
+
+# The default image of each calculation type
+DEFAULT_IMAGES = {
+    'albany': ALBANY_IMAGE,
+    'dream3d': DREAM3D_IMAGE,
+    'smtk': SMTK_IMAGE
+}
+
+# Initializes the environment of the smtk container
+SMTK_SETUP = '. ~/setupEnvironment'
+SMTK_COMMAND = 'python /usr/local/afrl-automation/runner.py input.json'
+
+# The default output manifests. The patterns of Albany and smtk are
+# relative to the working directory, and those of Dream3D to ./output/.
+ALBANY_OUTPUT_MANIFEST = {'include': ['output.exo']}
+DREAM3D_OUTPUT_MANIFEST = {}
+SMTK_OUTPUT_MANIFEST = {'include': ['input.yaml', 'elastic.yaml', '*BC.exo']}
+
+# Runs Dream3D pipelines with bash. The first argument is the number of
+# pipelines to run at the same time, and the others are the pipelines
+# (all of the *.json files by default). A single pipeline runs in the
+# working directory and writes to ./output/ as before. Otherwise, each
+# pipeline runs in its own directory, with links to the input files,
+# and its output is moved to ./output/<pipeline name>/ along with its
+# log. The run time of each pipeline is printed and written to
+# ./output/pipeline_timings.csv.
+DREAM3D_SCRIPT = r'''
+concurrency=$1
+shift
+if [ $# -eq 0 ]; then
+    shopt -s nullglob
+    set -- *.json
+fi
+if [ $# -eq 0 ]; then
+    echo "Error: no Dream3D pipelines (*.json) were found." >&2
+    exit 1
+fi
+for pipeline in "$@"; do
+    if [ ! -f "$pipeline" ]; then
+        echo "Error: the pipeline $pipeline was not found." >&2
+        exit 1
+    fi
+done
+
+mkdir -p output
+timings=output/pipeline_timings.csv
+echo "pipeline,exitCode,seconds" > "$timings"
+
+reportTiming() {
+    seconds=$(printf '%d.%03d' $(($3 / 1000)) $(($3 % 1000)))
+    echo "$1,$2,$seconds" >> "$timings"
+    echo "Pipeline $1 finished in $seconds s (exit code $2)"
+}
+
+runPipeline() {
+    pipeline=$1
+    name=${pipeline%.json}
+    dir=.pipelines/$name
+    mkdir -p "$dir"
+    for entry in *; do
+        [ "$entry" = output ] || ln -s "../../$entry" "$dir/$entry"
+    done
+
+    start=$(date +%s%N)
+    (cd "$dir" && bash /root/runPipelineRunner "$pipeline") \
+        > "$dir.log" 2>&1
+    status=$?
+    elapsed=$((($(date +%s%N) - start) / 1000000))
+
+    if [ -d "$dir/output" ]; then
+        mv "$dir/output" "output/$name"
+    else
+        mkdir -p "output/$name"
+    fi
+    mv "$dir.log" "output/$name/pipeline.log"
+    while IFS= read -r line; do
+        printf '[%s] %s\n' "$name" "$line"
+    done < "output/$name/pipeline.log"
+
+    reportTiming "$name" $status $elapsed
+    [ $status -eq 0 ]
+}
+
+if [ $# -eq 1 ]; then
+    start=$(date +%s%N)
+    bash /root/runPipelineRunner "$1"
+    status=$?
+    reportTiming "${1%.json}" $status \
+        $((($(date +%s%N) - start) / 1000000))
+    exit $status
+fi
+
+export timings
+export -f reportTiming runPipeline
+echo "Running $# pipelines, $concurrency at a time"
+printf '%s\0' "$@" |
+    xargs -0 -n 1 -P "$concurrency" bash -c 'runPipeline "$1"' runPipeline
+status=$?
+rm -rf .pipelines
+
+if [ $status -ne 0 ]; then
+    failed=$(tail -n +2 "$timings" | awk -F, '$2 != 0' | wc -l)
+    echo "Error: $failed of $# pipelines failed." >&2
+    exit 1
+fi
+'''
+
+
+def calculationImage(calculationType):
+    """Get the docker image reference of a calculation type."""
+    images = Setting().get(PluginSettings.IMAGES)
+    return images.get(calculationType) or DEFAULT_IMAGES[calculationType]
+
+
+def albanyTask(inputFolderId, outputFolderId, streamOutput=False,
+               compressionLevel=None, limits=None, outputManifest=None):
+    """Get the docker_run arguments to run albany on a girder folder."""
+    filename = 'input.yaml'
+    folder_name = 'workingDir'
+    scratch = utils.createWorkingVolume('albany', inputFolderId)
+    volume = utils.createInputVolume(inputFolderId, folder_name, scratch)
+    outputDir = inputFolderId + '/' + folder_name
+    volumepath = VolumePath(outputDir, volume=scratch)
+    if outputManifest is None:
+        outputManifest = ALBANY_OUTPUT_MANIFEST
+    workingDir, resultHooks = utils.createOutputTransforms(
+        volume, volumepath, outputFolderId, streamOutput,
+        compressionLevel, summarize=True, manifest=outputManifest)
+    return calculationImage('albany'), utils.applyResourceLimits({
+        'pull_image': False,
+        'container_args': [filename],
+        'entrypoint': '/usr/local/albany/bin/AlbanyT',
+        'remove_container': True,
+        'volumes': utils.extraVolumes(scratch),
+        'working_dir': workingDir,
+        # Parses the solver steps from the output for the job progress
+        'stream_connectors': [AlbanyProgressStdOut()],
+        'girder_result_hooks': resultHooks
+    }, limits)
+
+
+def dream3dTask(inputFolderId, outputFolderId, streamOutput=False,
+                compressionLevel=None, limits=None, pipelines=None,
+                pipelineConcurrency=1, outputManifest=None):
+    """Get the docker_run arguments to run Dream3D on a girder folder.
+
+    'pipelines' is the list of pipeline files to run, or None to run
+    every *.json file in the folder. Up to 'pipelineConcurrency' of them
+    run at the same time in the container.
+    """
+    folder_name = 'workingDir'
+    scratch = utils.createWorkingVolume('dream3d', inputFolderId)
+    volume = utils.createInputVolume(inputFolderId, folder_name, scratch)
+    outputDir = inputFolderId + '/' + folder_name + '/output'
+    volumepath = VolumePath(outputDir, volume=scratch)
+    if outputManifest is None:
+        outputManifest = DREAM3D_OUTPUT_MANIFEST
+    workingDir, resultHooks = utils.createOutputTransforms(
+        volume, volumepath, outputFolderId, streamOutput,
+        compressionLevel, manifest=outputManifest)
+    return calculationImage('dream3d'), utils.applyResourceLimits({
+        'pull_image': False,
+        'container_args': [
+            '-c', DREAM3D_SCRIPT, 'dream3d', str(pipelineConcurrency)
+        ] + list(pipelines or []),
+        'remove_container': True,
+        'volumes': utils.extraVolumes(scratch),
+        'working_dir': workingDir,
+        'entrypoint': 'bash',
+        'girder_result_hooks': resultHooks
+    }, limits)
+
+
+def smtkMeshPlacementTask(inputFolderId, outputFolderId, streamOutput=False,
+                          compressionLevel=None, limits=None,
+                          outputManifest=None):
+    """Get the docker_run arguments to run an smtk mesh placement.
+
+    If the warm pool of smtk is enabled, the arguments are for
+    warm_docker_run instead.
+    """
+    warmPool = Setting().get(PluginSettings.SMTK_WARM_POOL)
+    warm = warmPool.get('enabled', False)
+    folder_name = 'workingDir'
+    scratch = utils.createWorkingVolume('smtk', inputFolderId,
+                                        warmPool=warm)
+    volume = utils.createInputVolume(inputFolderId, folder_name, scratch)
+    outputDir = inputFolderId + '/' + folder_name
+    volumepath = VolumePath(outputDir, volume=scratch)
+    if outputManifest is None:
+        outputManifest = SMTK_OUTPUT_MANIFEST
+    workingDir, resultHooks = utils.createOutputTransforms(
+        volume, volumepath, outputFolderId, streamOutput,
+        compressionLevel, summarize=True, manifest=outputManifest)
+    kwargs = {
+        'pull_image': False,
+        'container_args': ['-c', SMTK_SETUP + '; ' + SMTK_COMMAND],
+        'entrypoint': 'bash',
+        'remove_container': True,
+        'volumes': utils.extraVolumes(scratch),
+        'working_dir': workingDir,
+        'girder_result_hooks': resultHooks
+    }
+    if warm:
+        # The environment is set up once, when the container starts
+        kwargs['container_args'] = ['-c', SMTK_COMMAND]
+        kwargs['warm_pool'] = {
+            'setup': SMTK_SETUP,
+            'maxJobs': warmPool.get('maxJobsPerContainer'),
+            'idleSeconds': (warmPool['idleMinutes'] * 60
+                            if 'idleMinutes' in warmPool else None),
+            'queuedTime': time.time()
+        }
+
+    kwargs = utils.applyResourceLimits(kwargs, limits)
+    return calculationImage('smtk'), kwargs
+
+
+def celeryTask(kwargs):
+    """Get the celery task that runs a job with the given arguments."""
+    return warm_docker_run if 'warm_pool' in kwargs else docker_run
+
+
+# The task function for each calculation type
+CALCULATION_TASKS = {
+    'albany': albanyTask,
+    'dream3d': dream3dTask,
+    'smtk': smtkMeshPlacementTask
+}
@@ -1,13 +1,94 @@
 """Utilities for the multiscale endpoint functions."""
 
+import six
+
+from girder.exceptions import RestException, ValidationException
+from girder.models.folder import Folder
+from girder.models.setting import Setting
 from girder.plugins.jobs.models.job import Job
 
+from girder_worker.docker.transforms import TemporaryVolume
+
+from multiscale_worker.compression import CompressedVolumePath
+from multiscale_worker.manifest import ManifestVolumePath
+from multiscale_worker.pool import WarmPoolVolume
+from multiscale_worker.scratch import ScratchVolume
+from multiscale_worker.staging import (
+    CachedGirderFolderIdToVolume,
+    ProgressGirderFolderIdToVolume
+)
+from multiscale_worker.summary import GirderJobSummary
+from multiscale_worker.upload import (
+    GirderUploadRemainingVolumePathToFolder,
+    ParallelGirderUploadVolumePathToFolder,
+    StreamingUploadWorkingDir
+)
+
+from ..settings import PluginSettings, validateResourceLimits
 
-def setMultiscaleMetaData(jobId, inputFolderId, outputFolderId):
+# Runs the calculation's command ("$@") under the resource limits, and
+# explains in the job log why the container was stopped. timeout exits
+# with 124 when the time limit is reached (or 137 if the command had to
+# be killed), and a process killed by the kernel's OOM killer exits with
+# 137 (128 + SIGKILL).
+#
+# The shell is PID 1 in the container, which ignores SIGTERM by default,
+# so the command runs in the background and the SIGTERM that docker
+# sends to cancel a job is forwarded to it. wait returns early when the
+# signal arrives, so it is called until the command has exited, and then
+# once more for its exit status.
+LIMITS_SCRIPT = '''
+max=$MULTISCALE_MAX_RUN_SECONDS
+mem=$MULTISCALE_MEMORY_MB
+start=$(date +%s)
+if [ -n "$max" ]; then
+    timeout -k 30 "$max" "$@" &
+else
+    "$@" &
+fi
+child=$!
+trap 'kill -TERM $child 2>/dev/null' TERM INT
+while kill -0 $child 2>/dev/null; do
+    wait $child
+done
+wait $child
+status=$?
+elapsed=$(( $(date +%s) - start ))
+if [ -n "$max" ] && { [ $status -eq 124 ] ||
+        { [ $status -eq 137 ] && [ $elapsed -ge "$max" ]; }; }; then
+    echo "Error: the calculation exceeded its maximum run time of $max" \\
+        "seconds and was stopped." >&2
+elif [ $status -eq 137 ]; then
+    echo "Error: the calculation was killed (exit code 137)." \\
+        "It most likely ran out of memory${mem:+ (the limit is $mem MB)}." >&2
+fi
+exit $status
+'''
+
+
+def multiscaleSettings(inputFolderId, outputFolderId, calculationType=None,
+                       image=None):
+    """Get the multiscale settings that are stored in a job's meta data."""
+    settings = {
+        'inputFolderId': inputFolderId,
+        'outputFolderId': outputFolderId
+    }
+    if calculationType is not None:
+        settings['calculationType'] = calculationType
+
+    if image is not None:
+        settings['image'] = image
+
+    return settings
+
+
+def setMultiscaleMetaData(jobId, inputFolderId, outputFolderId,
+                          calculationType=None, image=None):
     """Set the multiscale meta data for the jobId.
 
     Currently, we use this to keep track of the input and output
-    folders.
+    folders, of the type of calculation, and of the docker image that
+    runs it.
 
     Returns the updated job.
     """
@@ -16,11 +97,276 @@ def setMultiscaleMetaData(jobId, inputFolderId, outputFolderId):
     job = Job().findOne({'_id': jobId})
     multiscale_io = {
         'meta': {
-            'multiscale_settings': {
-                'inputFolderId': inputFolderId,
-                'outputFolderId': outputFolderId
-            }
+            'multiscale_settings': multiscaleSettings(
+                inputFolderId, outputFolderId, calculationType, image)
         }
     }
 
     return Job().updateJob(job, otherFields=multiscale_io)
+
+
+def createWorkingVolume(calculationType, inputFolderId, warmPool=False):
+    """Create the volume that holds the working directory of a job.
+
+    If a scratch directory is configured for the calculation type, the
+    volume is created there on the worker, provided that it has room
+    for the input files plus its 'minFreeMB'. Otherwise, the default
+    temporary volume is used.
+
+    If 'warmPool' is True, the job runs in a warm container, which can
+    only mount a WarmPoolVolume.
+    """
+    scratch = Setting().get(PluginSettings.SCRATCH_VOLUMES).get(
+        calculationType)
+    if not scratch and not warmPool:
+        return TemporaryVolume.default
+
+    requiredBytes = 0
+    if scratch:
+        # The size of a folder only counts the items directly inside of it
+        folder = Folder().load(inputFolderId, force=True)
+        inputBytes = Folder().getSizeRecursive(folder) if folder else 0
+        requiredBytes = inputBytes + scratch.get('minFreeMB', 0) * 1024 ** 2
+
+    volumeClass = WarmPoolVolume if warmPool else ScratchVolume
+    return volumeClass(scratch['path'] if scratch else None,
+                       required_bytes=requiredBytes)
+
+
+def extraVolumes(volume):
+    """Get the 'volumes' argument of docker_run for a working volume.
+
+    The default temporary volume is always mounted, but other volumes
+    must be listed.
+    """
+    return [volume] if isinstance(volume, ScratchVolume) else []
+
+
+def createInputVolume(inputFolderId, folderName,
+                      volume=TemporaryVolume.default):
+    """Create the transform that stages the input folder on the worker.
+
+    If a staging cache directory has been configured, the input files
+    are staged through the worker-local cache. Otherwise, the whole
+    folder is downloaded for every job.
+    """
+    cacheDir = Setting().get(PluginSettings.STAGING_CACHE_DIR)
+    if not cacheDir:
+        return ProgressGirderFolderIdToVolume(
+            inputFolderId,
+            volume=volume,
+            folder_name=folderName)
+
+    return CachedGirderFolderIdToVolume(
+        inputFolderId,
+        volume=volume,
+        folder_name=folderName,
+        cache_dir=cacheDir,
+        cache_max_bytes=Setting().get(PluginSettings.STAGING_CACHE_MAX_BYTES))
+
+
+def getCompressionLevel(compressionLevel):
+    """Get the output compression level to use for a job.
+
+    If 'compressionLevel' is None, the plugin setting is used instead.
+    """
+    if compressionLevel is None:
+        return Setting().get(PluginSettings.OUTPUT_COMPRESSION_LEVEL)
+
+    if not 0 <= compressionLevel <= 9:
+        raise RestException('compressionLevel must be between 0 and 9.')
+
+    return compressionLevel
+
+
+def getResourceLimits(calculationType, **overrides):
+    """Get the resource limits to use for a job.
+
+    The defaults of the calculation type come from the resource limits
+    setting, and are replaced by the 'overrides' (cpus, memoryMB and
+    maxRunSeconds) that are not None.
+    """
+    overrides = dict((k, v) for k, v in overrides.items() if v is not None)
+    try:
+        validateResourceLimits(overrides)
+    except ValidationException as e:
+        raise RestException(str(e))
+
+    limits = dict(Setting().get(PluginSettings.RESOURCE_LIMITS).get(
+        calculationType) or {})
+    limits.update(overrides)
+    return dict((k, v) for k, v in limits.items() if v is not None)
+
+
+# The fields of an output manifest
+OUTPUT_MANIFEST_KEYS = ('include', 'exclude', 'maxFileMB', 'maxTotalMB')
+
+
+def validateOutputManifest(manifest):
+    """Validate an output manifest given to an end point.
+
+    See multiscale_worker.manifest for its fields.
+    """
+    if manifest is None:
+        return
+
+    unknown = set(manifest) - set(OUTPUT_MANIFEST_KEYS)
+    if unknown:
+        raise RestException('Unknown output manifest keys: %s (expected %s).'
+                            % (', '.join(sorted(unknown)),
+                               ', '.join(OUTPUT_MANIFEST_KEYS)))
+
+    for key in ('include', 'exclude'):
+        patterns = manifest.get(key, [])
+        if (not isinstance(patterns, list) or
+                not all(isinstance(x, six.string_types) and x
+                        for x in patterns)):
+            raise RestException('The output manifest "%s" must be a list of '
+                                'glob patterns.' % key)
+
+    for key in ('maxFileMB', 'maxTotalMB'):
+        value = manifest.get(key)
+        if value is not None and (isinstance(value, bool) or
+                                  not isinstance(value, six.integer_types) or
+                                  value <= 0):
+            raise RestException('The output manifest "%s" must be a positive '
+                                'integer.' % key)
+
+
+def applyResourceLimits(kwargs, limits):
+    """Apply resource limits to the docker_run arguments of a task.
+
+    The CPU and memory limits are enforced by docker. The maximum run
+    time is enforced by running the entry point under 'timeout' in the
+    container, which also reports the limit that was exceeded in the
+    job log. The container then exits with an error, so the job ends in
+    the error state.
+
+    Returns 'kwargs'.
+    """
+    if not limits:
+        return kwargs
+
+    environment = {}
+    if 'cpus' in limits:
+        kwargs['nano_cpus'] = int(limits['cpus'] * 1e9)
+
+    if 'memoryMB' in limits:
+        memory = '%dm' % limits['memoryMB']
+        # Without a swap limit, the container could swap instead
+        kwargs['mem_limit'] = memory
+        kwargs['memswap_limit'] = memory
+        environment['MULTISCALE_MEMORY_MB'] = str(limits['memoryMB'])
+
+    if 'maxRunSeconds' in limits:
+        environment['MULTISCALE_MAX_RUN_SECONDS'] = str(
+            limits['maxRunSeconds'])
+
+    entrypoint = kwargs.get('entrypoint') or []
+    if not isinstance(entrypoint, list):
+        entrypoint = [entrypoint]
+
+    kwargs['entrypoint'] = ['sh', '-c', LIMITS_SCRIPT,
+                            'multiscale-limits'] + entrypoint
+    kwargs['environment'] = dict(kwargs.get('environment') or {},
+                                 **environment)
+    return kwargs
+
+
+# The job fields needed to check access to a job and report its progress
+PROGRESS_FIELDS = ['access', 'public', 'userId', 'status', 'progress',
+                   'updated']
+
+
+def jobProgress(job):
+    """Get the status and the latest progress event of a job.
+
+    The stage is the part of the progress message before the first
+    colon.
+    """
+    progress = job.get('progress') or {}
+    message = progress.get('message') or ''
+    stage = message.split(':', 1)[0].strip() or None
+    return {
+        '_id': job['_id'],
+        'status': job['status'],
+        'updated': job.get('updated'),
+        'stage': stage,
+        'message': message,
+        'current': progress.get('current'),
+        'total': progress.get('total')
+    }
+
+
+def setOutputSummary(job, summary):
+    """Store the summary of a job's output in its meta data."""
+    Job().update({'_id': job['_id']},
+                 {'$set': {'meta.multiscale_summary': summary}})
+
+
+def setUploadStats(job, stats):
+    """Store the statistics of a job's output upload in its meta data."""
+    Job().update({'_id': job['_id']},
+                 {'$set': {'meta.multiscale_upload': stats}})
+
+
+def setRunTiming(job, timing):
+    """Store the queue and start timing of a job in its meta data."""
+    Job().update({'_id': job['_id']},
+                 {'$set': {'meta.multiscale_timing': timing}})
+
+
+def setResolvedImage(job, image):
+    """Store the image that a job's worker ran in its meta data."""
+    Job().update({'_id': job['_id']},
+                 {'$set': {'meta.multiscale_image': image}})
+
+
+def createOutputTransforms(workingDir, volumepath, outputFolderId,
+                           streamOutput=False, compressionLevel=None,
+                           summarize=False, manifest=None):
+    """Create the working directory and result hooks for uploading output.
+
+    Returns a tuple of the transform to use as the 'working_dir' and the
+    list of 'girder_result_hooks' for docker_run.
+
+    Only the files under 'volumepath' that the output 'manifest' selects
+    are summarized and uploaded, with their paths relative to it.
+
+    If streamOutput is True, the output path is watched while the
+    container is running and completed files are uploaded as soon as
+    they are finished. The result hook then only uploads what remains.
+
+    If the compression level is greater than 0, NetCDF and HDF5 output
+    files are repacked with compression before the final upload.
+
+    The output files are uploaded by as many workers as the output
+    upload workers setting.
+
+    If 'summarize' is True and the output summary setting is enabled,
+    the Exodus output is summarized into the job meta data before it is
+    uploaded.
+    """
+    resultHooks = []
+    outputPath = ManifestVolumePath(volumepath, manifest)
+    if summarize and Setting().get(PluginSettings.OUTPUT_SUMMARY):
+        resultHooks.append(GirderJobSummary(outputPath))
+
+    uploadPath = outputPath
+    compressionLevel = getCompressionLevel(compressionLevel)
+    if compressionLevel > 0:
+        uploadPath = CompressedVolumePath(outputPath, compressionLevel)
+
+    uploadWorkers = Setting().get(PluginSettings.OUTPUT_UPLOAD_WORKERS)
+    if not streamOutput:
+        resultHooks.append(ParallelGirderUploadVolumePathToFolder(
+            uploadPath, outputFolderId, upload_workers=uploadWorkers))
+        return workingDir, resultHooks
+
+    streamingDir = StreamingUploadWorkingDir(workingDir, volumepath,
+                                             outputFolderId,
+                                             manifest=manifest)
+    resultHooks.append(GirderUploadRemainingVolumePathToFolder(
+        uploadPath, outputFolderId, watcher_id=streamingDir.watcher_id,
+        upload_workers=uploadWorkers))
+    return streamingDir, resultHooks
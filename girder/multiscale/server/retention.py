@@ -0,0 +1,284 @@
+"""Retention policy and sweeper for finished multiscale jobs.
+
+The policy is set in the multiscale.retention setting. Finished jobs
+(successful, failed or canceled) are deleted along with their job
+folder under "multiscale_data" when they are older than "maxAgeDays",
+or, oldest first, while the job folders of a user take up more than
+"maxMBPerUser". The newest "keepLastSuccessful" successful jobs of each
+calculation type of each user are never deleted.
+
+The sweep runs every "sweepIntervalHours" in the background of the
+girder server (in only one process when there are several), and can
+also be run by an administrator. The report of
+the last sweep is kept in the multiscale.retention_report setting.
+"""
+
+import datetime
+import time
+
+import cherrypy
+from cherrypy.process.plugins import Monitor
+from pymongo.errors import DuplicateKeyError
+
+from girder import logger
+from girder.models.folder import Folder
+from girder.models.setting import Setting
+from girder.plugins.jobs.constants import JobStatus
+from girder.plugins.jobs.models.job import Job
+
+from .settings import PluginSettings
+
+# The statuses of the jobs that may be deleted
+FINISHED_STATUSES = (JobStatus.SUCCESS, JobStatus.ERROR, JobStatus.CANCELED)
+
+# The folder that the client creates the job folders in
+BASE_FOLDER_NAME = 'multiscale_data'
+
+DEFAULT_BATCH_SIZE = 100
+
+# How often the background thread checks whether a sweep is due
+CHECK_SECONDS = 600
+
+# Every girder process checks whether a sweep is due. The one that runs
+# it records when it started in this setting, which has no validator
+# since it is only written here.
+SWEEP_CLAIM_KEY = 'multiscale.retention_sweep_claim'
+
+MB = 1024 ** 2
+
+# The job fields read by the sweeper
+JOB_FIELDS = ['_id', 'status', 'updated', 'meta.multiscale_settings']
+
+
+def findJobFolder(outputFolderId):
+    """Find the job folder of a job from its output folder.
+
+    Only folders that the client created, i.e. "job_*" folders inside
+    the "multiscale_data" folder of a user, are job folders. Returns
+    None for other folders, which are never deleted.
+    """
+    if not outputFolderId:
+        return None
+
+    output = Folder().load(outputFolderId, force=True)
+    if not output or output['parentCollection'] != 'folder':
+        return None
+
+    jobFolder = Folder().load(output['parentId'], force=True)
+    if (not jobFolder or not jobFolder['name'].startswith('job_') or
+            jobFolder['parentCollection'] != 'folder'):
+        return None
+
+    base = Folder().load(jobFolder['parentId'], force=True,
+                         fields=['name', 'parentCollection'])
+    if (not base or base['name'] != BASE_FOLDER_NAME or
+            base['parentCollection'] != 'user'):
+        return None
+
+    return jobFolder
+
+
+def protectedJobIds(jobs, keepLastSuccessful):
+    """Get the ids of the newest successful jobs of each calculation type.
+
+    'jobs' must be sorted newest first.
+    """
+    kept = {}
+    protected = set()
+    if not keepLastSuccessful:
+        return protected
+
+    for job in jobs:
+        if job['status'] != JobStatus.SUCCESS:
+            continue
+
+        calcType = job['meta']['multiscale_settings'].get('calculationType')
+        if kept.get(calcType, 0) < keepLastSuccessful:
+            kept[calcType] = kept.get(calcType, 0) + 1
+            protected.add(job['_id'])
+
+    return protected
+
+
+def selectUserJobs(userId, policy, now):
+    """Select the jobs of a user to delete.
+
+    Returns a list of (job, jobFolder, sizeBytes, reason) tuples, where
+    jobFolder may be None.
+    """
+    jobs = list(Job().find({
+        'userId': userId,
+        'meta.multiscale_settings': {'$exists': True}
+    }, sort=[('_id', -1)], fields=JOB_FIELDS))
+
+    protected = protectedJobIds(jobs, policy.get('keepLastSuccessful'))
+    maxAgeDays = policy.get('maxAgeDays')
+    maxMBPerUser = policy.get('maxMBPerUser')
+    cutoff = None
+    if maxAgeDays:
+        cutoff = now - datetime.timedelta(days=maxAgeDays)
+
+    entries = []
+    totalBytes = 0
+    for job in jobs:
+        settings = job['meta']['multiscale_settings']
+        folder = findJobFolder(settings.get('outputFolderId'))
+        size = 0
+        if folder is not None and maxMBPerUser is not None:
+            size = Folder().getSizeRecursive(folder)
+        totalBytes += size
+        entries.append((job, folder, size))
+
+    selected = []
+    remaining = []
+    for job, folder, size in entries:
+        if job['status'] not in FINISHED_STATUSES or job['_id'] in protected:
+            continue
+
+        updated = job.get('updated')
+        if cutoff is not None and updated is not None and updated < cutoff:
+            selected.append((job, folder, size, 'maxAge'))
+            totalBytes -= size
+        else:
+            remaining.append((job, folder, size))
+
+    if maxMBPerUser is not None:
+        # Delete the oldest jobs first until the user is under the limit
+        for job, folder, size in reversed(remaining):
+            if totalBytes <= maxMBPerUser * MB:
+                break
+            if folder is None:
+                continue
+            selected.append((job, folder, size, 'maxMBPerUser'))
+            totalBytes -= size
+
+    if maxMBPerUser is None:
+        # The sizes are only needed for the report
+        selected = [
+            (job, folder,
+             Folder().getSizeRecursive(folder) if folder else 0, reason)
+            for job, folder, size, reason in selected]
+
+    return selected
+
+
+def deleteBatch(batch, report, dryRun=False):
+    """Delete a batch of jobs and their job folders.
+
+    What was deleted is added to the report.
+    """
+    for job, folder, size, reason in batch:
+        if folder is not None:
+            if not dryRun:
+                Folder().remove(folder)
+            report['foldersDeleted'] += 1
+            report['bytesReclaimed'] += size
+        report['reasons'][reason] = report['reasons'].get(reason, 0) + 1
+
+    if not dryRun:
+        # Job().remove() triggers the remove events (e.g. to delete the
+        # artifacts of a job), which get the whole job documents
+        ids = [job['_id'] for job, _, _, _ in batch]
+        for job in Job().find({'_id': {'$in': ids}}):
+            Job().remove(job)
+    report['jobsDeleted'] += len(batch)
+
+
+def sweep(policy=None, dryRun=False):
+    """Delete the jobs that the retention policy does not keep.
+
+    The jobs are deleted in batches of the policy's "batchSize". When
+    'dryRun' is True, nothing is deleted, but the report holds what
+    would have been.
+
+    Returns the report, which is also saved unless this is a dry run.
+    """
+    if policy is None:
+        policy = Setting().get(PluginSettings.RETENTION)
+
+    start = time.time()
+    now = datetime.datetime.utcnow()
+    report = {
+        'time': now,
+        'dryRun': dryRun,
+        'users': 0,
+        'jobsDeleted': 0,
+        'foldersDeleted': 0,
+        'bytesReclaimed': 0,
+        'reasons': {}
+    }
+
+    if policy.get('maxAgeDays') or policy.get('maxMBPerUser') is not None:
+        batchSize = policy.get('batchSize') or DEFAULT_BATCH_SIZE
+        userIds = Job().collection.distinct(
+            'userId', {'meta.multiscale_settings': {'$exists': True}})
+        for userId in userIds:
+            if userId is None:
+                continue
+
+            report['users'] += 1
+            selected = selectUserJobs(userId, policy, now)
+            for i in range(0, len(selected), batchSize):
+                deleteBatch(selected[i:i + batchSize], report, dryRun)
+
+    report['seconds'] = round(time.time() - start, 3)
+    if not dryRun:
+        Setting().set(PluginSettings.RETENTION_REPORT, report)
+
+    logger.info(
+        'Multiscale retention sweep%s: %d jobs and %d folders (%.1f MB) '
+        'in %.1f s', ' (dry run)' if dryRun else '', report['jobsDeleted'],
+        report['foldersDeleted'], report['bytesReclaimed'] / float(MB),
+        report['seconds'])
+    return report
+
+
+def claimSweep(now, intervalHours):
+    """Claim a due sweep for this girder process.
+
+    The claim only succeeds if no process has started a sweep within the
+    sweep interval. The check and the claim are a single atomic update,
+    so only one process runs each sweep.
+    """
+    since = now - datetime.timedelta(hours=intervalHours)
+    try:
+        Setting().collection.update_one(
+            {'key': SWEEP_CLAIM_KEY,
+             'value.started': {'$not': {'$gt': since}}},
+            {'$set': {'value': {'started': now}}}, upsert=True)
+    except DuplicateKeyError:
+        # Another process holds a claim (the setting keys are unique)
+        return False
+
+    return True
+
+
+def sweepIfDue():
+    """Run a sweep if the sweep interval has passed since the last one.
+
+    Only one girder process runs each sweep (see claimSweep()).
+    """
+    policy = Setting().get(PluginSettings.RETENTION)
+    intervalHours = policy.get('sweepIntervalHours')
+    if not intervalHours:
+        return
+
+    last = Setting().get(PluginSettings.RETENTION_REPORT).get('time')
+    now = datetime.datetime.utcnow()
+    if last is not None and now - last < datetime.timedelta(
+            hours=intervalHours):
+        return
+
+    if not claimSweep(now, intervalHours):
+        return
+
+    try:
+        sweep(policy)
+    except Exception:
+        logger.exception('The multiscale retention sweep failed')
+
+
+def scheduleSweeps():
+    """Check for due sweeps in the background while the server runs."""
+    Monitor(cherrypy.engine, sweepIfDue, frequency=CHECK_SECONDS,
+            name='multiscale-retention').subscribe()
@@ -0,0 +1,330 @@
+"""Settings for the multiscale plugin."""
+
+import re
+
+import six
+
+from girder.exceptions import ValidationException
+from girder.utility import setting_utilities
+
+
+class PluginSettings(object):
+    """Keys for the multiscale plugin settings."""
+
+    STAGING_CACHE_DIR = 'multiscale.staging_cache_dir'
+    STAGING_CACHE_MAX_BYTES = 'multiscale.staging_cache_max_bytes'
+    OUTPUT_COMPRESSION_LEVEL = 'multiscale.output_compression_level'
+    OUTPUT_SUMMARY = 'multiscale.output_summary'
+    OUTPUT_UPLOAD_WORKERS = 'multiscale.output_upload_workers'
+    RESOURCE_LIMITS = 'multiscale.resource_limits'
+    SCRATCH_VOLUMES = 'multiscale.scratch_volumes'
+    RETENTION = 'multiscale.retention'
+    RETENTION_REPORT = 'multiscale.retention_report'
+    SMTK_WARM_POOL = 'multiscale.smtk_warm_pool'
+    IMAGES = 'multiscale.images'
+
+
+# The calculation types, which key the settings of each calculation
+CALCULATION_TYPES = ('albany', 'dream3d', 'smtk')
+
+# The resource limits that may be set for each calculation type, and
+# their types
+RESOURCE_LIMIT_TYPES = {
+    'cpus': six.integer_types + (float, ),
+    'memoryMB': six.integer_types,
+    'maxRunSeconds': six.integer_types
+}
+
+# The keys of the retention policy. Each one is a positive integer.
+RETENTION_KEYS = ('maxAgeDays', 'maxMBPerUser', 'keepLastSuccessful',
+                  'sweepIntervalHours', 'batchSize')
+
+# The keys of the warm pool settings, other than "enabled". Each one is
+# a positive integer.
+WARM_POOL_KEYS = ('maxJobsPerContainer', 'idleMinutes')
+
+# A docker image reference, optionally pinned to a sha256 digest
+IMAGE_REFERENCE = re.compile(
+    r'^[A-Za-z0-9][A-Za-z0-9._/:-]*(@sha256:[0-9a-f]{64})?$')
+
+
+@setting_utilities.validator(PluginSettings.STAGING_CACHE_DIR)
+def _validateStagingCacheDir(doc):
+    """Validate the staging cache directory.
+
+    This is a path on the worker nodes. An empty value disables the cache.
+    """
+    if not isinstance(doc['value'], six.string_types):
+        raise ValidationException(
+            'Staging cache directory must be a string.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.STAGING_CACHE_MAX_BYTES)
+def _validateStagingCacheMaxBytes(doc):
+    """Validate the staging cache disk budget."""
+    try:
+        doc['value'] = int(doc['value'])
+    except (TypeError, ValueError):
+        raise ValidationException(
+            'Staging cache size must be an integer.', 'value')
+
+    if doc['value'] < 0:
+        raise ValidationException(
+            'Staging cache size must not be negative.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.OUTPUT_COMPRESSION_LEVEL)
+def _validateOutputCompressionLevel(doc):
+    """Validate the default output compression level.
+
+    0 disables output compression, and 1-9 are deflate levels.
+    """
+    try:
+        doc['value'] = int(doc['value'])
+    except (TypeError, ValueError):
+        raise ValidationException(
+            'Output compression level must be an integer.', 'value')
+
+    if not 0 <= doc['value'] <= 9:
+        raise ValidationException(
+            'Output compression level must be between 0 and 9.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.OUTPUT_SUMMARY)
+def _validateOutputSummary(doc):
+    """Validate whether Exodus output is summarized after each run."""
+    if not isinstance(doc['value'], bool):
+        raise ValidationException(
+            'Output summary setting must be a boolean.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.OUTPUT_UPLOAD_WORKERS)
+def _validateOutputUploadWorkers(doc):
+    """Validate the number of output files uploaded at the same time."""
+    try:
+        doc['value'] = int(doc['value'])
+    except (TypeError, ValueError):
+        raise ValidationException(
+            'Output upload workers must be an integer.', 'value')
+
+    if not 1 <= doc['value'] <= 32:
+        raise ValidationException(
+            'Output upload workers must be between 1 and 32.', 'value')
+
+
+def validateResourceLimits(limits, field='value'):
+    """Validate a dictionary of resource limits.
+
+    The keys must be in RESOURCE_LIMIT_TYPES and the values positive
+    numbers, or None for no limit.
+    """
+    if not isinstance(limits, dict):
+        raise ValidationException(
+            'Resource limits must be a JSON object.', field)
+
+    for key, value in limits.items():
+        if key not in RESOURCE_LIMIT_TYPES:
+            raise ValidationException(
+                'Unknown resource limit: %s (expected one of %s).' %
+                (key, ', '.join(sorted(RESOURCE_LIMIT_TYPES))), field)
+
+        if value is None:
+            continue
+
+        if (isinstance(value, bool) or
+                not isinstance(value, RESOURCE_LIMIT_TYPES[key]) or
+                value <= 0):
+            raise ValidationException(
+                'Resource limit %s must be a positive number.' % key, field)
+
+
+@setting_utilities.validator(PluginSettings.RESOURCE_LIMITS)
+def _validateResourceLimits(doc):
+    """Validate the default resource limits of each calculation type.
+
+    The value maps calculation types (e.g. "dream3d") to objects with
+    the "cpus", "memoryMB" and "maxRunSeconds" limits of their
+    containers.
+    """
+    if not isinstance(doc['value'], dict):
+        raise ValidationException(
+            'Resource limits must be a JSON object.', 'value')
+
+    for limits in doc['value'].values():
+        validateResourceLimits(limits)
+
+
+@setting_utilities.validator(PluginSettings.SCRATCH_VOLUMES)
+def _validateScratchVolumes(doc):
+    """Validate the scratch directory of each calculation type.
+
+    The value maps calculation types to objects with the "path" of the
+    scratch directory on the worker nodes, and optionally the free
+    space ("minFreeMB") to keep in addition to the input files.
+    """
+    if not isinstance(doc['value'], dict):
+        raise ValidationException(
+            'Scratch volumes must be a JSON object.', 'value')
+
+    for scratch in doc['value'].values():
+        if not isinstance(scratch, dict):
+            raise ValidationException(
+                'Each scratch volume must be a JSON object.', 'value')
+
+        path = scratch.get('path')
+        if not isinstance(path, six.string_types) or not path.startswith('/'):
+            raise ValidationException(
+                'Each scratch volume must have an absolute "path".', 'value')
+
+        minFreeMB = scratch.get('minFreeMB', 0)
+        if (isinstance(minFreeMB, bool) or
+                not isinstance(minFreeMB, six.integer_types) or
+                minFreeMB < 0):
+            raise ValidationException(
+                'minFreeMB must be a non-negative integer.', 'value')
+
+        unknown = set(scratch) - {'path', 'minFreeMB'}
+        if unknown:
+            raise ValidationException(
+                'Unknown scratch volume keys: %s' %
+                ', '.join(sorted(unknown)), 'value')
+
+
+@setting_utilities.validator(PluginSettings.RETENTION)
+def _validateRetention(doc):
+    """Validate the retention policy of finished jobs.
+
+    The value is an object with any of the RETENTION_KEYS. An empty
+    object keeps every job.
+    """
+    if not isinstance(doc['value'], dict):
+        raise ValidationException(
+            'Retention policy must be a JSON object.', 'value')
+
+    for key, value in doc['value'].items():
+        if key not in RETENTION_KEYS:
+            raise ValidationException(
+                'Unknown retention policy key: %s (expected one of %s).' %
+                (key, ', '.join(RETENTION_KEYS)), 'value')
+
+        if (isinstance(value, bool) or
+                not isinstance(value, six.integer_types) or value <= 0):
+            raise ValidationException(
+                'Retention policy %s must be a positive integer.' % key,
+                'value')
+
+
+@setting_utilities.validator(PluginSettings.RETENTION_REPORT)
+def _validateRetentionReport(doc):
+    """Validate the report of the last retention sweep."""
+    if not isinstance(doc['value'], dict):
+        raise ValidationException(
+            'Retention report must be a JSON object.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.SMTK_WARM_POOL)
+def _validateSmtkWarmPool(doc):
+    """Validate the warm container pool settings of smtk.
+
+    The value is an object with "enabled" (a boolean) and any of the
+    WARM_POOL_KEYS. An empty object disables the pool.
+    """
+    if not isinstance(doc['value'], dict):
+        raise ValidationException(
+            'Warm pool settings must be a JSON object.', 'value')
+
+    for key, value in doc['value'].items():
+        if key == 'enabled':
+            if not isinstance(value, bool):
+                raise ValidationException(
+                    'Warm pool "enabled" must be a boolean.', 'value')
+            continue
+
+        if key not in WARM_POOL_KEYS:
+            raise ValidationException(
+                'Unknown warm pool key: %s (expected enabled, %s).' %
+                (key, ', '.join(WARM_POOL_KEYS)), 'value')
+
+        if (isinstance(value, bool) or
+                not isinstance(value, six.integer_types) or value <= 0):
+            raise ValidationException(
+                'Warm pool %s must be a positive integer.' % key, 'value')
+
+
+@setting_utilities.validator(PluginSettings.IMAGES)
+def _validateImages(doc):
+    """Validate the docker image of each calculation type.
+
+    The value maps calculation types to image references, which should
+    be pinned to a digest, e.g. "openchemistry/albany@sha256:<digest>".
+    """
+    if not isinstance(doc['value'], dict):
+        raise ValidationException(
+            'Images must be a JSON object.', 'value')
+
+    for calculationType, image in doc['value'].items():
+        if calculationType not in CALCULATION_TYPES:
+            raise ValidationException(
+                'Unknown calculation type: %s (expected one of %s).' %
+                (calculationType, ', '.join(CALCULATION_TYPES)), 'value')
+
+        if (not isinstance(image, six.string_types) or
+                not IMAGE_REFERENCE.match(image)):
+            raise ValidationException(
+                'Invalid image reference for %s: %s' %
+                (calculationType, image), 'value')
+
+
+@setting_utilities.default(PluginSettings.STAGING_CACHE_DIR)
+def _defaultStagingCacheDir():
+    return ''
+
+
+@setting_utilities.default(PluginSettings.STAGING_CACHE_MAX_BYTES)
+def _defaultStagingCacheMaxBytes():
+    return 50 * 1024 ** 3
+
+
+@setting_utilities.default(PluginSettings.OUTPUT_COMPRESSION_LEVEL)
+def _defaultOutputCompressionLevel():
+    return 0
+
+
+@setting_utilities.default(PluginSettings.OUTPUT_SUMMARY)
+def _defaultOutputSummary():
+    return False
+
+
+@setting_utilities.default(PluginSettings.OUTPUT_UPLOAD_WORKERS)
+def _defaultOutputUploadWorkers():
+    return 4
+
+
+@setting_utilities.default(PluginSettings.RESOURCE_LIMITS)
+def _defaultResourceLimits():
+    return {}
+
+
+@setting_utilities.default(PluginSettings.SCRATCH_VOLUMES)
+def _defaultScratchVolumes():
+    return {}
+
+
+@setting_utilities.default(PluginSettings.RETENTION)
+def _defaultRetention():
+    return {}
+
+
+@setting_utilities.default(PluginSettings.RETENTION_REPORT)
+def _defaultRetentionReport():
+    return {}
+
+
+@setting_utilities.default(PluginSettings.SMTK_WARM_POOL)
+def _defaultSmtkWarmPool():
+    return {}
+
+
+@setting_utilities.default(PluginSettings.IMAGES)
+def _defaultImages():
+    return {}
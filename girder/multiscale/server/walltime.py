@@ -0,0 +1,125 @@
+"""Keep the run times of multiscale jobs on their job documents.
+
+Finding when a job ran means scanning its 'timestamps'. To save every
+reader from doing that, multiscale jobs have these fields, which are
+updated as their status changes:
+
+    runStarted   When the job started running, or None.
+    runEnded     When the job stopped running, or None.
+    wallSeconds  The number of seconds from runStarted to runEnded, or
+                 None until the job has stopped running.
+
+Jobs that were created before these fields existed are filled in by a
+background thread when the plugin is loaded.
+"""
+
+import threading
+
+from girder import events, logger
+from girder.plugins.jobs.constants import JobStatus
+from girder.plugins.jobs.models.job import Job
+
+# The statuses of jobs that hold a worker. The ones above 800 are the
+# stages of girder_worker jobs (fetching input, converting, pushing
+# output and canceling).
+RUNNING_STATUSES = (JobStatus.RUNNING, 820, 821, 822, 823, 824)
+
+RUN_TIME_FIELDS = ('runStarted', 'runEnded', 'wallSeconds')
+
+# The number of old jobs that are filled in between progress messages
+BACKFILL_LOG_INTERVAL = 1000
+
+
+def runTimes(job):
+    """Get the times at which a job started and stopped running.
+
+    Either may be None if the job has not started or stopped yet.
+    """
+    start = None
+    for stamp in job.get('timestamps') or []:
+        if start is None:
+            if stamp.get('status') == JobStatus.RUNNING:
+                start = stamp.get('time')
+        elif stamp.get('status') not in RUNNING_STATUSES:
+            return start, stamp.get('time')
+
+    return start, None
+
+
+def runTimeFields(job):
+    """Get the values of the RUN_TIME_FIELDS from a job's timestamps."""
+    start, end = runTimes(job)
+    wallSeconds = None
+    if start is not None and end is not None:
+        wallSeconds = (end - start).total_seconds()
+
+    return {
+        'runStarted': start,
+        'runEnded': end,
+        'wallSeconds': wallSeconds
+    }
+
+
+def updateRunTimes(event):
+    """Update the run time fields of a multiscale job after it changes.
+
+    This is bound to the 'jobs.job.update.after' event. The job is only
+    written to if the fields changed, which is only the case when its
+    status changed or when it became a multiscale job.
+    """
+    job = event.info['job']
+    if 'multiscale_settings' not in (job.get('meta') or {}):
+        return
+
+    if job.get('wallSeconds') is not None:
+        # The job has already stopped running
+        return
+
+    fields = runTimeFields(job)
+    if all(x in job and job[x] == fields[x] for x in RUN_TIME_FIELDS):
+        return
+
+    Job().update({'_id': job['_id']}, {'$set': fields}, multi=False)
+    job.update(fields)
+
+
+def backfillRunTimes():
+    """Fill in the run time fields of the multiscale jobs that lack them.
+
+    Returns the number of jobs that were updated.
+    """
+    jobs = Job().find({
+        'meta.multiscale_settings': {'$exists': True},
+        'wallSeconds': {'$exists': False}
+    }, fields=['timestamps'])
+
+    count = 0
+    for job in jobs:
+        Job().update({'_id': job['_id']}, {'$set': runTimeFields(job)},
+                     multi=False)
+        count += 1
+        if count % BACKFILL_LOG_INTERVAL == 0:
+            logger.info('Filled in the run times of %d multiscale jobs',
+                        count)
+
+    if count:
+        logger.info('Filled in the run times of %d multiscale jobs in all',
+                    count)
+    return count
+
+
+def _backfill():
+    try:
+        backfillRunTimes()
+    except Exception:
+        logger.exception('Failed to fill in the multiscale job run times')
+
+
+def bindEvents():
+    """Keep the run times up to date, and fill in those of older jobs."""
+    events.bind('jobs.job.update.after', 'multiscale_walltime',
+                updateRunTimes)
+
+    thread = threading.Thread(target=_backfill, name='multiscale-walltime')
+    thread.daemon = True
+    thread.start()
@@ -0,0 +1,8 @@
+"""Girder worker extensions for multiscale calculations.
+
+The transforms in this package are created by the multiscale girder
+plugin and executed on the girder worker nodes, so this package must
+be installed both next to girder and next to girder_worker.
+"""
+
+__version__ = '0.1.0'
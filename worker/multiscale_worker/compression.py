@@ -0,0 +1,216 @@
+"""Repack calculation output into compressed, chunked NetCDF4/HDF5.
+
+Albany writes Exodus II files (NetCDF) and Dream3D writes HDF5 files,
+both usually without any compression. The transform in this module
+rewrites them with deflate compression and chunking before they are
+uploaded. netCDF4 and h5py are optional: files whose library is missing
+are uploaded unchanged.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import os
+import time
+
+from girder_worker_utils.transform import Transform
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+from .upload import walkFiles
+
+NETCDF_EXTENSIONS = ('.exo', '.e', '.nc')
+HDF5_EXTENSIONS = ('.dream3d', '.h5', '.hdf5')
+
+# The maximum number of bytes to copy from a variable at a time
+COPY_BLOCK_BYTES = 64 * 1024 ** 2
+
+
+def _blockRows(shape, itemsize):
+    """Get how many rows along the first axis fit in a copy block."""
+    rowBytes = itemsize
+    for n in shape[1:]:
+        rowBytes *= n
+    return max(1, COPY_BLOCK_BYTES // max(1, rowBytes))
+
+
+def _copyRows(src, dst, length, rows):
+    """Copy src to dst in slabs of 'rows' along the first axis."""
+    for start in range(0, length, rows):
+        stop = min(start + rows, length)
+        dst[start:stop] = src[start:stop]
+
+
+def repackNetCDF(srcPath, dstPath, level):
+    """Rewrite a NetCDF (e.g. Exodus II) file as compressed NetCDF4."""
+    with netCDF4.Dataset(srcPath, 'r') as src, \
+            netCDF4.Dataset(dstPath, 'w', format='NETCDF4') as dst:
+        src.set_auto_maskandscale(False)
+        dst.set_auto_maskandscale(False)
+        dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+
+        for name, dim in src.dimensions.items():
+            dst.createDimension(
+                name, None if dim.isunlimited() else len(dim))
+
+        for name, var in src.variables.items():
+            attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+            fillValue = attrs.pop('_FillValue', None)
+            compress = len(var.dimensions) > 0
+            out = dst.createVariable(name, var.datatype, var.dimensions,
+                                     zlib=compress, complevel=level,
+                                     shuffle=compress, fill_value=fillValue)
+            out.setncatts(attrs)
+
+            if not var.shape:
+                out.assignValue(var.getValue())
+            elif var.shape[0] > 0:
+                # Variable length strings have no item size
+                itemsize = getattr(var.dtype, 'itemsize', 1)
+                rows = _blockRows(var.shape, itemsize)
+                _copyRows(var, out, var.shape[0], rows)
+
+
+def _copyHdf5Attrs(src, dst):
+    """Copy HDF5 attributes, keeping their exact types."""
+    for name in src.attrs:
+        dst.attrs.create(name, src.attrs[name],
+                         dtype=src.attrs.get_id(name).dtype)
+
+
+def repackHdf5(srcPath, dstPath, level):
+    """Rewrite an HDF5 (e.g. Dream3D) file with gzip compression."""
+    with h5py.File(srcPath, 'r') as src, h5py.File(dstPath, 'w') as dst:
+        _copyHdf5Attrs(src, dst)
+
+        def copyObject(name, obj):
+            if isinstance(obj, h5py.Group):
+                _copyHdf5Attrs(obj, dst.require_group(name))
+                return
+
+            if not obj.shape or obj.size == 0:
+                out = dst.create_dataset(name, data=obj[()], dtype=obj.dtype)
+            else:
+                out = dst.create_dataset(name, shape=obj.shape,
+                                         dtype=obj.dtype, chunks=True,
+                                         compression='gzip',
+                                         compression_opts=level,
+                                         shuffle=True)
+                rows = _blockRows(obj.shape, obj.dtype.itemsize)
+                _copyRows(obj, out, obj.shape[0], rows)
+            _copyHdf5Attrs(obj, out)
+
+        src.visititems(copyObject)
+
+
+def repackFunction(path):
+    """Get the repack function for a file, or None if it is unsupported.
+
+    None is also returned if the required library is not installed.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in NETCDF_EXTENSIONS and netCDF4 is not None:
+        return repackNetCDF
+    if ext in HDF5_EXTENSIONS and h5py is not None:
+        return repackHdf5
+    return None
+
+
+def repackFile(path, level):
+    """Repack a file in place.
+
+    Returns a tuple of the original size and the new size. The original
+    file is kept if the repacked file would not be smaller.
+    """
+    repack = repackFunction(path)
+    originalSize = os.path.getsize(path)
+    if repack is None:
+        return originalSize, originalSize
+
+    tmpPath = path + '.repack'
+    try:
+        repack(path, tmpPath, level)
+        newSize = os.path.getsize(tmpPath)
+        if newSize >= originalSize:
+            return originalSize, originalSize
+        os.rename(tmpPath, path)
+        return originalSize, newSize
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+class CompressedVolumePath(Transform):
+    """Wrap a VolumePath and compress its files when used in a result hook.
+
+    Use this in place of the VolumePath given to an upload result hook.
+    Every supported file under the path is repacked with the given
+    deflate 'level' (1-9) before the hook uploads it. The compression
+    ratio and the time taken are printed into the job log. Files passed
+    to skipFiles() are left as they are.
+    """
+
+    def __init__(self, volumepath, level):
+        """Initialize with the VolumePath to wrap and a compression level."""
+        self._volumepath = volumepath
+        self._level = level
+        self._skipped = set()
+
+    def skipFiles(self, relPaths):
+        """Do not compress these files, e.g. because they were uploaded.
+
+        Repacking a file that was already uploaded would change its
+        signature, so it would be uploaded a second time.
+        """
+        self._skipped = set(relPaths)
+
+    def __str__(self):
+        """Use the same string as the wrapped VolumePath."""
+        return str(self._volumepath)
+
+    def transform(self, *args, **kwargs):
+        """Repack the output if this is a result hook and return its path."""
+        path = self._volumepath.transform(*args, **kwargs)
+
+        # Without arguments, this is not a result hook and the output
+        # does not exist yet.
+        if not args or not os.path.exists(path):
+            return path
+
+        start = time.time()
+        totalOriginal = 0
+        totalNew = 0
+        for relPath, fullPath in walkFiles(path):
+            if (relPath in self._skipped or
+                    repackFunction(fullPath) is None):
+                continue
+
+            fileStart = time.time()
+            try:
+                originalSize, newSize = repackFile(fullPath, self._level)
+            except Exception as e:
+                print('Warning: failed to compress', relPath + ':', e)
+                continue
+
+            totalOriginal += originalSize
+            totalNew += newSize
+            print('Compressed {}: {} -> {} bytes (ratio {:.2f}) in '
+                  '{:.1f} s'.format(relPath, originalSize, newSize,
+                                    float(originalSize) / max(newSize, 1),
+                                    time.time() - fileStart))
+
+        if totalOriginal:
+            print('Output compression: {} -> {} bytes (ratio {:.2f}) in '
+                  '{:.1f} s'.format(totalOriginal, totalNew,
+                                    float(totalOriginal) / max(totalNew, 1),
+                                    time.time() - start))
+
+        return path
@@ -0,0 +1,151 @@
+"""Verify and pre-pull the calculation images on every worker.
+
+The girder plugin broadcasts the PREPARE_COMMAND remote control command
+to all of the workers with the image references to check (e.g.
+"openchemistry/albany@sha256:..."). Each worker replies with whether it
+has each image, along with the image id and repository digests. If
+'pull' is set, the missing images are pulled in the background, so the
+command returns right away, and the progress of the pulls is reported
+by the next commands.
+
+Before a calculation runs, the worker also stores the id and digests
+that the image reference of the job resolved to in the job's meta data,
+since a tag may point to different builds on different workers.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import threading
+import time
+
+try:
+    import docker
+    from docker.errors import DockerException, ImageNotFound
+except ImportError:
+    # These imports will not be available on the girder side.
+    pass
+
+from celery.signals import task_prerun
+from celery.worker.control import control_command
+
+from .progress import currentJobId
+
+PREPARE_COMMAND = 'multiscale_prepare_images'
+
+# The tasks that run calculation images, whose first argument is the image
+RUN_TASKS = ('girder_worker.docker.tasks.docker_run',
+             'multiscale_worker.pool.warm_docker_run')
+
+# The plugin end point that stores the resolved image of a job
+IMAGE_PATH = 'multiscale/jobs/{id}/image'
+
+# The pulls started on this worker, by image reference
+_pulls = {}
+_pullsLock = threading.Lock()
+
+
+def imageStatus(client, reference):
+    """Get whether an image is present, with its id and digests."""
+    try:
+        image = client.images.get(reference)
+    except ImageNotFound:
+        return {'present': False}
+
+    return {
+        'present': True,
+        'id': image.id,
+        'repoDigests': image.attrs.get('RepoDigests', [])
+    }
+
+
+def pullImage(reference):
+    """Pull an image, recording the outcome in the pull state."""
+    start = time.time()
+    try:
+        docker.from_env(version='auto').images.pull(reference)
+        pull = {'state': 'done'}
+    except DockerException as e:
+        print('Warning: failed to pull', reference, e)
+        pull = {'state': 'error', 'error': str(e)}
+
+    pull['seconds'] = time.time() - start
+    with _pullsLock:
+        _pulls[reference] = pull
+
+
+def startPull(reference):
+    """Pull an image in a background thread, unless it is being pulled."""
+    with _pullsLock:
+        if _pulls.get(reference, {}).get('state') == 'pulling':
+            return
+        _pulls[reference] = {'state': 'pulling'}
+
+    thread = threading.Thread(target=pullImage, args=(reference, ),
+                              name='multiscale-pull')
+    thread.daemon = True
+    thread.start()
+
+
+@task_prerun.connect
+def recordImage(task=None, sender=None, args=None, kwargs=None, **rest):
+    """Store the image that a calculation runs in the job's meta data.
+
+    This runs after girder_worker has set up the girder client of the
+    task, since its handler is connected first.
+    """
+    if sender is None or sender.name not in RUN_TASKS:
+        return
+
+    jobId = currentJobId()
+    gc = getattr(task, 'girder_client', None)
+    reference = args[0] if args else (kwargs or {}).get('image')
+    if not jobId or gc is None or not reference:
+        return
+
+    try:
+        image = imageStatus(docker.from_env(version='auto'), reference)
+    except DockerException as e:
+        print('Warning: failed to resolve the image', reference, e)
+        return
+
+    # The task fails on its own if the image is missing
+    if not image.pop('present'):
+        return
+
+    image['reference'] = reference
+    try:
+        gc.put(IMAGE_PATH.format(id=jobId), json=image)
+    except Exception as e:
+        print('Warning: failed to save the image of the job:', e)
+
+
+@control_command(args=[('images', list), ('pull', bool)],
+                 signature='images, pull')
+def multiscale_prepare_images(state, images=None, pull=False):
+    """Report the status of images, and start pulling the missing ones.
+
+    Returns a dictionary that maps each image reference to its status.
+    """
+    try:
+        client = docker.from_env(version='auto')
+    except DockerException as e:
+        return {'error': str(e)}
+
+    report = {}
+    for reference in images or []:
+        try:
+            status = imageStatus(client, reference)
+        except DockerException as e:
+            status = {'present': False, 'error': str(e)}
+
+        if pull and not status['present']:
+            startPull(reference)
+
+        with _pullsLock:
+            if reference in _pulls:
+                status['pull'] = dict(_pulls[reference])
+
+        report[reference] = status
+
+    return report
@@ -0,0 +1,136 @@
+"""Select the output files of a job with a declarative manifest.
+
+A manifest is a dictionary with:
+
+    include     A list of glob patterns. Only files that match one of
+                them are uploaded (default: every file).
+    exclude     A list of glob patterns of files that are not uploaded.
+    maxFileMB   Files larger than this are not uploaded.
+    maxTotalMB  Once this much has been selected, no more files are.
+
+The patterns are matched against the path of each file relative to the
+output directory, with fnmatch, so "*" also matches "/".
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import fnmatch
+import os
+import shutil
+
+from girder_worker_utils.transform import Transform
+
+from .upload import walkFiles
+
+MB = 1024 ** 2
+
+
+class OutputManifest(object):
+    """The include and exclude patterns and size limits of the output."""
+
+    def __init__(self, include=None, exclude=None, maxFileMB=None,
+                 maxTotalMB=None):
+        """Initialize with the fields of the manifest."""
+        self.include = list(include or ['*'])
+        self.exclude = list(exclude or [])
+        self.maxFileMB = maxFileMB
+        self.maxTotalMB = maxTotalMB
+
+    @classmethod
+    def fromDict(cls, manifest):
+        """Create a manifest from a dictionary (or None for everything)."""
+        return cls(**(manifest or {}))
+
+    def matches(self, relPath, size):
+        """Check whether a file matches the patterns and the file limit.
+
+        The total limit is not checked.
+        """
+        if not any(fnmatch.fnmatch(relPath, x) for x in self.include):
+            return False
+
+        if any(fnmatch.fnmatch(relPath, x) for x in self.exclude):
+            return False
+
+        return self.maxFileMB is None or size <= self.maxFileMB * MB
+
+    def select(self, path):
+        """Select the files under 'path' that are uploaded.
+
+        Files are taken in the order of their relative paths. Files that
+        are left out because of a size limit are reported in the job log.
+
+        Returns a list of (relative path, full path) tuples.
+        """
+        selected = []
+        total = 0
+        for relPath, fullPath in walkFiles(path):
+            size = os.path.getsize(fullPath)
+            if not self.matches(relPath, size):
+                if (self.maxFileMB is not None and
+                        size > self.maxFileMB * MB and
+                        self.matches(relPath, 0)):
+                    print('Warning: not uploading {} ({:.1f} MB), which is '
+                          'larger than maxFileMB'.format(relPath,
+                                                         size / float(MB)))
+                continue
+
+            if (self.maxTotalMB is not None and
+                    total + size > self.maxTotalMB * MB):
+                print('Warning: not uploading {} ({:.1f} MB), which would '
+                      'exceed maxTotalMB'.format(relPath, size / float(MB)))
+                continue
+
+            total += size
+            selected.append((relPath, fullPath))
+
+        return selected
+
+
+class ManifestVolumePath(Transform):
+    """Wrap a VolumePath and select its files when used in a result hook.
+
+    Use this in place of the VolumePath given to a result hook. The
+    files under the path that the manifest selects are linked into a
+    directory next to it, with the same relative paths, and the path of
+    that directory is returned. The original files are left in place.
+    """
+
+    def __init__(self, volumepath, manifest=None):
+        """Initialize with the VolumePath to wrap and a manifest dict."""
+        self._volumepath = volumepath
+        self._manifest = manifest
+
+    def __str__(self):
+        """Use the same string as the wrapped VolumePath."""
+        return str(self._volumepath)
+
+    def transform(self, *args, **kwargs):
+        """Select the output if this is a result hook and return its path."""
+        path = self._volumepath.transform(*args, **kwargs)
+
+        # Without arguments, this is not a result hook and the output
+        # does not exist yet.
+        if not args or not os.path.exists(path):
+            return path
+
+        path = path.rstrip(os.sep)
+        selectedDir = os.path.join(os.path.dirname(path),
+                                   '.' + os.path.basename(path) + '_upload')
+        # Every result hook transforms the path, so start over each time
+        if os.path.isdir(selectedDir):
+            shutil.rmtree(selectedDir)
+        os.makedirs(selectedDir)
+
+        manifest = OutputManifest.fromDict(self._manifest)
+        for relPath, fullPath in manifest.select(path):
+            dest = os.path.join(selectedDir, relPath)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            try:
+                os.link(fullPath, dest)
+            except OSError:
+                shutil.copy2(fullPath, dest)
+
+        return selectedDir
@@ -0,0 +1,15 @@
+"""The girder_worker plugin that registers the multiscale tasks."""
+
+from girder_worker import GirderWorkerPluginABC
+
+
+class MultiscaleWorkerPlugin(GirderWorkerPluginABC):
+    """Import the tasks and remote control commands of the extensions."""
+
+    def __init__(self, app, *args, **kwargs):
+        """Initialize with the celery app."""
+        self.app = app
+
+    def task_imports(self):
+        """Get the modules that define the tasks and control commands."""
+        return ['multiscale_worker.images', 'multiscale_worker.pool']
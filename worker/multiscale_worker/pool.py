@@ -0,0 +1,493 @@
+"""Run short calculations in warm containers that are reused between jobs.
+
+Starting a container and initializing its environment (e.g. sourcing
+~/setupEnvironment for smtk) can take longer than a short calculation
+itself. With the warm_docker_run task, each worker process (a "slot")
+keeps a container running with its environment already initialized,
+and runs each job in it with "docker exec". The environment of the
+setup command is saved in the container and loaded before every job.
+
+The working directory of a job is a WarmPoolVolume, which is created
+in a directory of its slot. Only that directory is mounted into the
+warm container, so a job cannot see the files of the jobs of other
+slots. The default temporary volume of the task, if the job uses it,
+is moved into the slot directory at the path that the container sees
+at its usual mount point. After each job, the processes that it left
+behind are killed and /tmp is cleaned in the container. A container is
+replaced after "maxJobs" jobs or if a job was canceled or the container
+could not be reset, and it is stopped after "idleSeconds" without a
+job.
+
+The warm containers are labelled with the name of their worker. When a
+worker starts, it removes the containers left behind by a previous
+worker with the same name, e.g. one that was killed.
+
+The time from queuing a job to starting its calculation is stored in
+the 'multiscale_timing' meta data of the job, along with whether the
+container was already warm.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import docker
+    from docker.errors import DockerException
+except ImportError:
+    # These imports will not be available on the girder side.
+    pass
+
+from celery.signals import celeryd_after_setup, worker_process_shutdown
+
+from girder_worker.app import app
+from girder_worker.docker.io import StdStreamWriter
+from girder_worker.docker.tasks import DockerTask
+from girder_worker.docker.transforms import TEMP_VOLUME_MOUNT_PREFIX
+
+from .progress import currentJobId
+from .scratch import ScratchVolume
+
+TIMING_PATH = 'multiscale/jobs/{id}/timing'
+
+# The directory (in the scratch or temporary directory) of the slots
+POOL_DIR_NAME = 'multiscale_warm_pool'
+
+# The label of the warm containers, for finding leftover ones. Its
+# value is the name of the worker that started the container.
+POOL_LABEL = 'multiscale.warm_pool'
+
+DEFAULT_MAX_JOBS = 100
+DEFAULT_IDLE_SECONDS = 1800
+
+# How often the idle containers of a worker process are looked for
+REAP_INTERVAL = 60
+
+# How long the setup of a new container may take
+READY_TIMEOUT = 600
+
+# Where the environment of the setup command is saved in the container
+ENV_FILE = '/tmp/.multiscale_warm_env'
+
+# The command of a warm container. It runs the setup command, saves the
+# resulting environment, and then waits for jobs.
+START_SCRIPT = '''
+%s
+export -p | grep -v -e '^declare -x \\(OLDPWD\\|PWD\\|SHLVL\\)=' \\
+    > ''' + ENV_FILE + '''.tmp
+mv ''' + ENV_FILE + '.tmp ' + ENV_FILE + '''
+exec sleep infinity
+'''
+
+# Runs a job's command ("$@") in its working directory ($1) with the
+# saved environment
+EXEC_SCRIPT = '''
+cd "$1" || exit 1
+shift
+. ''' + ENV_FILE + '''
+exec "$@"
+'''
+
+# Cleans up after a job. "kill -9 -1" kills every process except the
+# container's init process (sleep) and this shell.
+RESET_SCRIPT = '''
+kill -9 -1 2> /dev/null
+find /tmp -mindepth 1 -maxdepth 1 ! -path ''' + ENV_FILE + ''' \\
+    -exec rm -rf {} +
+'''
+
+# The docker_run arguments that are applied when a warm container is
+# created. Containers with different values are not shared.
+CONTAINER_KWARGS = ('nano_cpus', 'mem_limit', 'memswap_limit')
+
+
+def slotName():
+    """Get the name of the slot of the running task."""
+    return 'slot-%d-%x' % (os.getpid(), threading.current_thread().ident)
+
+
+class WarmPoolVolume(ScratchVolume):
+    """A ScratchVolume in the directory of the slot that runs the job.
+
+    Use it as the working volume of jobs that run with warm_docker_run.
+    The volume is created in <host_dir>/multiscale_warm_pool/<slot>, or
+    in the same directory under the default temporary directory.
+    """
+
+    def _fallbackDir(self):
+        path = os.path.join(tempfile.gettempdir(), POOL_DIR_NAME,
+                            slotName())
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def _make_paths(self, host_dir=None, mode=0o755):
+        if host_dir:
+            host_dir = os.path.join(host_dir, POOL_DIR_NAME, slotName())
+        super(WarmPoolVolume, self)._make_paths(host_dir, mode)
+
+
+class WarmContainer(object):
+    """A container that runs the jobs of a slot one after the other."""
+
+    def __init__(self, client, image, setup, mountDir, containerKwargs,
+                 owner, idleSeconds=DEFAULT_IDLE_SECONDS):
+        """Start a container and wait for its environment to be ready.
+
+        'mountDir' is the slot directory on the host, which is mounted
+        where the job volumes are mounted in ordinary containers.
+        'owner' is the name of the worker, which labels the container.
+        """
+        self.client = client
+        self.key = (image, setup, mountDir,
+                    tuple(sorted(containerKwargs.items())))
+        self.jobs = 0
+        self.lastUsed = time.time()
+        self.idleSeconds = idleSeconds
+
+        start = time.time()
+        self.container = client.containers.run(
+            image, ['-c', START_SCRIPT % (setup or '')], entrypoint=['bash'],
+            detach=True, tty=False, labels={POOL_LABEL: owner},
+            volumes={mountDir: {'bind': TEMP_VOLUME_MOUNT_PREFIX,
+                                'mode': 'rw'}},
+            **containerKwargs)
+        try:
+            self._waitUntilReady()
+        except Exception:
+            self.stop()
+            raise
+        self.startSeconds = time.time() - start
+        print('Started a warm container in {:.1f} s'.format(
+            self.startSeconds))
+
+    def _waitUntilReady(self):
+        deadline = time.time() + READY_TIMEOUT
+        while time.time() < deadline:
+            if not self.isRunning():
+                raise DockerException(
+                    'The warm container exited during its setup:\n' +
+                    self.container.logs().decode('utf-8', 'replace'))
+            if self._exec(['test', '-f', ENV_FILE]) == 0:
+                return
+            time.sleep(0.2)
+
+        raise DockerException('The warm container was not ready after %d s' %
+                              READY_TIMEOUT)
+
+    def _exec(self, command, environment=None, output=None):
+        """Run a command in the container and return its exit code.
+
+        If 'output' is given, the output of the command is written to it
+        as it is produced.
+        """
+        api = self.client.api
+        execId = api.exec_create(self.container.id, command,
+                                 environment=environment)['Id']
+        stream = api.exec_start(execId, stream=output is not None)
+        if output is not None:
+            for chunk in stream:
+                output.write(chunk)
+        return api.exec_inspect(execId)['ExitCode']
+
+    def isRunning(self):
+        """Check whether the container is still running."""
+        try:
+            self.container.reload()
+        except DockerException:
+            return False
+        return self.container.status == 'running'
+
+    def run(self, command, workingDir, environment, task):
+        """Run a job's command and return its exit code.
+
+        If the task is canceled, the job's processes are killed.
+        """
+        self.jobs += 1
+        done = threading.Event()
+
+        def watchCancel():
+            while not done.wait(1):
+                if task.canceled:
+                    self.reset()
+                    return
+
+        watcher = threading.Thread(target=watchCancel)
+        watcher.daemon = True
+        watcher.start()
+        try:
+            return self._exec(['bash', '-c', EXEC_SCRIPT, 'multiscale-warm',
+                               workingDir] + command,
+                              environment=environment,
+                              output=StdStreamWriter(sys.stdout))
+        finally:
+            done.set()
+            watcher.join()
+            self.lastUsed = time.time()
+
+    def reset(self):
+        """Clean up after a job. Returns False if that failed."""
+        try:
+            return self._exec(['sh', '-c', RESET_SCRIPT]) == 0
+        except DockerException as e:
+            print('Warning: failed to reset the warm container:', e)
+            return False
+
+    def stop(self):
+        """Stop and remove the container."""
+        try:
+            self.container.remove(force=True)
+        except DockerException as e:
+            print('Warning: failed to remove the warm container:', e)
+
+
+# The warm container of each slot of this process
+_containers = {}
+_containersLock = threading.Lock()
+
+
+def acquireContainer(client, image, setup, mountDir, containerKwargs,
+                     maxJobs, idleSeconds, owner):
+    """Get the warm container of the current slot, starting it if needed.
+
+    Returns a tuple of the container and whether it was already warm.
+    """
+    slot = slotName()
+    with _containersLock:
+        warm = _containers.pop(slot, None)
+
+    key = (image, setup, mountDir, tuple(sorted(containerKwargs.items())))
+    if warm is not None and (
+            warm.key != key or warm.jobs >= maxJobs or
+            time.time() - warm.lastUsed > idleSeconds or
+            not warm.isRunning()):
+        warm.stop()
+        warm = None
+
+    if warm is not None:
+        warm.idleSeconds = idleSeconds
+        return warm, True
+
+    return WarmContainer(client, image, setup, mountDir, containerKwargs,
+                         owner, idleSeconds), False
+
+
+def releaseContainer(warm, canceled=False):
+    """Keep a container for the next job of the slot, if it can be reset."""
+    if canceled or not warm.reset() or not warm.isRunning():
+        warm.stop()
+        return
+
+    with _containersLock:
+        _containers[slotName()] = warm
+    startReaper()
+
+
+def reapIdleContainers():
+    """Stop the containers that have been idle for their idleSeconds."""
+    now = time.time()
+    with _containersLock:
+        idle = [slot for slot, warm in _containers.items()
+                if now - warm.lastUsed > warm.idleSeconds]
+        stopped = [_containers.pop(slot) for slot in idle]
+
+    for warm in stopped:
+        warm.stop()
+
+
+def _reapLoop():
+    while True:
+        time.sleep(REAP_INTERVAL)
+        try:
+            reapIdleContainers()
+        except Exception as e:
+            print('Warning: failed to stop the idle warm containers:', e)
+
+
+_reaper = None
+
+
+def startReaper():
+    """Start stopping idle containers in this process, if not done yet."""
+    global _reaper
+    with _containersLock:
+        if _reaper is not None:
+            return
+
+        _reaper = threading.Thread(target=_reapLoop,
+                                   name='multiscale-warm-reaper')
+        _reaper.daemon = True
+        _reaper.start()
+
+
+@worker_process_shutdown.connect
+def stopContainers(**kwargs):
+    """Stop the warm containers when the worker process exits."""
+    with _containersLock:
+        containers = list(_containers.values())
+        _containers.clear()
+
+    for warm in containers:
+        warm.stop()
+
+
+@celeryd_after_setup.connect
+def removeLeftoverContainers(sender=None, **kwargs):
+    """Remove the warm containers of a previous worker with this name.
+
+    This runs when the worker starts, before it has started any warm
+    container, so every container labelled with its name was left
+    behind, e.g. by a worker that was killed.
+    """
+    try:
+        client = docker.from_env(version='auto')
+        leftovers = client.containers.list(
+            all=True, filters={'label': '%s=%s' % (POOL_LABEL, sender)})
+    except Exception as e:
+        print('Warning: failed to look for leftover warm containers:', e)
+        return
+
+    for container in leftovers:
+        try:
+            container.remove(force=True)
+        except DockerException as e:
+            print('Warning: failed to remove the leftover warm container',
+                  container.id, e)
+
+    if leftovers:
+        print('Removed', len(leftovers), 'leftover warm containers')
+
+
+def findMountDir(volumes, defaultVolume):
+    """Find the slot directory that holds the job's working volume.
+
+    'volumes' are the docker volumes of the task. The default temporary
+    volume is ignored, and every other volume must be a WarmPoolVolume.
+    """
+    slot = slotName()
+    mountDirs = set()
+    for hostPath, spec in volumes.items():
+        if hostPath == defaultVolume.host_path:
+            continue
+
+        hostDir, name = os.path.split(hostPath.rstrip(os.sep))
+        if (os.path.basename(hostDir) != slot or
+                spec['bind'] != os.path.join(TEMP_VOLUME_MOUNT_PREFIX, name)):
+            raise ValueError('Only WarmPoolVolumes can be mounted into warm '
+                             'containers: ' + hostPath)
+        mountDirs.add(hostDir)
+
+    if len(mountDirs) != 1:
+        raise ValueError('A warm container needs exactly one WarmPoolVolume')
+
+    return mountDirs.pop()
+
+
+def adoptDefaultVolume(defaultVolume, mountDir):
+    """Make the default temporary volume of a task visible to the job.
+
+    Ordinary containers mount it at its container path, under the
+    TEMP_VOLUME_MOUNT_PREFIX. A warm container only mounts the slot
+    directory there, so the volume is moved to the path in the slot
+    directory that appears at its container path. DockerTask removes it
+    from there after the task, since it is the same volume object.
+    """
+    hostPath = os.path.join(
+        mountDir, os.path.basename(defaultVolume.container_path))
+    shutil.move(defaultVolume.host_path, hostPath)
+    defaultVolume._host_path = hostPath
+
+
+def recordTiming(task, timing):
+    """Store the timing of a job in its meta data."""
+    jobId = currentJobId()
+    gc = getattr(task, 'girder_client', None)
+    if not jobId or gc is None:
+        return
+
+    try:
+        gc.put(TIMING_PATH.format(id=jobId), json=timing)
+    except Exception as e:
+        print('Warning: failed to save the job timing:', e)
+
+
+@app.task(base=DockerTask, bind=True)
+def warm_docker_run(task, image, warm_pool=None, entrypoint=None,
+                    container_args=None, volumes=None, working_dir=None,
+                    environment=None, **kwargs):
+    """Run a docker_run task in the warm container of this slot.
+
+    The arguments are those of docker_run, plus 'warm_pool', which is a
+    dictionary with the 'setup' command that initializes the
+    environment of the container, 'maxJobs' and 'idleSeconds' to
+    recycle the container, and the 'queuedTime' of the job (seconds
+    since the epoch). The image must have bash.
+
+    Image pulls, stream connectors and other docker_run arguments are
+    not supported, except for the CPU and memory limits.
+    """
+    warmPool = warm_pool or {}
+    containerKwargs = {k: kwargs.pop(k) for k in CONTAINER_KWARGS
+                       if k in kwargs}
+    for key in ('pull_image', 'remove_container'):
+        kwargs.pop(key, None)
+    if kwargs:
+        raise TypeError('Unsupported arguments for a warm container: ' +
+                        ', '.join(sorted(kwargs)))
+
+    defaultVolume = task.request._default_temp_volume
+    mountDir = findMountDir(volumes or {}, defaultVolume)
+    # The arguments of the job only refer to the default volume if they
+    # transformed it
+    if defaultVolume._transformed:
+        adoptDefaultVolume(defaultVolume, mountDir)
+
+    if entrypoint is not None and not isinstance(entrypoint, (list, tuple)):
+        entrypoint = [entrypoint]
+    command = list(entrypoint or []) + list(container_args or [])
+
+    client = docker.from_env(version='auto')
+    warm, wasWarm = acquireContainer(
+        client, image, warmPool.get('setup'), mountDir, containerKwargs,
+        warmPool.get('maxJobs') or DEFAULT_MAX_JOBS,
+        warmPool.get('idleSeconds') or DEFAULT_IDLE_SECONDS,
+        task.request.hostname)
+
+    startTime = time.time()
+    timing = {
+        'warm': wasWarm,
+        'containerStartSeconds': 0 if wasWarm else warm.startSeconds,
+        'containerJobs': warm.jobs + 1,
+        'startTime': startTime
+    }
+    queuedTime = warmPool.get('queuedTime')
+    if queuedTime is not None:
+        timing['queuedTime'] = queuedTime
+        timing['queueToStartSeconds'] = startTime - queuedTime
+        print('Queue to start latency: {:.1f} s ({} container)'.format(
+            timing['queueToStartSeconds'], 'warm' if wasWarm else 'new'))
+
+    try:
+        exitCode = warm.run(command, working_dir or '.', environment or {},
+                            task)
+    finally:
+        timing['runSeconds'] = time.time() - startTime
+        releaseContainer(warm, canceled=task.canceled)
+        recordTiming(task, timing)
+
+    if not task.canceled and exitCode != 0:
+        raise DockerException(
+            'Non-zero exit code from docker container (%d).' % exitCode)
+
+    # Trigger the result hooks, as docker_run does
+    results = []
+    if hasattr(task.request, 'girder_result_hooks'):
+        results = (None, ) * len(task.request.girder_result_hooks)
+
+    return results
@@ -0,0 +1,245 @@
+"""Report the progress of the stages of a job to girder.
+
+Progress is sent through the job manager of girder_worker, so it is
+stored in the 'progress' field of the job, and girder sends it to the
+user as a notification. The message of each update starts with the
+name of the stage ('staging', 'solving' or 'uploading'), followed by a
+colon and the details, e.g. 'staging: 45% (12.0 of 26.5 MB)'.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import contextlib
+import os
+import re
+import sys
+import threading
+
+from celery import current_task
+
+from girder_worker.docker.io import FDReadStreamConnector, StdStreamWriter
+from girder_worker.docker.transforms import ContainerStdOut
+from girder_worker_utils.transform import Transform
+
+STAGING = 'staging'
+SOLVING = 'solving'
+UPLOADING = 'uploading'
+
+MB = float(1024 ** 2)
+
+
+def currentJobManager():
+    """Get the job manager of the running task, or None.
+
+    celery's current_task is local to the thread that runs the task, so
+    threads started by the task must be handed the job manager.
+    """
+    return getattr(current_task, 'job_manager', None)
+
+
+def reportProgress(stage, current=None, total=None, detail=None,
+                   forceFlush=False, jobManager=None):
+    """Update the progress of the running job.
+
+    A 'total' of 0 means that the length of the stage is unknown. The
+    progress goes to 'jobManager', which is the job manager of the
+    running task by default. This is a no-op when the task is not
+    running as a girder job.
+    """
+    jobManager = jobManager or currentJobManager()
+    if jobManager is None:
+        return
+
+    message = stage if detail is None else '%s: %s' % (stage, detail)
+    jobManager.updateProgress(total=total, current=current, message=message,
+                              forceFlush=forceFlush)
+
+
+def currentJobId():
+    """Get the id of the girder job of the running task, or None."""
+    jobManager = currentJobManager()
+    url = getattr(jobManager, 'url', None)
+    if not url:
+        return None
+
+    # The job manager updates the job at <api url>/job/<job id>
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+def folderSize(gc, folderId):
+    """Get the total size of the files in a girder folder, recursively."""
+    size = gc.getFolder(folderId).get('size', 0)
+    for folder in gc.listFolder(folderId):
+        size += folderSize(gc, folder['_id'])
+
+    return size
+
+
+def treeSize(path):
+    """Get the total size of a local file, or of the files in a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+
+    return size
+
+
+class ByteProgress(object):
+    """The progress of a stage that transfers a known number of bytes.
+
+    While 'reporting(gc)' is active, every download and upload of the
+    GirderClient counts towards the progress, including the transfers
+    made by other threads. Bytes that do not need to be transferred
+    (e.g. cached files) can be counted with update().
+
+    It must be created by the thread that runs the task, whose job
+    manager it reports to.
+    """
+
+    def __init__(self, stage, totalBytes):
+        """Initialize with the name of the stage and the bytes expected."""
+        self.stage = stage
+        self.totalBytes = totalBytes
+        self.currentBytes = 0
+        self.jobManager = currentJobManager()
+        self._lock = threading.Lock()
+
+    def _report(self, forceFlush=False):
+        current = min(self.currentBytes, self.totalBytes)
+        percent = 100.0 * current / self.totalBytes if self.totalBytes else 100
+        detail = '{:.0f}% ({:.1f} of {:.1f} MB)'.format(
+            percent, current / MB, self.totalBytes / MB)
+        reportProgress(self.stage, current, self.totalBytes, detail,
+                       forceFlush=forceFlush, jobManager=self.jobManager)
+
+    def update(self, numBytes):
+        """Count bytes towards the progress."""
+        with self._lock:
+            self.currentBytes += numBytes
+            self._report()
+
+    def reporterClass(self):
+        """Get a class to use as the progressReporterCls of a GirderClient."""
+        progress = self
+
+        class Reporter(object):
+            # Keeps the client from printing a line per uploaded file
+            reportProgress = True
+
+            def __init__(self, label='', length=0):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, excType, excValue, traceback):
+                pass
+
+            def update(self, chunkSize):
+                progress.update(chunkSize)
+
+        return Reporter
+
+    @contextlib.contextmanager
+    def reporting(self, gc):
+        """Count the transfers of 'gc' towards the progress."""
+        with self._lock:
+            self._report(forceFlush=True)
+
+        previous = gc.progressReporterCls
+        gc.progressReporterCls = self.reporterClass()
+        try:
+            yield self
+        finally:
+            gc.progressReporterCls = previous
+
+        with self._lock:
+            self.currentBytes = self.totalBytes
+            self._report(forceFlush=True)
+
+
+@contextlib.contextmanager
+def stagingProgress(gc, folderId):
+    """Report the progress of staging a girder folder.
+
+    Once it is staged, the job is reported to be solving.
+    """
+    progress = ByteProgress(STAGING, folderSize(gc, folderId))
+    with progress.reporting(gc):
+        yield progress
+
+    reportProgress(SOLVING, 0, 0, forceFlush=True)
+
+
+class AlbanyProgressWriter(StdStreamWriter):
+    """Write the output of Albany to stdout and report its progress.
+
+    The continuation (load) steps of LOCA and the Newton iterations of
+    NOX are parsed from the output.
+    """
+
+    CONTINUATION_STEP = re.compile(br'Start of Continuation Step (\d+)')
+    NEWTON_ITERATION = re.compile(br'-- Nonlinear Solver Step (\d+) --')
+
+    def __init__(self, stream=None):
+        """Initialize with the stream to write to (default: stdout)."""
+        super(AlbanyProgressWriter, self).__init__(stream or sys.stdout)
+        # The output may be read by another thread than the task's
+        self.jobManager = currentJobManager()
+        self._partialLine = b''
+        self.step = None
+        self.iteration = None
+
+    def write(self, buf):
+        """Write a chunk of output and parse its complete lines."""
+        result = super(AlbanyProgressWriter, self).write(buf)
+
+        lines = (self._partialLine + buf).split(b'\n')
+        self._partialLine = lines.pop()
+        for line in lines:
+            self.parseLine(line)
+
+        return result
+
+    def parseLine(self, line):
+        """Update the progress if a line starts a step or an iteration."""
+        match = AlbanyProgressWriter.CONTINUATION_STEP.search(line)
+        if match:
+            self.step = int(match.group(1))
+            self.iteration = None
+            self._report()
+            return
+
+        match = AlbanyProgressWriter.NEWTON_ITERATION.search(line)
+        if match:
+            self.iteration = int(match.group(1))
+            self._report()
+
+    def _report(self):
+        details = []
+        if self.step is not None:
+            details.append('continuation step %d' % self.step)
+        if self.iteration is not None:
+            details.append('Newton iteration %d' % self.iteration)
+
+        current = self.step if self.step is not None else self.iteration
+        reportProgress(SOLVING, current, 0, ', '.join(details),
+                       jobManager=self.jobManager)
+
+
+class AlbanyProgressStdOut(Transform):
+    """A docker_run stream connector that parses the progress of Albany.
+
+    Pass it in the 'stream_connectors' of docker_run. The output of the
+    container still goes to the job log.
+    """
+
+    def transform(self, **kwargs):
+        """Connect the standard output of the container to the parser."""
+        return FDReadStreamConnector(ContainerStdOut(),
+                                     AlbanyProgressWriter())
@@ -0,0 +1,102 @@
+"""Working directories on a configurable scratch file system.
+
+By default, the working directory of a calculation is in the temporary
+volume of girder_worker, which is on the root disk of the worker. A
+ScratchVolume is created in another directory instead (e.g. on a local
+NVMe disk, or a tmpfs for small runs), if that directory has enough
+free space. Otherwise, it falls back to the default temporary directory.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import os
+import tempfile
+import uuid
+
+from girder_worker.docker.transforms import (
+    TEMP_VOLUME_MOUNT_PREFIX,
+    TemporaryVolume
+)
+
+GIB = float(1024 ** 3)
+
+
+def freeBytes(path):
+    """Get the number of bytes available to unprivileged users on a path."""
+    stats = os.statvfs(path)
+    return stats.f_bavail * stats.f_frsize
+
+
+def hasScratchSpace(directory, requiredBytes, mode=0o755):
+    """Check whether a scratch directory is usable and has enough room.
+
+    The directory is created if it does not exist. The reason why it
+    cannot be used is printed, which places it in the job log.
+    """
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            os.chmod(directory, mode)
+        available = freeBytes(directory)
+    except OSError as e:
+        print('Warning: the scratch directory', directory,
+              'cannot be used:', e)
+        return False
+
+    if available < requiredBytes:
+        print('Warning: the scratch directory {} has {:.2f} GiB free, but '
+              '{:.2f} GiB are needed.'.format(directory, available / GIB,
+                                              requiredBytes / GIB))
+        return False
+
+    return True
+
+
+class ScratchVolume(TemporaryVolume):
+    """A temporary volume in a scratch directory, with a fallback.
+
+    When the volume is first used, which is before the input files are
+    staged into it, the free space of 'host_dir' is compared with
+    'required_bytes'. If the directory does not have enough room or
+    cannot be used, the volume is created in the default temporary
+    directory of the worker instead.
+
+    The host and container paths are derived from 'name' rather than
+    created randomly. The result hooks of a task are deserialized
+    separately from its arguments, so their copy of the volume has to
+    find the same directory.
+    """
+
+    def __init__(self, host_dir, required_bytes=0, name=None, mode=0o755):
+        """Initialize with the scratch directory and the space needed."""
+        super(ScratchVolume, self).__init__(host_dir=host_dir, mode=mode)
+        self.required_bytes = required_bytes
+        self.name = name or uuid.uuid4().hex
+
+    def _fallbackDir(self):
+        """Get the directory to create the volume in without scratch space."""
+        return tempfile.gettempdir()
+
+    def _make_paths(self, host_dir=None, mode=0o755):
+        self._container_path = os.path.join(TEMP_VOLUME_MOUNT_PREFIX,
+                                            self.name)
+
+        scratchPath = os.path.join(host_dir, self.name) if host_dir else None
+        fallbackPath = os.path.join(self._fallbackDir(), self.name)
+        for path in (scratchPath, fallbackPath):
+            if path and os.path.isdir(path):
+                self._host_path = path
+                return
+
+        if scratchPath and hasScratchSpace(host_dir, self.required_bytes,
+                                           mode):
+            self._host_path = scratchPath
+            print('Using the scratch directory', host_dir)
+        else:
+            self._host_path = fallbackPath
+            print('Using the default temporary directory',
+                  self._fallbackDir())
+
+        # The same permissions as tempfile.mkdtemp()
+        os.mkdir(self._host_path, 0o700)
@@ -0,0 +1,235 @@
+"""Worker-local, content-addressed staging cache for girder input files."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import errno
+import os
+import shutil
+import stat
+import tempfile
+
+from girder_worker.docker.transforms import TemporaryVolume
+from girder_worker.docker.transforms.girder import GirderFolderIdToVolume
+
+from .progress import stagingProgress
+
+
+class StagingCache(object):
+    """A cache of girder files on the local disk, keyed by checksum.
+
+    Files are stored as <cacheDir>/<sha512[:2]>/<sha512>. The
+    modification time of each cached file is refreshed whenever it is
+    used, and the least recently used files are evicted whenever the
+    total size of the cache exceeds 'maxBytes'.
+    """
+
+    TMP_DIR_NAME = 'tmp'
+
+    def __init__(self, cacheDir, maxBytes, progress=None):
+        """Initialize with a cache directory and a disk budget in bytes.
+
+        The bytes of cache hits are counted towards 'progress' (a
+        ByteProgress), if it is given.
+        """
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.progress = progress
+
+        self.hits = 0
+        self.misses = 0
+        self.bytesSaved = 0
+        self.bytesFetched = 0
+
+        tmpDir = os.path.join(cacheDir, StagingCache.TMP_DIR_NAME)
+        if not os.path.isdir(tmpDir):
+            os.makedirs(tmpDir)
+
+    def _cachePath(self, checksum):
+        """Get the path where a file with the given checksum is stored."""
+        return os.path.join(self.cacheDir, checksum[:2], checksum)
+
+    def _download(self, gc, fileId, cachePath):
+        """Download a file into the cache.
+
+        The file is downloaded to a temporary location first and then
+        renamed, so that other processes never see partial files.
+        """
+        tmpDir = os.path.join(self.cacheDir, StagingCache.TMP_DIR_NAME)
+        fd, tmpPath = tempfile.mkstemp(dir=tmpDir)
+        os.close(fd)
+        try:
+            gc.downloadFile(fileId, tmpPath)
+            # Cached files are never modified, only copied from
+            os.chmod(tmpPath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+            parent = os.path.dirname(cachePath)
+            if not os.path.isdir(parent):
+                try:
+                    os.makedirs(parent)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            os.rename(tmpPath, cachePath)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    def stageFile(self, gc, fileDoc, dest):
+        """Place a girder file at 'dest', using the cache when possible.
+
+        'fileDoc' is the girder file document. Files without a checksum
+        are downloaded directly and are not cached.
+
+        Cached files are copied rather than hardlinked: the containers
+        run as root, which ignores the read-only mode of the cache, so a
+        job that wrote to a linked input would corrupt it for every
+        later job.
+        """
+        checksum = fileDoc.get('sha512')
+        size = fileDoc.get('size', 0)
+
+        if not checksum:
+            self.misses += 1
+            self.bytesFetched += size
+            gc.downloadFile(fileDoc['_id'], dest)
+            return
+
+        cachePath = self._cachePath(checksum)
+        if os.path.isfile(cachePath):
+            self.hits += 1
+            self.bytesSaved += size
+            # Mark it as recently used
+            os.utime(cachePath, None)
+            if self.progress is not None:
+                self.progress.update(size)
+        else:
+            self.misses += 1
+            self.bytesFetched += size
+            self._download(gc, fileDoc['_id'], cachePath)
+
+        shutil.copyfile(cachePath, dest)
+
+    def stageItem(self, gc, item, dest):
+        """Stage a girder item the same way GirderClient.downloadItem does.
+
+        An item with a single file is placed at dest/<item name>.
+        Otherwise, a directory is made for the item with its files inside.
+        """
+        files = list(gc.listFile(item['_id']))
+        if len(files) == 1:
+            self.stageFile(gc, files[0], os.path.join(dest, item['name']))
+            return
+
+        itemDir = os.path.join(dest, item['name'])
+        if not os.path.isdir(itemDir):
+            os.makedirs(itemDir)
+        for fileDoc in files:
+            self.stageFile(gc, fileDoc, os.path.join(itemDir, fileDoc['name']))
+
+    def stageFolder(self, gc, folderId, dest):
+        """Recursively stage a girder folder into the local 'dest'."""
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+
+        for item in gc.listItem(folderId):
+            self.stageItem(gc, item, dest)
+
+        for folder in gc.listFolder(folderId):
+            self.stageFolder(gc, folder['_id'],
+                             os.path.join(dest, folder['name']))
+
+    def evict(self):
+        """Remove the least recently used files until within budget.
+
+        The working directories have their own copies, so files may be
+        removed from the cache at any time.
+        """
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.cacheDir):
+            if root == os.path.join(self.cacheDir, StagingCache.TMP_DIR_NAME):
+                continue
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Removed by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        return evicted
+
+    def hitRate(self):
+        """Get the fraction of staged files that were found in the cache."""
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def report(self):
+        """Get a one-line summary of the cache statistics."""
+        return ('Staging cache: {} hits, {} misses ({:.1f}% hit rate), '
+                '{} bytes saved, {} bytes downloaded').format(
+                    self.hits, self.misses, self.hitRate() * 100.0,
+                    self.bytesSaved, self.bytesFetched)
+
+
+class CachedGirderFolderIdToVolume(GirderFolderIdToVolume):
+    """A GirderFolderIdToVolume that stages files through a StagingCache.
+
+    The working directory is populated by copying from the cache
+    instead of downloading every file for every job. The cache
+    statistics are printed, which places them in the job log.
+    """
+
+    def __init__(self, _id, volume=TemporaryVolume.default, folder_name=None,
+                 cache_dir=None, cache_max_bytes=0, **kwargs):
+        """Initialize with a cache directory and budget in bytes."""
+        super(CachedGirderFolderIdToVolume, self).__init__(
+            _id, volume=volume, folder_name=folder_name, **kwargs)
+        self._cache_dir = cache_dir
+        self._cache_max_bytes = cache_max_bytes
+
+    def transform(self, **kwargs):
+        """Stage the folder into the volume and return the container path."""
+        self._volume.transform(**kwargs)
+        # The folder is removed by the cleanup of the parent class
+        relPath, self._folder_path = self._create_folder_path(
+            self._volume.host_path)
+
+        with stagingProgress(self.gc, self._folder_id) as progress:
+            cache = StagingCache(self._cache_dir, self._cache_max_bytes,
+                                 progress)
+            cache.stageFolder(self.gc, self._folder_id, self._folder_path)
+        print(cache.report())
+
+        evicted = cache.evict()
+        if evicted:
+            print('Staging cache: evicted', evicted, 'files')
+
+        return os.path.join(self._volume.container_path, relPath)
+
+
+class ProgressGirderFolderIdToVolume(GirderFolderIdToVolume):
+    """A GirderFolderIdToVolume that reports the staging progress."""
+
+    def transform(self, **kwargs):
+        """Download the folder and return its path in the container."""
+        with stagingProgress(self.gc, self._folder_id):
+            return super(ProgressGirderFolderIdToVolume, self).transform(
+                **kwargs)
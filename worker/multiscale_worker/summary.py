@@ -0,0 +1,197 @@
+"""Summarize Exodus output and save the summary in the job meta data.
+
+Albany and the smtk mesh placement write Exodus II files, which are
+NetCDF files. The summary holds the mesh size, the time steps, and the
+minimum, maximum and mean of every global, nodal and element variable
+at the final time step, so that a run can be checked without
+downloading its output. Only the final time step of each variable is
+read from the file. netCDF4 is optional: without it, no summary is
+made.
+"""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import time
+
+from girder_worker_utils.transforms.girder_io import GirderClientTransform
+
+try:
+    import netCDF4
+    import numpy
+except ImportError:
+    netCDF4 = None
+
+from .progress import currentJobId
+from .upload import walkFiles
+
+EXODUS_EXTENSIONS = ('.exo', '.e')
+
+# The plugin end point that stores the summary of a job
+SUMMARY_PATH = 'multiscale/jobs/{id}/summary'
+
+
+def _names(dataset, variableName):
+    """Read an Exodus variable of names (a 2D character array)."""
+    names = netCDF4.chartostring(dataset.variables[variableName][:])
+    # Mongo keys may not contain dots or start with a dollar sign
+    return [str(x).strip().replace('.', '_').lstrip('$') for x in names]
+
+
+def _accumulate(stats, name, values):
+    """Add an array of values to the statistics of a variable."""
+    data = numpy.ma.masked_invalid(numpy.ma.asarray(values,
+                                                    dtype=numpy.float64))
+    count = int(data.count())
+    if count == 0:
+        return
+
+    entry = stats.setdefault(name, {
+        'min': float('inf'),
+        'max': float('-inf'),
+        'sum': 0.0,
+        'count': 0
+    })
+    entry['min'] = min(entry['min'], float(data.min()))
+    entry['max'] = max(entry['max'], float(data.max()))
+    entry['sum'] += float(data.sum())
+    entry['count'] += count
+
+
+def _finish(stats):
+    """Turn accumulated statistics into min, max and mean."""
+    return dict((name, {
+        'min': entry['min'],
+        'max': entry['max'],
+        'mean': entry['sum'] / entry['count']
+    }) for name, entry in stats.items())
+
+
+def summarizeExodus(path):
+    """Summarize an Exodus file.
+
+    Returns a dictionary with the mesh size, the number of time steps,
+    the first and final times, and a 'variables' dictionary with the
+    'global', 'nodal' and 'element' variables. Each variable has the
+    'min', 'max' and 'mean' of its values at the final time step (over
+    all element blocks for element variables).
+    """
+    with netCDF4.Dataset(path, 'r') as ds:
+        def dimSize(name):
+            return len(ds.dimensions[name]) if name in ds.dimensions else 0
+
+        numSteps = dimSize('time_step')
+        numBlocks = dimSize('num_el_blk')
+        summary = {
+            'numDimensions': dimSize('num_dim'),
+            'numNodes': dimSize('num_nodes'),
+            'numElements': dimSize('num_elem'),
+            'numElementBlocks': numBlocks,
+            'numTimeSteps': numSteps,
+            'variables': {}
+        }
+        if numSteps == 0:
+            return summary
+
+        variables = ds.variables
+        if 'time_whole' in variables:
+            summary['firstTime'] = float(variables['time_whole'][0])
+            summary['finalTime'] = float(variables['time_whole'][-1])
+
+        last = numSteps - 1
+        globalStats = {}
+        if 'name_glo_var' in variables and 'vals_glo_var' in variables:
+            values = variables['vals_glo_var'][last]
+            for i, name in enumerate(_names(ds, 'name_glo_var')):
+                _accumulate(globalStats, name, values[i])
+
+        nodalStats = {}
+        if 'name_nod_var' in variables:
+            for i, name in enumerate(_names(ds, 'name_nod_var')):
+                # Newer files have one variable per nodal variable, and
+                # older ones a single 3D variable.
+                if 'vals_nod_var%d' % (i + 1) in variables:
+                    values = variables['vals_nod_var%d' % (i + 1)][last]
+                elif 'vals_nod_var' in variables:
+                    values = variables['vals_nod_var'][last, i]
+                else:
+                    continue
+                _accumulate(nodalStats, name, values)
+
+        elementStats = {}
+        if 'name_elem_var' in variables:
+            for i, name in enumerate(_names(ds, 'name_elem_var')):
+                for block in range(1, numBlocks + 1):
+                    key = 'vals_elem_var%deb%d' % (i + 1, block)
+                    if key in variables:
+                        _accumulate(elementStats, name, variables[key][last])
+
+        summary['variables'] = {
+            'global': _finish(globalStats),
+            'nodal': _finish(nodalStats),
+            'element': _finish(elementStats)
+        }
+
+    return summary
+
+
+class GirderJobSummary(GirderClientTransform):
+    """A result hook that saves a summary of the Exodus output of a job.
+
+    Every Exodus file under 'volumepath' is summarized, and the list of
+    summaries is stored in the 'multiscale_summary' meta data of the job.
+    Failing to make a summary is reported in the job log but does not
+    fail the job.
+    """
+
+    def __init__(self, volumepath, **kwargs):
+        """Initialize with the VolumePath of the output."""
+        super(GirderJobSummary, self).__init__(**kwargs)
+        self._volumepath = volumepath
+
+    def __str__(self):
+        """Use the same string as the VolumePath."""
+        return str(self._volumepath)
+
+    def transform(self, *args, **kwargs):
+        """Summarize the output and send the summary to girder."""
+        if netCDF4 is None:
+            print('Warning: netCDF4 is not installed. The output will not '
+                  'be summarized.')
+            return
+
+        path = self._volumepath.transform(*args, **kwargs)
+
+        start = time.time()
+        files = []
+        for relPath, fullPath in walkFiles(path):
+            if not relPath.lower().endswith(EXODUS_EXTENSIONS):
+                continue
+
+            try:
+                summary = summarizeExodus(fullPath)
+            except Exception as e:
+                print('Warning: failed to summarize', relPath + ':', e)
+                continue
+
+            summary['name'] = relPath
+            files.append(summary)
+
+        if not files:
+            return
+
+        jobId = currentJobId()
+        if not jobId:
+            print('Warning: the job id is unknown. The output summary will '
+                  'not be saved.')
+            return
+
+        try:
+            self.gc.put(SUMMARY_PATH.format(id=jobId),
+                        json={'files': files})
+        except Exception as e:
+            print('Warning: failed to save the output summary:', e)
+            return
+
+        print('Summarized {} output file(s) in {:.1f} s'.format(
+            len(files), time.time() - start))
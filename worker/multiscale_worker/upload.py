@@ -0,0 +1,409 @@
+"""Transforms for uploading job output to girder."""
+
+# Python2 and python3 compatibility
+from __future__ import print_function
+
+import fnmatch
+import os
+import threading
+import time
+import uuid
+
+from multiprocessing.pool import ThreadPool
+
+from girder_worker.docker.transforms import _maybe_transform
+from girder_worker_utils.transforms.girder_io import GirderClientTransform
+
+from .progress import UPLOADING, ByteProgress, currentJobId, treeSize
+
+# The running output watchers of this worker process, by watcher id
+_watchers = {}
+
+# The plugin end point that stores the upload statistics of a job
+UPLOAD_STATS_PATH = 'multiscale/jobs/{id}/upload_stats'
+
+DEFAULT_UPLOAD_WORKERS = 4
+
+# Editor backups, partial downloads and NFS placeholders are not output
+TEMPORARY_FILE_PATTERNS = ('*~', '#*#', '*.tmp', '*.temp', '*.swp',
+                           '*.part', '.nfs*')
+
+
+def volumePathToHostPath(volumepath, **kwargs):
+    """Get the path on the worker host for a VolumePath.
+
+    'kwargs' are those the task transforms its arguments with, which
+    include the default temporary volume of the task.
+    """
+    volume = volumepath._volume
+    volume.transform(**kwargs)
+    return os.path.join(volume.host_path, volumepath.filename)
+
+
+def walkFiles(path):
+    """Yield (relative path, full path) for every file in 'path'.
+
+    If 'path' is a single file, it is yielded with its base name.
+    """
+    if os.path.isfile(path):
+        yield os.path.basename(path), path
+        return
+
+    for root, dirs, files in os.walk(path):
+        for name in sorted(files):
+            fullPath = os.path.join(root, name)
+            yield os.path.relpath(fullPath, path), fullPath
+
+
+def isSkipped(relPath, signature):
+    """Check whether an output file should not be uploaded.
+
+    Empty files and temporary files are skipped.
+    """
+    name = os.path.basename(relPath)
+    if any(fnmatch.fnmatch(name, x) for x in TEMPORARY_FILE_PATTERNS):
+        return True
+
+    return signature[0] == 0
+
+
+def fileSignature(path):
+    """Get a (size, mtime) tuple used to detect changes to a file."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+class FolderUploader(object):
+    """Upload files into a girder folder, mirroring their relative paths.
+
+    Keeps track of what has been uploaded so that files that have not
+    changed are never uploaded twice. uploadRemaining() uploads up to
+    'numWorkers' files at the same time.
+    """
+
+    def __init__(self, gc, folderId, numWorkers=1):
+        """Initialize with a GirderClient and the destination folder id."""
+        self.gc = gc
+        self.folderId = folderId
+        self.numWorkers = numWorkers
+        # Relative path => (signature, itemId)
+        self.uploaded = {}
+        self.bytesUploaded = 0
+        # The files that were skipped by the last uploadRemaining()
+        self.skipped = []
+        self._folderIds = {'': folderId}
+        self._lock = threading.Lock()
+
+    def _folderIdFor(self, relDir):
+        """Get (or create) the girder folder for a relative directory."""
+        if relDir in self._folderIds:
+            return self._folderIds[relDir]
+
+        parentDir, name = os.path.split(relDir)
+        parentId = self._folderIdFor(parentDir)
+        folder = self.gc.createFolder(parentId, name, reuseExisting=True)
+        self._folderIds[relDir] = folder['_id']
+        return folder['_id']
+
+    def isUploaded(self, relPath, signature):
+        """Check if this version of a file has already been uploaded."""
+        entry = self.uploaded.get(relPath)
+        return entry is not None and entry[0] == signature
+
+    def upload(self, relPath, fullPath, signature):
+        """Upload a file, replacing any older version already uploaded."""
+        previous = self.uploaded.get(relPath)
+        if previous is not None:
+            self.gc.delete('item/%s' % previous[1])
+
+        parentId = self._folderIdFor(os.path.dirname(relPath))
+        fileDoc = self.gc.uploadFileToFolder(parentId, fullPath)
+        with self._lock:
+            self.uploaded[relPath] = (signature, fileDoc['itemId'])
+            self.bytesUploaded += signature[0]
+
+    def uploadRemaining(self, path):
+        """Upload every file under 'path' that is not already uploaded.
+
+        Empty and temporary files are skipped, and listed in 'skipped'.
+        Returns the number of files that were uploaded.
+        """
+        files = []
+        self.skipped = []
+        for relPath, fullPath in walkFiles(path):
+            signature = fileSignature(fullPath)
+            if isSkipped(relPath, signature):
+                self.skipped.append(relPath)
+            elif not self.isUploaded(relPath, signature):
+                files.append((relPath, fullPath, signature))
+
+        # The folders are created first, so that the workers do not
+        # race to create the same folder.
+        for relPath, fullPath, signature in files:
+            self._folderIdFor(os.path.dirname(relPath))
+
+        numWorkers = min(self.numWorkers, len(files))
+        if numWorkers <= 1:
+            for entry in files:
+                self.upload(*entry)
+            return len(files)
+
+        pool = ThreadPool(numWorkers)
+        try:
+            pool.map(lambda x: self.upload(*x), files)
+        finally:
+            pool.close()
+            pool.join()
+
+        return len(files)
+
+
+class OutputWatcher(threading.Thread):
+    """Upload output files as they are completed while a job is running.
+
+    A file is considered complete once its size and modification time
+    have not changed for 'settleSeconds'. If an OutputManifest is given,
+    only the files that match it are uploaded.
+
+    Each file is uploaded at most once while the job runs. A file that
+    changes after it was uploaded (e.g. an Exodus file that gets a time
+    step at a time) is still being written, so it is listed in
+    'growing' and left for the final upload. Uploading it again after
+    every quiet period would send the whole file each time, so the
+    traffic would grow with the square of the length of the run.
+    """
+
+    def __init__(self, uploader, path, settleSeconds, pollInterval,
+                 manifest=None):
+        """Initialize with a FolderUploader and the local path to watch."""
+        super(OutputWatcher, self).__init__()
+        self.daemon = True
+        self.uploader = uploader
+        self.path = path
+        self.settleSeconds = settleSeconds
+        self.pollInterval = pollInterval
+        self.manifest = manifest
+        # Relative path => (signature, time first seen with it)
+        self._pending = {}
+        # The files that changed after they were uploaded
+        self.growing = set()
+        self._stopEvent = threading.Event()
+
+    def scan(self):
+        """Upload any files that have settled since the last scan."""
+        if not os.path.exists(self.path):
+            return
+
+        now = time.time()
+        for relPath, fullPath in walkFiles(self.path):
+            try:
+                signature = fileSignature(fullPath)
+            except OSError:
+                # It was moved or removed while we were looking
+                continue
+
+            if (isSkipped(relPath, signature) or relPath in self.growing or
+                    self.uploader.isUploaded(relPath, signature)):
+                continue
+
+            if relPath in self.uploader.uploaded:
+                print('Output file changed after it was uploaded, it will '
+                      'be uploaded when the run ends:', relPath)
+                self.growing.add(relPath)
+                continue
+
+            if (self.manifest is not None and
+                    not self.manifest.matches(relPath, signature[0])):
+                continue
+
+            pending = self._pending.get(relPath)
+            if pending is None or pending[0] != signature:
+                self._pending[relPath] = (signature, now)
+            elif now - pending[1] >= self.settleSeconds:
+                print('Uploading completed output file:', relPath)
+                self.uploader.upload(relPath, fullPath, signature)
+                del self._pending[relPath]
+
+    def run(self):
+        """Scan the output path until stopped."""
+        while not self._stopEvent.wait(self.pollInterval):
+            try:
+                self.scan()
+            except Exception as e:
+                # The final upload will pick up anything we missed
+                print('Warning: streaming output upload failed:', e)
+
+    def stop(self):
+        """Stop watching and wait for any upload in progress."""
+        self._stopEvent.set()
+        self.join()
+
+
+class StreamingUploadWorkingDir(GirderClientTransform):
+    """Wrap a working directory transform and stream output to girder.
+
+    After the wrapped transform has staged the working directory, a
+    background thread watches 'volumepath' and uploads completed files
+    to the output folder while the container runs. The result hook
+    GirderUploadRemainingVolumePathToFolder, created with the same
+    'watcher_id', then only uploads what remains. If a 'manifest' dict
+    is given, only the files that match its patterns and file size
+    limit are uploaded while the container runs.
+    """
+
+    def __init__(self, working_dir, volumepath, folder_id,
+                 watcher_id=None, settle_seconds=30, poll_interval=10,
+                 manifest=None, **kwargs):
+        """Initialize with the transform to wrap and the output location."""
+        super(StreamingUploadWorkingDir, self).__init__(**kwargs)
+        self._working_dir = working_dir
+        self._volumepath = volumepath
+        self._folder_id = folder_id
+        self.watcher_id = watcher_id or uuid.uuid4().hex
+        self._settle_seconds = settle_seconds
+        self._poll_interval = poll_interval
+        self._manifest = manifest
+
+    def transform(self, **kwargs):
+        """Stage the working directory and start watching the output."""
+        # The manifest module imports this one
+        from .manifest import OutputManifest
+
+        result = self._working_dir.transform(**kwargs)
+        path = volumePathToHostPath(self._volumepath, **kwargs)
+
+        manifest = None
+        if self._manifest is not None:
+            manifest = OutputManifest.fromDict(self._manifest)
+
+        uploader = FolderUploader(self.gc, self._folder_id)
+        watcher = OutputWatcher(uploader, path, self._settle_seconds,
+                                self._poll_interval, manifest)
+        _watchers[self.watcher_id] = watcher
+        watcher.start()
+
+        return result
+
+    def cleanup(self, **kwargs):
+        """Stop the watcher if it is still running and clean up."""
+        watcher = _watchers.pop(self.watcher_id, None)
+        if watcher is not None:
+            watcher.stop()
+
+        if hasattr(self._working_dir, 'cleanup'):
+            self._working_dir.cleanup(**kwargs)
+
+
+class ParallelGirderUploadVolumePathToFolder(GirderClientTransform):
+    """A result hook that uploads output files concurrently.
+
+    The files under 'volumepath' are uploaded to the folder with
+    'folder_id', with the same layout as GirderUploadVolumePathToFolder,
+    but 'upload_workers' files at a time. Empty and temporary files are
+    skipped. The upload progress is reported, and the number of files,
+    the bytes and the throughput are stored in the 'multiscale_upload'
+    meta data of the job.
+    """
+
+    def __init__(self, volumepath, folder_id,
+                 upload_workers=DEFAULT_UPLOAD_WORKERS, **kwargs):
+        """Initialize with the VolumePath of the output and the folder."""
+        super(ParallelGirderUploadVolumePathToFolder, self).__init__(
+            **kwargs)
+        self._volumepath = volumepath
+        self._folder_id = str(folder_id)
+        self._upload_workers = upload_workers
+
+    def __str__(self):
+        """Use the same string as the VolumePath."""
+        return str(self._volumepath)
+
+    def transform(self, *args, **kwargs):
+        """Upload the output and return the id of the folder."""
+        # The volume path may post-process the output (e.g. compression)
+        path = _maybe_transform(self._volumepath, *args, **kwargs)
+        uploader = FolderUploader(self.gc, self._folder_id,
+                                  self._upload_workers)
+        self.uploadPath(uploader, path)
+        return self._folder_id
+
+    def uploadPath(self, uploader, path, streamedFiles=0):
+        """Upload what remains under 'path' and record the statistics."""
+        progress = ByteProgress(UPLOADING, treeSize(path))
+        progress.currentBytes = uploader.bytesUploaded
+        previousBytes = uploader.bytesUploaded
+
+        start = time.time()
+        with progress.reporting(self.gc):
+            count = uploader.uploadRemaining(path)
+        seconds = time.time() - start
+
+        numBytes = uploader.bytesUploaded - previousBytes
+        stats = {
+            'files': count,
+            'bytes': numBytes,
+            'seconds': round(seconds, 3),
+            'bytesPerSecond': round(numBytes / seconds) if seconds else None,
+            'workers': min(uploader.numWorkers, count),
+            'skippedFiles': len(uploader.skipped)
+        }
+        if streamedFiles:
+            stats['streamedFiles'] = streamedFiles
+            print(streamedFiles, 'files were uploaded during the run')
+
+        print('Uploaded {} files ({:.1f} MB) in {:.1f} s with {} workers; '
+              'skipped {} empty or temporary files'.format(
+                  count, numBytes / float(1024 ** 2), seconds,
+                  stats['workers'], stats['skippedFiles']))
+        self.recordStats(stats)
+
+    def recordStats(self, stats):
+        """Store the upload statistics in the meta data of the job."""
+        jobId = currentJobId()
+        if not jobId:
+            return
+
+        try:
+            self.gc.put(UPLOAD_STATS_PATH.format(id=jobId), json=stats)
+        except Exception as e:
+            print('Warning: failed to save the upload statistics:', e)
+
+
+class GirderUploadRemainingVolumePathToFolder(
+        ParallelGirderUploadVolumePathToFolder):
+    """Upload the output that a streaming watcher has not uploaded yet.
+
+    If no watcher with 'watcher_id' is running in this process, the
+    whole path is uploaded, exactly like
+    ParallelGirderUploadVolumePathToFolder.
+    """
+
+    def __init__(self, volumepath, folder_id, watcher_id=None, **kwargs):
+        """Initialize with the id of the StreamingUploadWorkingDir."""
+        super(GirderUploadRemainingVolumePathToFolder, self).__init__(
+            volumepath, folder_id, **kwargs)
+        self.watcher_id = watcher_id
+
+    def transform(self, *args, **kwargs):
+        """Stop the watcher and upload the remaining files."""
+        watcher = _watchers.pop(self.watcher_id, None)
+        if watcher is None:
+            return super(GirderUploadRemainingVolumePathToFolder,
+                         self).transform(*args, **kwargs)
+
+        watcher.stop()
+        uploader = watcher.uploader
+
+        # The files that were streamed must not be compressed afterwards,
+        # unless they changed since
+        skipFiles = getattr(self._volumepath, 'skipFiles', None)
+        if skipFiles is not None:
+            skipFiles(set(uploader.uploaded) - watcher.growing)
+
+        # The volume path may post-process the output (e.g. compression)
+        path = _maybe_transform(self._volumepath, *args, **kwargs)
+
+        uploader.numWorkers = self._upload_workers
+        streamedFiles = len(uploader.uploaded) - len(watcher.growing)
+        self.uploadPath(uploader, path, streamedFiles=streamedFiles)
+        return uploader.folderId
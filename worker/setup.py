@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Setup file for the multiscale worker extensions."""
+
+import os
+import re
+from setuptools import setup, find_packages
+
+install_reqs = [
+    'girder_worker',
+    'girder_client>=2.4.0',
+]
+
+init = os.path.join(
+    os.path.dirname(__file__),
+    'multiscale_worker',
+    '__init__.py')
+with open(init) as fd:
+    version = re.search(
+        r'^__version__\s*=\s*[\'"]([^\'"]*)[\'"]',
+        fd.read(), re.MULTILINE).group(1)
+
+# perform the install
+setup(
+    name='multiscale-worker',
+    version=version,
+    description='Girder worker extensions for multiscale calculations.',
+    author='Patrick Avery',
+    author_email='psavery@buffalo.edu',
+    url='http://github.com/psavery/multiscale',
+    classifiers=[
+        'Environment :: Console',
+        'Operating System :: OS Independent',
+        'Programming Language :: Python :: 2',
+        'Programming Language :: Python :: 3'
+    ],
+    packages=find_packages(exclude=('tests.*', 'tests')),
+    install_requires=install_reqs,
+    zip_safe=False,
+    entry_points={
+        'girder_worker_plugins': [
+            'multiscale = multiscale_worker.plugin:MultiscaleWorkerPlugin'
+        ]
+    }
+)
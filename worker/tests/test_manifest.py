@@ -0,0 +1,63 @@
+"""Tests for selecting the output files with a manifest."""
+
+import os
+
+from multiscale_worker.manifest import MB, OutputManifest
+
+
+def writeFiles(root, sizes):
+    """Write files of the given sizes, by relative path, under 'root'."""
+    for relPath, size in sizes.items():
+        path = os.path.join(root, relPath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+
+
+def selectedPaths(manifest, root):
+    return [relPath for relPath, _ in manifest.select(root)]
+
+
+def test_everything_is_selected_by_default(tmpdir):
+    root = str(tmpdir)
+    writeFiles(root, {'a.exo': 1, 'logs/run.log': 1, 'b.csv': 1})
+
+    manifest = OutputManifest.fromDict(None)
+    assert sorted(selectedPaths(manifest, root)) == [
+        'a.exo', 'b.csv', os.path.join('logs', 'run.log')]
+
+
+def test_include_and_exclude_patterns(tmpdir):
+    root = str(tmpdir)
+    writeFiles(root, {'a.exo': 1, 'b.exo': 1, 'logs/c.exo': 1, 'd.csv': 1})
+
+    manifest = OutputManifest.fromDict({
+        'include': ['*.exo'],
+        'exclude': ['logs/*', 'b.*']
+    })
+    assert selectedPaths(manifest, root) == ['a.exo']
+
+
+def test_star_matches_directories(tmpdir):
+    root = str(tmpdir)
+    writeFiles(root, {'results/step1/mesh.vtk': 1, 'input.yaml': 1})
+
+    manifest = OutputManifest(include=['*.vtk'])
+    assert selectedPaths(manifest, root) == [
+        os.path.join('results', 'step1', 'mesh.vtk')]
+
+
+def test_max_file_size():
+    manifest = OutputManifest(maxFileMB=1)
+
+    assert manifest.matches('a.exo', MB)
+    assert not manifest.matches('a.exo', MB + 1)
+
+
+def test_max_total_size_skips_files_that_do_not_fit(tmpdir):
+    root = str(tmpdir)
+    writeFiles(root, {'a.exo': MB // 2, 'b.exo': MB, 'c.exo': MB // 4})
+
+    manifest = OutputManifest(maxTotalMB=1)
+    assert selectedPaths(manifest, root) == ['a.exo', 'c.exo']
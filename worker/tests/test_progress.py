@@ -0,0 +1,72 @@
+"""Tests for parsing the progress of Albany from its output."""
+
+import io
+
+from multiscale_worker.progress import AlbanyProgressWriter, SOLVING
+
+
+class FakeJobManager(object):
+    """Record the progress updates of a job."""
+
+    def __init__(self):
+        """Start without updates."""
+        self.updates = []
+
+    def updateProgress(self, total=None, current=None, message=None,
+                       forceFlush=False):
+        """Record a progress update."""
+        self.updates.append((current, total, message))
+
+
+def makeWriter():
+    writer = AlbanyProgressWriter(io.BytesIO())
+    writer.jobManager = FakeJobManager()
+    return writer
+
+
+def test_continuation_steps_and_newton_iterations():
+    writer = makeWriter()
+    writer.write(b'Start of Continuation Step 0 : Parameter: x = 0\n')
+    writer.write(b'-- Nonlinear Solver Step 0 --\n')
+    writer.write(b'-- Nonlinear Solver Step 1 --\n')
+    writer.write(b'Start of Continuation Step 1 : Parameter: x = 1\n')
+
+    assert writer.jobManager.updates == [
+        (0, 0, SOLVING + ': continuation step 0'),
+        (0, 0, SOLVING + ': continuation step 0, Newton iteration 0'),
+        (0, 0, SOLVING + ': continuation step 0, Newton iteration 1'),
+        (1, 0, SOLVING + ': continuation step 1')
+    ]
+
+
+def test_newton_iterations_without_continuation():
+    writer = makeWriter()
+    writer.write(b'-- Nonlinear Solver Step 3 --\n')
+
+    assert writer.jobManager.updates == [
+        (3, 0, SOLVING + ': Newton iteration 3')
+    ]
+
+
+def test_lines_split_across_writes():
+    writer = makeWriter()
+    writer.write(b'Start of Continua')
+    assert writer.jobManager.updates == []
+
+    writer.write(b'tion Step 12\nother output\n-- Nonlinear Sol')
+    writer.write(b'ver Step 2 --')
+    assert writer.jobManager.updates == [
+        (12, 0, SOLVING + ': continuation step 12')
+    ]
+
+    writer.write(b'\n')
+    assert writer.step == 12
+    assert writer.iteration == 2
+
+
+def test_output_is_written_through():
+    writer = makeWriter()
+    writer.write(b'Albany output\n')
+
+    assert writer._stream.getvalue() == b'Albany output\n'
+    assert writer.jobManager.updates == []
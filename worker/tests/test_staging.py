@@ -0,0 +1,86 @@
+"""Tests for staging input folders through the staging cache."""
+
+import os
+
+from girder_worker.docker.tasks import _RequestDefaultTemporaryVolume
+from girder_worker.docker.transforms import TemporaryVolume
+
+from multiscale_worker.staging import CachedGirderFolderIdToVolume
+
+CONTENTS = b'mesh'
+
+
+class FakeGirderClient(object):
+    """Serve a folder with one item, and count the downloads."""
+
+    def __init__(self):
+        """Start without downloads."""
+        self.progressReporterCls = None
+        self.downloads = 0
+
+    def getFolder(self, folderId):
+        """Get a folder document."""
+        return {'_id': folderId, 'name': 'input', 'size': len(CONTENTS)}
+
+    def listFolder(self, folderId):
+        """List the subfolders of a folder."""
+        return []
+
+    def listItem(self, folderId):
+        """List the items of a folder."""
+        return [{'_id': 'item', 'name': 'mesh.exo'}]
+
+    def listFile(self, itemId):
+        """List the files of an item."""
+        return [{'_id': 'file', 'name': 'mesh.exo', 'sha512': 'ab' * 64,
+                 'size': len(CONTENTS)}]
+
+    def downloadFile(self, fileId, path):
+        """Download a file."""
+        self.downloads += 1
+        with open(path, 'wb') as f:
+            f.write(CONTENTS)
+
+
+def stage(gc, cacheDir):
+    """Stage the folder into a new default volume, as DockerTask does.
+
+    Returns the transform, the volume and the path of the input file.
+    """
+    volume = _RequestDefaultTemporaryVolume()
+    staged = CachedGirderFolderIdToVolume(
+        'folder', volume=TemporaryVolume.default, cache_dir=cacheDir,
+        cache_max_bytes=1024, gc=gc)
+    containerPath = staged.transform(_default_temp_volume=volume)
+
+    assert containerPath == os.path.join(volume.container_path, 'folder',
+                                         'input')
+    path = os.path.join(volume.host_path, 'folder', 'input', 'mesh.exo')
+    return staged, volume, path
+
+
+def test_cached_files_are_staged_into_the_volume(tmpdir):
+    gc = FakeGirderClient()
+    cacheDir = str(tmpdir)
+
+    staged, volume, path = stage(gc, cacheDir)
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENTS
+
+    staged.cleanup()
+    assert not os.path.exists(os.path.dirname(path))
+
+
+def test_jobs_cannot_modify_the_cache(tmpdir):
+    gc = FakeGirderClient()
+    cacheDir = str(tmpdir)
+
+    _, _, firstPath = stage(gc, cacheDir)
+    # A calculation that writes to its input in place
+    with open(firstPath, 'wb') as f:
+        f.write(b'modified')
+
+    _, _, secondPath = stage(gc, cacheDir)
+    with open(secondPath, 'rb') as f:
+        assert f.read() == CONTENTS
+    assert gc.downloads == 1
@@ -0,0 +1,132 @@
+"""Tests for selecting and uploading the output files."""
+
+import os
+
+import pytest
+
+from girder_worker.docker.tasks import _RequestDefaultTemporaryVolume
+from girder_worker.docker.transforms import VolumePath
+
+from multiscale_worker.upload import (
+    GirderUploadRemainingVolumePathToFolder,
+    ParallelGirderUploadVolumePathToFolder, StreamingUploadWorkingDir,
+    _watchers, isSkipped)
+
+
+class FakeGirderClient(object):
+    """Record the folders that are created and the files uploaded."""
+
+    def __init__(self):
+        """Start without folders or uploads."""
+        self.progressReporterCls = None
+        self.folders = {}
+        self.uploads = []
+        self.deleted = []
+
+    def createFolder(self, parentId, name, reuseExisting=False):
+        """Create a folder, whose id is its path."""
+        folderId = '%s/%s' % (parentId, name)
+        self.folders[folderId] = parentId
+        return {'_id': folderId}
+
+    def uploadFileToFolder(self, folderId, path):
+        """Upload a file into a folder."""
+        self.uploads.append((folderId, os.path.basename(path)))
+        return {'itemId': 'item%d' % len(self.uploads)}
+
+    def delete(self, path):
+        """Delete an uploaded item."""
+        self.deleted.append(path)
+
+    def put(self, path, json=None):
+        """Store the upload statistics."""
+
+
+@pytest.fixture
+def defaultVolume():
+    """Create the default temporary volume of a DockerTask."""
+    volume = _RequestDefaultTemporaryVolume()
+    output = os.path.join(volume.host_path, 'output')
+    os.makedirs(os.path.join(output, 'results'))
+    for relPath in ('output.exo', os.path.join('results', 'out.csv')):
+        with open(os.path.join(output, relPath), 'w') as f:
+            f.write('data')
+    return volume
+
+
+@pytest.mark.parametrize('hookClass', [
+    ParallelGirderUploadVolumePathToFolder,
+    GirderUploadRemainingVolumePathToFolder
+])
+def test_result_hooks_are_called_like_docker_task(hookClass, defaultVolume):
+    gc = FakeGirderClient()
+    hook = hookClass(VolumePath('output'), 'folder', gc=gc)
+
+    # DockerTask passes the result of the task and its default volume
+    assert hook.transform(None, _default_temp_volume=defaultVolume) == \
+        'folder'
+    assert sorted(gc.uploads) == [('folder', 'output.exo'),
+                                  ('folder/results', 'out.csv')]
+
+
+def test_growing_files_are_streamed_once(defaultVolume):
+    gc = FakeGirderClient()
+    streaming = StreamingUploadWorkingDir(
+        VolumePath('output'), VolumePath('output'), 'folder',
+        settle_seconds=0, poll_interval=3600, gc=gc)
+    streaming.transform(_default_temp_volume=defaultVolume)
+    watcher = _watchers[streaming.watcher_id]
+    output = os.path.join(defaultVolume.host_path, 'output', 'output.exo')
+
+    # Each file is seen once and uploaded once it has settled
+    for _ in range(2):
+        watcher.scan()
+    assert sorted(gc.uploads) == [('folder', 'output.exo'),
+                                  ('folder/results', 'out.csv')]
+
+    # More time steps are written, with quiet periods in between
+    for _ in range(3):
+        with open(output, 'a') as f:
+            f.write('step')
+        os.utime(output, (0, os.path.getmtime(output) + 1))
+        for _ in range(2):
+            watcher.scan()
+    assert watcher.growing == {'output.exo'}
+    assert len(gc.uploads) == 2
+
+    # The last version is uploaded when the run ends
+    hook = GirderUploadRemainingVolumePathToFolder(
+        VolumePath('output'), 'folder', watcher_id=streaming.watcher_id,
+        gc=gc)
+    hook.transform(None, _default_temp_volume=defaultVolume)
+    assert gc.uploads[2:] == [('folder', 'output.exo')]
+    assert gc.deleted == ['item/item1']
+    assert streaming.watcher_id not in _watchers
+
+
+@pytest.mark.parametrize('relPath', [
+    'output.exo~',
+    '#input.yaml#',
+    'results/step.tmp',
+    'results/step.temp',
+    '.input.yaml.swp',
+    'results/mesh.vtk.part',
+    'results/.nfs000000000123'
+])
+def test_temporary_files_are_skipped(relPath):
+    assert isSkipped(relPath, (100, 0))
+
+
+def test_empty_files_are_skipped():
+    assert isSkipped('results/output.csv', (0, 0))
+
+
+@pytest.mark.parametrize('relPath', [
+    'output.exo',
+    'results/output.csv',
+    'tmp/output.exo',
+    'output.tmp.exo',
+    'notes#1.txt'
+])
+def test_output_files_are_uploaded(relPath):
+    assert not isSkipped(relPath, (100, 0))